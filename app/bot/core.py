@@ -3,34 +3,76 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram import Router
 from aiogram.exceptions import TelegramBadRequest
 import asyncio
-from collections import defaultdict
+import logging
+import time
 from typing import List
 
 from app.core.settings import settings
-from app.db.sqlite import get_db_connection
-from app.web.static import uploads_path
+from app.db.aio import database
+from app.db.catalog import FilmRecord, catalog
+from app.db.sqlite import on_genres_changed
+from app.bot.posters import send_poster
+from app.bot.state import ChatStateStore, RecentPicks
+from app.bot.subscriptions import SubscriptionCache
+from app.bot.users import BotUser, BotUserMiddleware, generate_referral_code, user_cache
+
+logger = logging.getLogger(__name__)
 
 router = Router()
+# Строка пользователя из users.db (с регистрацией при первом обращении) — один раз на апдейт
+router.message.middleware(BotUserMiddleware(user_cache))
+router.callback_query.middleware(BotUserMiddleware(user_cache))
+
+subscriptions = SubscriptionCache(settings.SUBS_CACHE_TTL, settings.SUBS_CACHE_NEGATIVE_TTL, settings.CHAT_STATE_MAX)
+
+# Сообщение-"контейнер" (меню/контент), которое редактируем при навигации, и эфемерные
+# сообщения (карточки фильмов и т.п.), чтобы не спамить. Память ограничена (LRU + простой)
+chat_state = ChatStateStore(settings.CHAT_STATE_MAX, settings.CHAT_STATE_IDLE_TTL, settings.CHAT_STATE_BACKEND)
+# Последние подобранные по жанру фильмы (кольцевой буфер на пользователя), чтобы не повторяться
+recent_picks = RecentPicks(settings.PICK_AVOID_REPEATS, settings.CHAT_STATE_MAX, settings.CHAT_STATE_IDLE_TTL)
+
+# Фоновые задачи бота (удаление сообщений и т.п.); держим ссылки, чтобы их не собрал GC
+_background: set[asyncio.Task] = set()
+
+# deleteMessages принимает не больше 100 id за вызов
+DELETE_BATCH = 100
+
 
-# Сообщение-"контейнер" (меню/контент) — редактируем его при навигации
-menu_message: dict[int, int] = {}
-# Эфемерные сообщения (карточки фильмов и т.п.), чтобы не спамить
-content_messages: dict[int, list[int]] = defaultdict(list)
+def spawn(coro) -> asyncio.Task:
+    """Run a coroutine in the background without awaiting it."""
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def delete_messages(bot: Bot, chat_id: int, ids: List[int]) -> None:
+    """Delete messages with bulk deleteMessages; fall back to parallel deleteMessage."""
+    for i in range(0, len(ids), DELETE_BATCH):
+        chunk = ids[i:i + DELETE_BATCH]
+        if len(chunk) > 1:
+            try:
+                await bot.delete_messages(chat_id, chunk)
+                continue
+            except Exception:
+                # Например, часть сообщений старше 48 часов — удаляем по одному что получится
+                pass
+        await asyncio.gather(*(bot.delete_message(chat_id, mid) for mid in chunk), return_exceptions=True)
 
-async def purge_content_messages(chat_id: int, bot: Bot) -> None:
-    ids = list(content_messages.get(chat_id, []))
+
+async def purge_content_messages(chat_id: int, bot: Bot, *, background: bool = False) -> None:
+    ids = chat_state.content(chat_id)
     if not ids:
         return
-    for mid in ids:
-        try:
-            await bot.delete_message(chat_id, mid)
-        except Exception:
-            pass
-    content_messages[chat_id] = []
+    # Сразу забываем id: новые эфемерные сообщения запишутся поверх, не дожидаясь удаления
+    chat_state.set_content(chat_id, [])
+    if background:
+        spawn(delete_messages(bot, chat_id, ids))
+    else:
+        await delete_messages(bot, chat_id, ids)
 
 def _main_menu_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -42,33 +84,69 @@ def _main_menu_kb() -> InlineKeyboardMarkup:
 def _back_kb() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="m_main")]])
 
-def _pick_kb() -> InlineKeyboardMarkup:
-    # Сформировать клавиатуру жанров динамически из БД (все уникальные жанры среди активных фильмов)
+# Клавиатура жанров строится из genres/film_genres и живёт в памяти до изменения жанров
+_pick_kb_cache: InlineKeyboardMarkup | None = None
+_pick_kb_generation = 0
+# Цикл событий, в котором строится клавиатура; кэш меняем только в нём
+_pick_kb_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _reset_pick_kb() -> None:
+    global _pick_kb_cache, _pick_kb_generation
+    _pick_kb_generation += 1
+    _pick_kb_cache = None
+
+
+def invalidate_pick_kb() -> None:
+    loop = _pick_kb_loop
+    try:
+        current = asyncio.get_running_loop()
+    except RuntimeError:
+        current = None
+    if loop is not None and current is not loop:
+        # Вызов из другого потока (напр. потока записи в БД) — сбрасываем кэш в цикле событий,
+        # иначе защита поколением не спасает от гонки с _pick_kb
+        loop.call_soon_threadsafe(_reset_pick_kb)
+        return
+    _reset_pick_kb()
+
+
+on_genres_changed(invalidate_pick_kb)
+
+
+def _load_active_genres(conn) -> list[tuple[int, str]]:
+    rows = conn.execute(
+        """
+        SELECT g.id, g.name FROM genres g
+        WHERE EXISTS (
+            SELECT 1 FROM film_genres fg JOIN films f ON f.id = fg.film_id
+            WHERE fg.genre_id = g.id AND f.activate = 1
+        )
+        """
+    ).fetchall()
+    return [(int(r[0]), r[1]) for r in rows]
+
+
+async def _pick_kb() -> InlineKeyboardMarkup:
+    global _pick_kb_cache, _pick_kb_loop
+    _pick_kb_loop = asyncio.get_running_loop()
+    kb = _pick_kb_cache
+    if kb is not None:
+        return kb
+    generation = _pick_kb_generation
+    # Все жанры, у которых есть хотя бы один активный фильм
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT genre FROM films
-            WHERE activate = 1 AND genre IS NOT NULL AND TRIM(genre) != ''
-        """)
-        genres_set: set[str] = set()
-        for row in cursor.fetchall():
-            raw = row[0] or ''
-            for part in raw.split(','):
-                g = part.strip()
-                if g:
-                    genres_set.add(g)
-        conn.close()
+        genres = await database.read(_load_active_genres)
     except Exception:
-        genres_set = set()
+        genres = []
 
-    genres = sorted(genres_set, key=lambda s: s.lower())
+    genres.sort(key=lambda g: g[1].lower())
     rows: list[list[InlineKeyboardButton]] = []
     if genres:
         # По 2 кнопки в ряд для компактности
         row: list[InlineKeyboardButton] = []
-        for g in genres:
-            row.append(InlineKeyboardButton(text=g, callback_data=f"gen:{g}"))
+        for gid, name in genres:
+            row.append(InlineKeyboardButton(text=name, callback_data=f"gen:{gid}"))
             if len(row) == 2:
                 rows.append(row)
                 row = []
@@ -76,10 +154,14 @@ def _pick_kb() -> InlineKeyboardMarkup:
             rows.append(row)
     # Добавим кнопку Назад в любом случае
     rows.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="m_main")])
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+    kb = InlineKeyboardMarkup(inline_keyboard=rows)
+    # Если за время сборки жанры поменялись — не кэшируем устаревший вариант
+    if generation == _pick_kb_generation:
+        _pick_kb_cache = kb
+    return kb
 
 async def _edit_menu(chat_id: int, bot: Bot, *, text: str, reply_markup: InlineKeyboardMarkup, disable_web_page_preview: bool = True) -> None:
-    mid = menu_message.get(chat_id)
+    mid = await chat_state.menu(chat_id)
     if mid:
         try:
             await bot.edit_message_text(
@@ -102,16 +184,16 @@ async def _edit_menu(chat_id: int, bot: Bot, *, text: str, reply_markup: InlineK
             pass
     # если нет сообщения меню — отправим новое и запомним
     m = await bot.send_message(chat_id, text, reply_markup=reply_markup, disable_web_page_preview=disable_web_page_preview)
-    menu_message[chat_id] = m.message_id
+    await chat_state.set_menu(chat_id, m.message_id)
 
 async def _send_menu(message: Message, bot: Bot, *, text: str, sticker: str | None = None, force_new: bool = False) -> None:
     # Удалим эфемерные сообщения, меню не трогаем
-    await purge_content_messages(message.chat.id, bot)
+    await purge_content_messages(message.chat.id, bot, background=True)
     if sticker:
         try:
             s = await bot.send_sticker(message.chat.id, sticker)
             # Стикер считаем эфемерным
-            content_messages[message.chat.id] = [s.message_id]
+            chat_state.set_content(message.chat.id, [s.message_id])
         except Exception:
             pass
     if force_new:
@@ -122,31 +204,13 @@ async def _send_menu(message: Message, bot: Bot, *, text: str, sticker: str | No
                 reply_markup=_main_menu_kb(),
                 disable_web_page_preview=True,
             )
-            menu_message[message.chat.id] = m.message_id
+            await chat_state.set_menu(message.chat.id, m.message_id)
         except Exception:
             pass
     else:
         await _edit_menu(message.chat.id, bot, text=text, reply_markup=_main_menu_kb())
 
 
-def is_user_banned(user_id: int) -> bool:
-    conn = get_db_connection('users.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT banned FROM users WHERE tg_id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return bool(user and user['banned'] == 1)
-
-
-async def _is_admin_user(user_id: int) -> bool:
-    conn = get_db_connection('users.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT admin FROM users WHERE tg_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return bool(row and row['admin'] == 1)
-
-
 def _username_from_url(url: str | None) -> str | None:
     if not url:
         return None
@@ -195,23 +259,32 @@ async def _is_member_of(bot: Bot, channel: int | str, user_id: int, url: str | N
         return False
 
 
-async def ensure_subscription(message: Message, bot: Bot, user_id: int | None = None) -> bool:
+async def ensure_subscription(message: Message, bot: Bot, user: BotUser) -> bool:
     # Нет каналов для проверки — пропускаем
     if not settings.CHANNELS:
         return True
     # Трафферам разрешаем без подписки
-    uid = user_id if user_id is not None else (message.from_user.id if message.from_user else None)
-    if uid is None:
-        return False
-    if await _is_admin_user(uid):
+    if user.admin:
         return True
-
-    # Проверяем подписку по всем каналам
-    not_joined = []
-    for name, url, cid in settings.CHANNELS:
-        ok = await _is_member_of(bot, cid, uid, url)
-        if not ok:
-            not_joined.append((name, url))
+    uid = user.tg_id
+
+    # Проверяем подписку по всем каналам (из кэша или параллельно через API)
+    started = time.perf_counter()
+    not_joined = subscriptions.get(uid)
+    source = "cache"
+    if not_joined is None:
+        source = "api"
+        results = await asyncio.gather(
+            *(_is_member_of(bot, cid, uid, url) for _, url, cid in settings.CHANNELS)
+        )
+        not_joined = [(name, url) for (name, url, _), ok in zip(settings.CHANNELS, results) if not ok]
+        subscriptions.put(uid, not_joined)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.log(
+        logging.INFO if source == "api" else logging.DEBUG,
+        "subscription gate uid=%s: %.1f ms (%s, missing %d/%d)",
+        uid, elapsed_ms, source, len(not_joined), len(settings.CHANNELS),
+    )
 
     if not not_joined:
         return True
@@ -231,47 +304,35 @@ async def ensure_subscription(message: Message, bot: Bot, user_id: int | None =
     return False
 
 
-def generate_referral_code() -> str:
-    import random, string
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-
-
-def register_user(user) -> None:
-    conn = get_db_connection('users.db')
+def _apply_referral(conn, user_id: int, referral_code: str) -> None:
     cursor = conn.cursor()
-    referral_code = generate_referral_code()
-    cursor.execute("INSERT OR IGNORE INTO users (name, tg_id, admin, referral_code) VALUES (?, ?, ?, ?)",
-                   (user.first_name, user.id, 0, referral_code))
-    conn.commit()
-    conn.close()
+    cursor.execute("SELECT referral_code, referred_by FROM users WHERE tg_id = ?", (user_id,))
+    user = cursor.fetchone()
+    if (user and user['referred_by']) or (user and user['referral_code'] == referral_code):
+        return
+    cursor.execute("SELECT tg_id FROM users WHERE referral_code = ?", (referral_code,))
+    referrer = cursor.fetchone()
+    if referrer:
+        referrer_id = referrer['tg_id']
+        cursor.execute("UPDATE users SET referred_by = ? WHERE tg_id = ?", (referral_code, user_id))
+        cursor.execute("INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (?, ?)", (referrer_id, user_id))
 
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, bot: Bot):
-    if is_user_banned(message.from_user.id):
+async def cmd_start(message: Message, bot: Bot, bot_user: BotUser):
+    if bot_user.banned:
         return
-    register_user(message.from_user)
 
     # Требование подписки
-    if not await ensure_subscription(message, bot):
+    if not await ensure_subscription(message, bot, bot_user):
         return
 
-    # Реферал
+    # Реферал (уже приглашённому или своим кодом — не пишем в базу вовсе)
     if message.text and len(message.text.split()) > 1:
         referral_code = message.text.split()[1].upper()
-        conn = get_db_connection('users.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT referral_code, referred_by FROM users WHERE tg_id = ?", (message.from_user.id,))
-        user = cursor.fetchone()
-        if not (user and user['referred_by']) and not (user and user['referral_code'] == referral_code):
-            cursor.execute("SELECT tg_id FROM users WHERE referral_code = ?", (referral_code,))
-            referrer = cursor.fetchone()
-            if referrer:
-                referrer_id = referrer['tg_id']
-                cursor.execute("UPDATE users SET referred_by = ? WHERE tg_id = ?", (referral_code, message.from_user.id))
-                cursor.execute("INSERT OR IGNORE INTO referrals (referrer_id, referred_id) VALUES (?, ?)", (referrer_id, message.from_user.id))
-                conn.commit()
-        conn.close()
+        if not bot_user.referred_by and bot_user.referral_code != referral_code:
+            await database.write(_apply_referral, bot_user.tg_id, referral_code, db_name='users.db')
+            user_cache.invalidate(bot_user.tg_id)
 
     await _send_menu(
         message,
@@ -283,85 +344,71 @@ async def cmd_start(message: Message, bot: Bot):
 
 
 @router.callback_query(F.data == "m_search")
-async def cb_search(c: CallbackQuery, bot: Bot):
-    if is_user_banned(c.from_user.id):
+async def cb_search(c: CallbackQuery, bot: Bot, bot_user: BotUser):
+    if bot_user.banned:
         return await c.answer("Доступ ограничён")
     await c.answer()
     # Требование подписки
-    if not await ensure_subscription(c.message, bot, user_id=c.from_user.id):
+    if not await ensure_subscription(c.message, bot, bot_user):
         return
     await _edit_menu(c.message.chat.id, bot, text="Введите код фильма:", reply_markup=_back_kb())
 
 
 @router.callback_query(F.data == "m_pick")
-async def cb_pick(c: CallbackQuery, bot: Bot):
-    if is_user_banned(c.from_user.id):
+async def cb_pick(c: CallbackQuery, bot: Bot, bot_user: BotUser):
+    if bot_user.banned:
         return await c.answer("Доступ ограничён")
     await c.answer()
-    if not await ensure_subscription(c.message, bot, user_id=c.from_user.id):
+    if not await ensure_subscription(c.message, bot, bot_user):
         return
-    await _edit_menu(c.message.chat.id, bot, text="Выберите жанр:", reply_markup=_pick_kb())
+    await _edit_menu(c.message.chat.id, bot, text="Выберите жанр:", reply_markup=await _pick_kb())
 
 
 @router.callback_query(F.data.startswith("gen:"))
-async def cb_genre_selected(c: CallbackQuery, bot: Bot):
-    if is_user_banned(c.from_user.id):
+async def cb_genre_selected(c: CallbackQuery, bot: Bot, bot_user: BotUser):
+    if bot_user.banned:
         return await c.answer("Доступ ограничён")
     # Требование подписки
-    if not await ensure_subscription(c.message, bot, user_id=c.from_user.id):
+    if not await ensure_subscription(c.message, bot, bot_user):
         return
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    g = c.data.split(":", 1)[1].lower().strip()
-    # Точное попадание жанра среди запятой-разделённого списка (без ложных совпадений типа Драма/Мелодрама)
-    cursor.execute(
-        """
-        SELECT * FROM films
-        WHERE activate = 1
-          AND LOWER(',' || REPLACE(COALESCE(genre, ''), ' ', '') || ',') LIKE ?
-        ORDER BY RANDOM() LIMIT 1
-        """,
-        (f"%,{g.replace(' ', '')},%",)
-    )
-    film = cursor.fetchone()
-    conn.close()
+    g = c.data.split(":", 1)[1].strip()
+    if g.isdigit():
+        genre_id = int(g)
+    else:
+        # Старые кнопки вида gen:<название жанра>
+        genre_row = await database.fetchone("SELECT id FROM genres WHERE name = ?", (g,))
+        genre_id = int(genre_row[0]) if genre_row else 0
+    await catalog.ensure_loaded()
+    recent = recent_picks.get(c.from_user.id) if settings.PICK_AVOID_REPEATS > 0 else None
+    film = catalog.random_by_genre(genre_id, exclude=recent or ())
+    if film and recent is not None:
+        recent_picks.add(c.from_user.id, film.id)
     if film:
         await send_film_info(c.message.chat.id, film, bot, context_message=c.message)
     else:
-        await _edit_menu(c.message.chat.id, bot, text="К сожалению, фильмов этого жанра пока нет.", reply_markup=_pick_kb())
+        await _edit_menu(c.message.chat.id, bot, text="К сожалению, фильмов этого жанра пока нет.", reply_markup=await _pick_kb())
     await c.answer()
 
 
-async def profile(message: Message, bot: Bot, user_id: int | None = None):
-    uid = user_id if user_id is not None else (message.from_user.id if message.from_user else None)
-    if uid is None:
-        return
-    if is_user_banned(uid):
+async def profile(message: Message, bot: Bot, user: BotUser):
+    if user.banned:
         return
     # Профиль можно показывать и без подписки — но если нужно, раскомментируйте:
-    # if not await ensure_subscription(message, bot):
+    # if not await ensure_subscription(message, bot, user):
     #     return
-    conn = get_db_connection('users.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE tg_id = ?", (uid,))
-    user = cursor.fetchone()
-    if user:
-        from html import escape
-        profile_text = (
-            f"<b>👤 Профиль</b>\n"
-            f"────────────────\n"
-            f"<b>ID:</b> <code>{escape(str(user['tg_id']))}</code>\n"
-            f"<b>Статус:</b> {'Траффер' if user['admin'] else 'Пользователь'}\n"
-        )
-        kb_buttons = []
-        if user['admin']:
-            kb_buttons.append([InlineKeyboardButton(text="🎁 Реферальная система", callback_data="ref_sys")])
-        kb_buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="m_main")])
-        kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
-        await _edit_menu(message.chat.id, bot, text=profile_text, reply_markup=kb, disable_web_page_preview=True)
-    else:
-        await _edit_menu(message.chat.id, bot, text="Произошла ошибка при получении данных профиля.", reply_markup=_main_menu_kb())
-    conn.close()
+    from html import escape
+    profile_text = (
+        f"<b>👤 Профиль</b>\n"
+        f"────────────────\n"
+        f"<b>ID:</b> <code>{escape(str(user.tg_id))}</code>\n"
+        f"<b>Статус:</b> {'Траффер' if user.admin else 'Пользователь'}\n"
+    )
+    kb_buttons = []
+    if user.admin:
+        kb_buttons.append([InlineKeyboardButton(text="🎁 Реферальная система", callback_data="ref_sys")])
+    kb_buttons.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="m_main")])
+    kb = InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+    await _edit_menu(message.chat.id, bot, text=profile_text, reply_markup=kb, disable_web_page_preview=True)
 
 
 @router.callback_query(F.data == "m_main")
@@ -376,26 +423,16 @@ async def cb_main(c: CallbackQuery, bot: Bot):
 
 
 @router.message()
-async def handle_message(message: Message, bot: Bot):
-    if is_user_banned(message.from_user.id):
+async def handle_message(message: Message, bot: Bot, bot_user: BotUser):
+    if bot_user.banned:
         return
     # Требование подписки
-    if not await ensure_subscription(message, bot):
+    if not await ensure_subscription(message, bot, bot_user):
         return
     if message.text and message.text.isdigit():
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        # Ищем по коду (основной путь) или по старому числовому id для совместимости
-        try:
-            num_id = int(message.text)
-        except ValueError:
-            num_id = -1
-        cursor.execute(
-            "SELECT * FROM films WHERE activate = 1 AND (code = ? OR id = ?)",
-            (message.text, num_id)
-        )
-        film = cursor.fetchone()
-        conn.close()
+        # Ищем по коду (основной путь) или по старому числовому id для совместимости — из памяти
+        await catalog.ensure_loaded()
+        film = catalog.lookup(message.text)
         if film:
             await send_film_info(message.chat.id, film, bot, context_message=message)
         else:
@@ -405,9 +442,11 @@ async def handle_message(message: Message, bot: Bot):
 
 
 @router.callback_query(F.data == "check_subs")
-async def cb_check_subs(c: CallbackQuery, bot: Bot):
+async def cb_check_subs(c: CallbackQuery, bot: Bot, bot_user: BotUser):
+    # Пользователь утверждает, что подписался — проверяем заново, минуя кэш
+    subscriptions.invalidate(c.from_user.id)
     try:
-        ok = await ensure_subscription(c.message, bot, user_id=c.from_user.id)
+        ok = await ensure_subscription(c.message, bot, bot_user)
         if ok:
             await c.answer("Подписка подтверждена!", show_alert=False)
             # Обновим меню без отправки новых сообщений
@@ -423,13 +462,11 @@ async def cb_check_subs(c: CallbackQuery, bot: Bot):
         await c.answer("Ошибка проверки. Попробуйте ещё раз.", show_alert=False)
 
 
-async def send_film_info(chat_id: int, film, bot: Bot, *, context_message: Message | None = None):
-    from aiogram.types import FSInputFile
-    import os
+async def send_film_info(chat_id: int, film: FilmRecord, bot: Bot, *, context_message: Message | None = None):
     # Больше не подставляем ссылку на канал из окружения
-    watch_url = film['site'] if film['site'] else None
+    watch_url = film.site or None
     kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="▶️ Смотреть", url=watch_url)]]) if watch_url else None
-    code_val = film['code'] if ('code' in film.keys() and film['code']) else film['id']
+    code_val = film.code or film.id
     # Ограничение Telegram: подпись к медиа максимум 1024 символа.
     MAX_CAPTION = 1024
 
@@ -439,9 +476,9 @@ async def send_film_info(chat_id: int, film, bot: Bot, *, context_message: Messa
             return text
         return (text[: max(0, limit - 1)].rstrip()) + "…"
 
-    name = _truncate(str(film['name'] or ''), 256)
-    genre = _truncate(str(film['genre'] or ''), 256)
-    desc = str(film['description'] or '').strip()
+    name = _truncate(film.name, 256)
+    genre = _truncate(film.genre, 256)
+    desc = film.description.strip()
 
     # Подберём максимально возможную длину описания под лимит 1024
     base_before_desc = f"🎬 Название: {name}\n🎭 Жанр: {genre}\n📝 Описание: "
@@ -462,50 +499,26 @@ async def send_film_info(chat_id: int, film, bot: Bot, *, context_message: Messa
         desc_crop = _truncate(desc, available_for_desc)
         caption = base_before_desc + desc_crop + base_after_desc
     # Чистим старые контент-сообщения (карточки)
-    await purge_content_messages(chat_id, bot)
-    if film['photo_id']:
-        file_path = os.path.join(uploads_path(), film['photo_id'])
-        if os.path.exists(file_path):
-            try:
-                m = await bot.send_photo(chat_id, FSInputFile(file_path), caption=caption, reply_markup=kb)
-                content_messages[chat_id] = [m.message_id]
-                return
-            except TelegramBadRequest as e:
-                # Перестраховка на случай превышения лимита — отправим укороченную подпись без описания
-                safe_caption = f"🎬 Название: {name}\n🎭 Жанр: {genre}\n\n🔢 Код фильма: {code_val}"
-                safe_caption = _truncate(safe_caption, MAX_CAPTION)
-                m = await bot.send_photo(chat_id, FSInputFile(file_path), caption=safe_caption, reply_markup=kb)
-                content_messages[chat_id] = [m.message_id]
-                return
+    await purge_content_messages(chat_id, bot, background=True)
+    if film.photo_id:
+        try:
+            m = await send_poster(bot, chat_id, film, caption=caption, reply_markup=kb)
+        except TelegramBadRequest:
+            # Перестраховка на случай превышения лимита — отправим укороченную подпись без описания
+            safe_caption = f"🎬 Название: {name}\n🎭 Жанр: {genre}\n\n🔢 Код фильма: {code_val}"
+            safe_caption = _truncate(safe_caption, MAX_CAPTION)
+            m = await send_poster(bot, chat_id, film, caption=safe_caption, reply_markup=kb)
+        if m:
+            chat_state.set_content(chat_id, [m.message_id])
+            return
     m = await bot.send_message(chat_id, caption, reply_markup=kb)
-    content_messages[chat_id] = [m.message_id]
+    chat_state.set_content(chat_id, [m.message_id])
 
 
 # ==== Реферальная система ====
 
-async def _render_ref_system(message: Message, bot: Bot, *, user_id: int | None = None) -> None:
-    chat_id = message.chat.id
-    uid = user_id if user_id is not None else (message.from_user.id if message.from_user else None)
-    if uid is None:
-        return
-    conn = get_db_connection('users.db')
+def _load_referrals(conn, uid: int):
     cursor = conn.cursor()
-    cursor.execute("SELECT referral_code FROM users WHERE tg_id = ?", (uid,))
-    row = cursor.fetchone()
-    if not row:
-        conn.close()
-        await _edit_menu(message.chat.id, bot, text="Пользователь не найден в базе.", reply_markup=_main_menu_kb())
-        return
-    referral_code = row['referral_code']
-    # Если у пользователя по какой-либо причине ещё нет кода — сгенерируем и сохраним
-    if not referral_code:
-        referral_code = generate_referral_code()
-        cursor.execute("UPDATE users SET referral_code = ? WHERE tg_id = ?", (referral_code, uid))
-        conn.commit()
-    me = await bot.me()
-    from html import escape
-    ref_link = f"https://t.me/{escape(me.username)}?start={escape(str(referral_code))}"
-    # Статистика и последние приглашенные
     cursor.execute("SELECT COUNT(*) FROM referrals WHERE referrer_id = ?", (uid,))
     total = cursor.fetchone()[0]
     cursor.execute(
@@ -519,8 +532,26 @@ async def _render_ref_system(message: Message, bot: Bot, *, user_id: int | None
         """,
         (uid,),
     )
-    rows = cursor.fetchall()
-    conn.close()
+    return total, cursor.fetchall()
+
+
+async def _referral_code(user: BotUser) -> str:
+    # Если у пользователя по какой-либо причине ещё нет кода — сгенерируем и сохраним
+    if not user.referral_code:
+        referral_code = generate_referral_code()
+        await database.execute("UPDATE users SET referral_code = ? WHERE tg_id = ?", (referral_code, user.tg_id), db_name='users.db')
+        user.referral_code = referral_code
+    return user.referral_code
+
+
+async def _render_ref_system(message: Message, bot: Bot, user: BotUser) -> None:
+    uid = user.tg_id
+    referral_code = await _referral_code(user)
+    me = await bot.me()
+    from html import escape
+    ref_link = f"https://t.me/{escape(me.username)}?start={escape(str(referral_code))}"
+    # Статистика и последние приглашенные
+    total, rows = await database.read(_load_referrals, uid, db_name='users.db')
     lines = [
         "<b>🎁 Реферальная система</b>",
         "────────────────",
@@ -549,31 +580,21 @@ async def _render_ref_system(message: Message, bot: Bot, *, user_id: int | None
 
 
 @router.callback_query(F.data == "ref_sys")
-async def cb_ref_sys(c: CallbackQuery, bot: Bot):
-    uid = c.from_user.id
-    if not await _is_admin_user(uid):
+async def cb_ref_sys(c: CallbackQuery, bot: Bot, bot_user: BotUser):
+    if not bot_user.admin:
         await c.answer("Доступно только трафферам", show_alert=False)
         return
     await c.answer()
-    await _render_ref_system(c.message, bot, user_id=uid)
+    await _render_ref_system(c.message, bot, bot_user)
 
 @router.callback_query(F.data == "ref_copy")
-async def cb_ref_copy(c: CallbackQuery, bot: Bot):
+async def cb_ref_copy(c: CallbackQuery, bot: Bot, bot_user: BotUser):
     """Показать сообщение с реф. ссылкой для копирования (автокопирование в боте недоступно)."""
     try:
-        uid = c.from_user.id
-        if not await _is_admin_user(uid):
+        if not bot_user.admin:
             await c.answer("Доступно только трафферам", show_alert=False)
             return
-        conn = get_db_connection('users.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT referral_code FROM users WHERE tg_id = ?", (uid,))
-        row = cursor.fetchone()
-        conn.close()
-        if not row:
-            await c.answer("Не удалось получить ссылку", show_alert=False)
-            return
-        referral_code = row['referral_code']
+        referral_code = await _referral_code(bot_user)
         me = await bot.me()
         ref_link = f"https://t.me/{me.username}?start={referral_code}"
         m = await bot.send_message(c.message.chat.id, f"Ваша реферальная ссылка:\n<code>{ref_link}</code>")
@@ -584,22 +605,21 @@ async def cb_ref_copy(c: CallbackQuery, bot: Bot):
                 await bot.delete_message(c.message.chat.id, m.message_id)
             except Exception:
                 pass
-        asyncio.create_task(_auto_delete())
+        spawn(_auto_delete())
         await c.answer("Ссылка показана сообщением — скопируйте и отправьте друзьям", show_alert=False)
     except Exception:
         await c.answer("Ошибка. Попробуйте ещё раз", show_alert=False)
 
 @router.callback_query(F.data == "ref_refresh")
-async def cb_ref_refresh(c: CallbackQuery, bot: Bot):
-    uid = c.from_user.id
-    if not await _is_admin_user(uid):
+async def cb_ref_refresh(c: CallbackQuery, bot: Bot, bot_user: BotUser):
+    if not bot_user.admin:
         await c.answer("Доступно только трафферам", show_alert=False)
         return
     await c.answer("Обновлено")
-    await _render_ref_system(c.message, bot, user_id=uid)
+    await _render_ref_system(c.message, bot, bot_user)
 
 
 @router.callback_query(F.data == "m_profile")
-async def cb_profile(c: CallbackQuery, bot: Bot):
+async def cb_profile(c: CallbackQuery, bot: Bot, bot_user: BotUser):
     await c.answer()
-    await profile(c.message, bot, user_id=c.from_user.id)
+    await profile(c.message, bot, bot_user)
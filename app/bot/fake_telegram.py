@@ -0,0 +1,157 @@
+"""Local stand-in for the Telegram Bot API, for load-testing webhook mode.
+
+Serves Bot API methods with canned successful answers and fires synthetic
+updates at the bot's webhook. Run the bot with
+
+    BOT_MODE=webhook TELEGRAM_API_BASE=http://127.0.0.1:8081 WEBHOOK_URL= python main.py
+
+and then
+
+    python -m app.bot.fake_telegram --updates 5000 --chats 500 --rate 1000
+
+It prints how many updates the webhook accepted, how fast, and how many API
+calls the bot made back.
+"""
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+from typing import Any, Dict
+
+import aiohttp
+from aiohttp import web
+
+
+class FakeTelegram:
+    def __init__(self) -> None:
+        self.calls: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(1)
+
+    # --- Bot API side ---
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id") or 0)
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text") or params.get("caption") or "",
+        }
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        if method in ("sendmessage", "sendsticker", "editmessagetext", "copymessage"):
+            return self._message(params)
+        if method == "sendphoto":
+            msg = self._message(params)
+            msg["photo"] = [{"file_id": f"fake-{msg['message_id']}", "file_unique_id": f"u{msg['message_id']}", "width": 500, "height": 750}]
+            return msg
+        if method == "getchatmember":
+            return {"status": "member", "user": {"id": int(params.get("user_id") or 0), "is_bot": False, "first_name": "u"}}
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    # --- update side ---
+    def update(self, chat_id: int) -> Dict[str, Any]:
+        user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+        if random.random() < 0.5:
+            return {
+                "update_id": next(self._update_ids),
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": user,
+                    "text": "/start",
+                },
+            }
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": user,
+                "chat_instance": str(chat_id),
+                "data": random.choice(["m_main", "m_pick", "m_profile"]),
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": "menu",
+                },
+            },
+        }
+
+
+async def _fire(fake: FakeTelegram, url: str, secret: str, total: int, chats: int, rate: float) -> None:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    statuses: Counter = Counter()
+    latencies = []
+    sem = asyncio.Semaphore(100)
+
+    async def one(session: aiohttp.ClientSession) -> None:
+        async with sem:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=fake.update(random.randint(1, chats)), headers=headers) as r:
+                    statuses[r.status] += 1
+            except aiohttp.ClientError:
+                statuses["error"] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        pending = []
+        for i in range(total):
+            pending.append(asyncio.create_task(one(session)))
+            if rate > 0:
+                await asyncio.sleep(max(0.0, started + (i + 1) / rate - time.perf_counter()))
+        await asyncio.gather(*pending)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def p(q: float) -> float:
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+
+    print(f"updates: {total} за {elapsed:.2f}s ({total / elapsed:.0f}/s), ответы: {dict(statuses)}")
+    print(f"задержка ответа webhook: p50={p(0.5):.1f}ms p99={p(0.99):.1f}ms")
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--listen", default="127.0.0.1:8081", help="где поднять заглушку Bot API")
+    ap.add_argument("--webhook", default="http://127.0.0.1:5555/tg/webhook", help="адрес webhook бота")
+    ap.add_argument("--secret", default="", help="WEBHOOK_SECRET бота")
+    ap.add_argument("--updates", type=int, default=1000)
+    ap.add_argument("--chats", type=int, default=100)
+    ap.add_argument("--rate", type=float, default=0, help="апдейтов в секунду (0 — без ограничения)")
+    ap.add_argument("--settle", type=float, default=3, help="сколько ждать ответных вызовов бота, с")
+    args = ap.parse_args()
+
+    fake = FakeTelegram()
+    app = web.Application()
+    app.router.add_route("*", "/bot{token}/{method}", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    host, port = args.listen.rsplit(":", 1)
+    await web.TCPSite(runner, host, int(port)).start()
+    try:
+        await _fire(fake, args.webhook, args.secret, args.updates, args.chats, args.rate)
+        await asyncio.sleep(args.settle)
+        print(f"вызовы Bot API: {sum(fake.calls.values())} {dict(fake.calls.most_common(8))}")
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
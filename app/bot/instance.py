@@ -1,7 +1,24 @@
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 
+from app.bot.outbound import OutboundScheduler
 from app.core.settings import settings
 
-bot = Bot(token=settings.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# Свой адрес Bot API (локальный сервер или заглушка для тестов)
+_session = AiohttpSession(api=TelegramAPIServer.from_base(settings.TELEGRAM_API_BASE)) if settings.TELEGRAM_API_BASE else None
+
+bot = Bot(token=settings.BOT_TOKEN, session=_session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+
+# Все исходящие вызовы идут через общий планировщик лимитов Telegram
+outbound = OutboundScheduler(
+    global_rate=settings.TG_GLOBAL_RATE,
+    chat_rate=settings.TG_CHAT_RATE,
+    chat_burst=settings.TG_CHAT_BURST,
+    group_rate=settings.TG_GROUP_RATE,
+    max_chats=settings.CHAT_STATE_MAX,
+    bulk_rate=settings.TG_BULK_RATE,
+)
+bot.session.middleware(outbound)
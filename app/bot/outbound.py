@@ -0,0 +1,180 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.bot.state import BoundedLRU
+from app.core.ratelimit import TokenBucket
+
+# Правки, из которых важна только последняя (по ключу метод + чат + сообщение)
+_COALESCED = {"editMessageText", "editMessageReplyMarkup", "editMessageCaption", "editMessageMedia"}
+# Не отправляют сообщений — в лимиты чата и общий лимит не входят и не ждут за рассылкой
+_UNPACED = {"getChat", "getChatMember", "getChatAdministrators", "getChatMemberCount", "deleteMessage", "deleteMessages"}
+
+# Вызовы массовых задач (рассылка, прогрев постеров); см. OutboundScheduler.bulk()
+_bulk: ContextVar[bool] = ContextVar("outbound_bulk", default=False)
+
+
+class _PendingEdit:
+    __slots__ = ("method", "future")
+
+    def __init__(self, method) -> None:
+        self.method = method
+        self.future: "asyncio.Future[Any]" = asyncio.get_running_loop().create_future()
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Paces every Bot API call that the shared Bot makes.
+
+    Installed as an aiogram request middleware, so send_photo,
+    edit_message_text, delete_message, etc. all pass through it. Calls wait
+    for a per-chat token bucket (private chats and groups have separate
+    rates) and then for the global bucket. A 429 pauses only that chat, or
+    every chat if it has no chat_id, for retry_after seconds, and then the
+    call is retried. A chat keeps at most one waiting edit per message: a
+    newer edit replaces its content, so only the latest text is sent, and
+    all callers get the result of that one request.
+
+    Calls made inside `with scheduler.bulk():` first pass a separate bucket
+    whose rate is kept below the global one, so mass sends never take the
+    whole global budget and replies to users don't queue behind them. Reads
+    and deletes (_UNPACED) skip the buckets altogether.
+    """
+
+    RETRIES = 3
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, max_chats: int = 100000, bulk_rate: float = 20) -> None:
+        self._global = TokenBucket(global_rate, capacity=max(1.0, global_rate))
+        # Без запаса: массовые отправки не выбирают разом весь burst общего лимита
+        self._bulk = TokenBucket(min(bulk_rate, global_rate) if global_rate > 0 else bulk_rate, capacity=1.0)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._chats: BoundedLRU[Any, TokenBucket] = BoundedLRU(max_chats, 3600)
+        self._paused: Dict[Any, float] = {}
+        self._edits: Dict[Tuple[str, Any, Any], _PendingEdit] = {}
+        self._waits: Deque[float] = deque(maxlen=1000)
+        self.sent = 0
+        self.coalesced = 0
+        self.retry_after = 0
+        self.max_wait = 0.0
+
+    def _bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id — группа/канал: там лимит ~20 сообщений в минуту
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            rate = self._group_rate if is_group else self._chat_rate
+            bucket = TokenBucket(rate, capacity=self._chat_burst if not is_group else max(1.0, rate))
+            self._chats.put(chat_id, bucket)
+        return bucket
+
+    @contextmanager
+    def bulk(self) -> Iterator[None]:
+        """Mark calls made in this context (and tasks started from it) as bulk traffic."""
+        token = _bulk.set(True)
+        try:
+            yield
+        finally:
+            _bulk.reset(token)
+
+    def _pause(self, chat_id: Any, seconds: float) -> None:
+        now = time.monotonic()
+        # Заодно выбрасываем истёкшие паузы чатов, которые больше ничего не отправляли
+        for key in [k for k, until in self._paused.items() if until <= now]:
+            del self._paused[key]
+        self._paused[chat_id] = now + seconds
+
+    async def _wait_paused(self, chat_id: Any) -> None:
+        while True:
+            now = time.monotonic()
+            until = max(self._paused.get(chat_id, 0.0), self._paused.get(None, 0.0))
+            if until <= now:
+                # Пауза истекла — запись больше не нужна
+                if self._paused.get(chat_id, now) <= now:
+                    self._paused.pop(chat_id, None)
+                return
+            await asyncio.sleep(until - now)
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        chat_id = getattr(method, "chat_id", None)
+        edit = key = None
+        if name in _COALESCED and chat_id is not None:
+            key = (name, chat_id, getattr(method, "message_id", None))
+            pending = self._edits.get(key)
+            if pending is not None:
+                # Правка этого сообщения уже ждёт очереди — она отправит наш вариант
+                pending.method = method
+                self.coalesced += 1
+                return await asyncio.shield(pending.future)
+            edit = self._edits[key] = _PendingEdit(method)
+        started = time.monotonic()
+        try:
+            for attempt in range(self.RETRIES + 1):
+                await self._wait_paused(chat_id)
+                if name not in _UNPACED:
+                    if chat_id is not None:
+                        await self._bucket(chat_id).acquire()
+                    if _bulk.get():
+                        await self._bulk.acquire()
+                    await self._global.acquire()
+                if attempt == 0:
+                    self._record_wait(time.monotonic() - started)
+                if edit is not None:
+                    # С этого момента правки, пришедшие позже, встают в очередь заново
+                    if self._edits.get(key) is edit:
+                        del self._edits[key]
+                    method = edit.method
+                try:
+                    result = await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    self.retry_after += 1
+                    if attempt == self.RETRIES:
+                        raise
+                    self._pause(chat_id, e.retry_after)
+                    if edit is not None:
+                        if key in self._edits:
+                            # Пока ждали, пришла правка новее — отправится она
+                            edit.future.set_result(True)
+                            return True
+                        self._edits[key] = edit
+                    continue
+                self.sent += 1
+                if edit is not None:
+                    edit.future.set_result(result)
+                return result
+        except BaseException as e:
+            if edit is not None and not edit.future.done():
+                if self._edits.get(key) is edit:
+                    del self._edits[key]
+                if isinstance(e, asyncio.CancelledError):
+                    edit.future.cancel()
+                else:
+                    edit.future.set_exception(e)
+                    # Ждущих может и не быть — не даём asyncio ругаться на «потерянную» ошибку
+                    edit.future.exception()
+            raise
+
+    def _record_wait(self, wait: float) -> None:
+        self._waits.append(wait)
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+
+        def pct(q: float) -> float:
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else 0.0
+
+        return {
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retry_after": self.retry_after,
+            "wait_ms": {"p50": pct(0.5), "p95": pct(0.95), "p99": pct(0.99), "max": round(self.max_wait * 1000, 1)},
+        }
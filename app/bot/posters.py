@@ -0,0 +1,42 @@
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InlineKeyboardMarkup, Message
+
+from app.db.catalog import FilmRecord, catalog
+from app.web.static import uploads_path
+
+
+async def send_poster(
+    bot: Bot,
+    chat_id: int,
+    film: FilmRecord,
+    *,
+    caption: str | None = None,
+    reply_markup: InlineKeyboardMarkup | None = None,
+) -> Message | None:
+    """Отправить постер фильма, по возможности по сохранённому file_id.
+
+    Файл выгружается в Telegram только при первом показе (или если file_id
+    устарел); полученный file_id сохраняется в films.telegram_file_id.
+    Возвращает None, если у фильма нет файла постера.
+    """
+    if film.file_id:
+        try:
+            return await bot.send_photo(chat_id, film.file_id, caption=caption, reply_markup=reply_markup)
+        except TelegramBadRequest as e:
+            # Ошибки подписи и т.п. пробрасываем — с файлом всё в порядке
+            if "file" not in str(e).lower():
+                raise
+            # file_id недействителен — забываем и выгружаем файл заново
+            await catalog.set_file_id(film, None)
+    if not film.photo_id:
+        return None
+    file_path = os.path.join(uploads_path(), film.photo_id)
+    if not os.path.exists(file_path):
+        return None
+    m = await bot.send_photo(chat_id, FSInputFile(file_path), caption=caption, reply_markup=reply_markup)
+    if m.photo:
+        await catalog.set_file_id(film, m.photo[-1].file_id)
+    return m
@@ -0,0 +1,192 @@
+import time
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Iterable, List, Optional, TypeVar
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from app.db.aio import database
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class BoundedLRU(Generic[K, V]):
+    """Dict-like LRU: at most `maxsize` keys, a key idle for `idle_ttl` seconds is dropped.
+
+    Keys are kept in recency order, so both limits are enforced by popping
+    from the front; nothing grows with the number of chats ever seen.
+    """
+
+    def __init__(self, maxsize: int, idle_ttl: float) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.idle_ttl = idle_ttl
+        # key -> (last_seen, value)
+        self._data: "OrderedDict[K, tuple[float, V]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K) -> Optional[V]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        now = time.monotonic()
+        if self.idle_ttl > 0 and now - item[0] > self.idle_ttl:
+            del self._data[key]
+            return None
+        self._data[key] = (now, item[1])
+        self._data.move_to_end(key)
+        return item[1]
+
+    def put(self, key: K, value: V) -> None:
+        now = time.monotonic()
+        self._data[key] = (now, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        if self.idle_ttl > 0:
+            while self._data:
+                first = next(iter(self._data.values()))
+                if now - first[0] <= self.idle_ttl:
+                    break
+                self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+
+# --- SQLite backend for menu message ids (users.db, see app.db.sqlite migrations) ---
+def _load_menu(conn, chat_id: int) -> Optional[int]:
+    row = conn.execute("SELECT menu_id FROM chat_state WHERE chat_id = ?", (chat_id,)).fetchone()
+    return int(row[0]) if row else None
+
+
+def _save_menu(conn, chat_id: int, menu_id: int) -> None:
+    conn.execute(
+        """
+        INSERT INTO chat_state(chat_id, menu_id, updated_at) VALUES (?, ?, strftime('%s','now'))
+        ON CONFLICT(chat_id) DO UPDATE SET menu_id = excluded.menu_id, updated_at = excluded.updated_at
+        """,
+        (chat_id, menu_id),
+    )
+
+
+def _prune_menus(conn, max_age: float) -> None:
+    conn.execute("DELETE FROM chat_state WHERE updated_at < strftime('%s','now') - ?", (int(max_age),))
+
+
+class ChatStateStore:
+    """Per-chat UI state of the bot: the menu message and ephemeral card messages.
+
+    A chat's record is one array('q') — [menu_id, *content_ids], 0 meaning
+    "no menu" — held in a BoundedLRU. With backend="sqlite" menu ids are
+    also written through to users.db, so after a restart (or eviction) the
+    bot keeps editing the same menu message instead of sending a new one.
+    """
+
+    def __init__(self, maxsize: int, idle_ttl: float, backend: str = "memory") -> None:
+        self._records: BoundedLRU[int, array] = BoundedLRU(maxsize, idle_ttl)
+        self._idle_ttl = idle_ttl
+        self._persist = backend == "sqlite"
+        self._pruned = False
+
+    def _record(self, chat_id: int) -> Optional[array]:
+        return self._records.get(chat_id)
+
+    async def menu(self, chat_id: int) -> Optional[int]:
+        rec = self._record(chat_id)
+        if rec is not None and rec[0]:
+            return int(rec[0])
+        if not self._persist:
+            return None
+        if not self._pruned:
+            self._pruned = True
+            if self._idle_ttl > 0:
+                try:
+                    await database.write(_prune_menus, self._idle_ttl, db_name='users.db')
+                except Exception:
+                    pass
+        try:
+            mid = await database.read(_load_menu, chat_id, db_name='users.db')
+        except Exception:
+            return None
+        if mid:
+            self._put(chat_id, mid, rec[1:] if rec is not None else ())
+        return mid
+
+    async def set_menu(self, chat_id: int, menu_id: int) -> None:
+        rec = self._record(chat_id)
+        self._put(chat_id, menu_id, rec[1:] if rec is not None else ())
+        if self._persist:
+            try:
+                await database.write(_save_menu, chat_id, menu_id, db_name='users.db')
+            except Exception:
+                pass
+
+    def content(self, chat_id: int) -> List[int]:
+        rec = self._record(chat_id)
+        return list(rec[1:]) if rec is not None else []
+
+    def set_content(self, chat_id: int, ids: Iterable[int]) -> None:
+        ids = list(ids)
+        rec = self._record(chat_id)
+        menu_id = rec[0] if rec is not None else 0
+        if not menu_id and not ids:
+            self._records.pop(chat_id)
+            return
+        self._put(chat_id, menu_id, ids)
+
+    def _put(self, chat_id: int, menu_id: int, content: Iterable[int]) -> None:
+        self._records.put(chat_id, array("q", [int(menu_id or 0), *content]))
+
+
+class RecentPicks:
+    """Last `depth` film ids picked for each user, in a BoundedLRU of arrays."""
+
+    def __init__(self, depth: int, maxsize: int, idle_ttl: float) -> None:
+        self.depth = depth
+        self._picks: BoundedLRU[int, array] = BoundedLRU(maxsize, idle_ttl)
+
+    def get(self, uid: int) -> array:
+        return self._picks.get(uid) or array("q")
+
+    def add(self, uid: int, film_id: int) -> None:
+        picks = self.get(uid)
+        picks.append(film_id)
+        self._picks.put(uid, picks[-self.depth:])
+
+
+class BoundedMemoryStorage(BaseStorage):
+    """aiogram FSM storage with the same LRU/idle bounds.
+
+    Unlike MemoryStorage, reading an empty state does not create a record,
+    and a key whose state and data are both cleared is removed.
+    """
+
+    def __init__(self, maxsize: int, idle_ttl: float) -> None:
+        # key -> (state, data)
+        self._records: BoundedLRU[StorageKey, tuple[Optional[str], Dict[str, Any]]] = BoundedLRU(maxsize, idle_ttl)
+
+    def _store(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        if state is None and not data:
+            self._records.pop(key)
+        else:
+            self._records.put(key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        self._store(key, value, (self._records.get(key) or (None, {}))[1])
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (self._records.get(key) or (None, {}))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._store(key, (self._records.get(key) or (None, {}))[0], data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (self._records.get(key) or (None, {}))[1].copy()
+
+    async def close(self) -> None:
+        pass
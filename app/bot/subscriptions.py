@@ -0,0 +1,43 @@
+import time
+from typing import List, Optional, Tuple
+
+from app.bot.state import BoundedLRU
+
+NotJoined = List[Tuple[str, str]]
+
+
+class SubscriptionCache:
+    """Per-user result of the channel membership check.
+
+    A passed check is trusted for `positive_ttl` seconds, a failed one only
+    for `negative_ttl` — so a user who has just subscribed is re-checked soon
+    (or immediately via the "check_subs" button, which invalidates). At most
+    `maxsize` users are kept; the least recently seen are dropped first.
+    """
+
+    def __init__(self, positive_ttl: float, negative_ttl: float, maxsize: int = 100000) -> None:
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        # uid -> (expires_at, каналы без подписки); простаивающие дольше любого TTL тоже вытесняются
+        self._entries: BoundedLRU[int, Tuple[float, NotJoined]] = BoundedLRU(maxsize, max(positive_ttl, negative_ttl))
+
+    def get(self, uid: int) -> Optional[NotJoined]:
+        """Cached list of channels the user is missing; None on a miss."""
+        entry = self._entries.get(uid)
+        if entry is None:
+            return None
+        expires_at, not_joined = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(uid)
+            return None
+        return not_joined
+
+    def put(self, uid: int, not_joined: NotJoined) -> None:
+        ttl = self.negative_ttl if not_joined else self.positive_ttl
+        if ttl <= 0:
+            self._entries.pop(uid)
+            return
+        self._entries.put(uid, (time.monotonic() + ttl, list(not_joined)))
+
+    def invalidate(self, uid: int) -> None:
+        self._entries.pop(uid)
@@ -0,0 +1,135 @@
+import random
+import sqlite3
+import string
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from app.bot.state import BoundedLRU
+from app.core.settings import settings
+from app.db.aio import database
+
+_USER_COLUMNS = "id, tg_id, name, admin, banned, referral_code, referred_by"
+
+
+class BotUser:
+    """users.db row of the person behind the current update."""
+
+    __slots__ = ("id", "tg_id", "name", "admin", "banned", "referral_code", "referred_by")
+
+    def __init__(self, id: int, tg_id: int, name: str, admin: bool, banned: bool,
+                 referral_code: Optional[str], referred_by: Optional[str]) -> None:
+        self.id = id
+        self.tg_id = tg_id
+        self.name = name
+        self.admin = admin
+        self.banned = banned
+        self.referral_code = referral_code
+        self.referred_by = referred_by
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "BotUser":
+        return cls(
+            int(row['id']),
+            int(row['tg_id']),
+            row['name'] or '',
+            row['admin'] == 1,
+            row['banned'] == 1,
+            row['referral_code'] or None,
+            row['referred_by'] or None,
+        )
+
+
+def generate_referral_code() -> str:
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+
+
+def _load_user(conn: sqlite3.Connection, tg_id: int) -> Optional[sqlite3.Row]:
+    return conn.execute(f"SELECT {_USER_COLUMNS} FROM users WHERE tg_id = ?", (tg_id,)).fetchone()
+
+
+def _register_user(conn: sqlite3.Connection, tg_id: int, name: str) -> Optional[sqlite3.Row]:
+    # referral_code уникален: при совпадении INSERT OR IGNORE ничего не вставит — пробуем другой код
+    for _ in range(5):
+        conn.execute(
+            "INSERT OR IGNORE INTO users (name, tg_id, admin, referral_code) VALUES (?, ?, 0, ?)",
+            (name, tg_id, generate_referral_code()),
+        )
+        row = _load_user(conn, tg_id)
+        if row is not None:
+            return row
+    return None
+
+
+class UserCache:
+    """tg_id -> BotUser, trusted for `ttl` seconds.
+
+    Bounded like the chat state (LRU); the expiry is absolute, so changes
+    made outside the bot (ban, admin flag) are picked up within `ttl` even
+    for a user who keeps pressing buttons. The admin panel also drops the
+    entry right away via invalidate().
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.ttl = ttl
+        # tg_id -> (expires_at, пользователь)
+        self._entries: BoundedLRU[int, Tuple[float, BotUser]] = BoundedLRU(maxsize, ttl)
+
+    def get(self, tg_id: int) -> Optional[BotUser]:
+        entry = self._entries.get(tg_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._entries.pop(tg_id)
+            return None
+        return entry[1]
+
+    def put(self, user: BotUser) -> None:
+        if self.ttl > 0:
+            self._entries.put(user.tg_id, (time.monotonic() + self.ttl, user))
+
+    def invalidate(self, tg_id: int) -> None:
+        self._entries.pop(tg_id)
+
+    async def load(self, tg_user: User) -> BotUser:
+        """Cached row, else one read; a user seen for the first time is registered."""
+        user = self.get(tg_user.id)
+        if user is not None:
+            return user
+        row = await database.read(_load_user, tg_user.id, db_name='users.db')
+        if row is None:
+            row = await database.write(_register_user, tg_user.id, tg_user.first_name, db_name='users.db')
+            if row is None:
+                raise RuntimeError(f"Не удалось зарегистрировать пользователя {tg_user.id}")
+        user = BotUser.from_row(row)
+        self.put(user)
+        return user
+
+
+class BotUserMiddleware(BaseMiddleware):
+    """Passes the sender's BotUser to handlers as the `bot_user` argument.
+
+    Registered as an inner middleware on the router's message and callback
+    observers, so it runs once per handled update. Updates without a sender
+    (channel posts and the like) are not handled.
+    """
+
+    def __init__(self, users: UserCache) -> None:
+        self.users = users
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        tg_user: Optional[User] = data.get("event_from_user")
+        if tg_user is None:
+            return None
+        data["bot_user"] = await self.users.load(tg_user)
+        return await handler(event, data)
+
+
+user_cache = UserCache(settings.CHAT_STATE_MAX, settings.USER_CACHE_TTL)
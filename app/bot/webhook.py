@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+def _shard_key(data: Dict[str, Any]) -> int:
+    """Chat (or user) the update belongs to; updates of one chat share a worker."""
+    for key, payload in data.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat") or {}
+        if chat.get("id") is not None:
+            return int(chat["id"])
+        user = payload.get("from") or payload.get("user") or {}
+        if user.get("id") is not None:
+            return int(user["id"])
+    return int(data.get("update_id") or 0)
+
+
+class UpdateQueue:
+    """Webhook ingestion: accept raw updates immediately, handle them in the background.
+
+    The HTTP handler only calls offer(), which drops the update into one of
+    `workers` bounded queues and returns; each queue has its own handler
+    task. Updates are sharded by chat id, so one chat's updates are handled
+    in order while different chats run in parallel. When a queue is full
+    offer() returns False and the endpoint answers 503 — Telegram retries.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, maxsize: int = 10000, workers: int = 16) -> None:
+        self.dp = dp
+        self.bot = bot
+        self._workers = max(1, int(workers))
+        self._maxsize = max(1, int(maxsize) // self._workers)
+        self._queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self, url: Optional[str] = None, secret: Optional[str] = None) -> None:
+        self._queues = [asyncio.Queue(self._maxsize) for _ in range(self._workers)]
+        self._tasks = [asyncio.create_task(self._worker(q), name=f"tg-update-{i}") for i, q in enumerate(self._queues)]
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp)
+        if url:
+            await self.bot.set_webhook(
+                url,
+                secret_token=secret or None,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=100,
+            )
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        # Даём доработать уже принятым апдейтам, затем гасим обработчики
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp)
+        except Exception:
+            pass
+
+    def offer(self, data: Dict[str, Any]) -> bool:
+        if not self._queues:
+            return False
+        try:
+            self._queues[_shard_key(data) % self._workers].put_nowait(data)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": sum(q.qsize() for q in self._queues),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+        }
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            data = await queue.get()
+            try:
+                update = Update.model_validate(data, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка обработки апдейта %s", data.get("update_id"))
+            finally:
+                queue.task_done()
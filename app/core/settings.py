@@ -7,6 +7,39 @@ class Settings(BaseSettings):
     # Telegram / Bot
     BOT_TOKEN: str = os.getenv("BOT_TOKEN", "")
     CHANNELS: List[Tuple[str, str, int]] = []
+    # Служебный чат, куда заранее выгружаются постеры для получения file_id
+    POSTER_CACHE_CHAT_ID: int = int(os.getenv("POSTER_CACHE_CHAT_ID", "0"))
+    # Кэш проверки подписки на каналы (секунды): успешная / неуспешная проверка
+    SUBS_CACHE_TTL: int = int(os.getenv("SUBS_CACHE_TTL", "300"))
+    SUBS_CACHE_NEGATIVE_TTL: int = int(os.getenv("SUBS_CACHE_NEGATIVE_TTL", "20"))
+    # Сколько секунд бот доверяет закэшированной строке пользователя (бан, статус траффера)
+    USER_CACHE_TTL: int = int(os.getenv("USER_CACHE_TTL", "60"))
+    # Сколько последних подобранных фильмов не повторять пользователю (0 — не отслеживать)
+    PICK_AVOID_REPEATS: int = int(os.getenv("PICK_AVOID_REPEATS", "10"))
+    # Состояние чатов (меню, карточки, FSM): сколько чатов держать в памяти и через сколько
+    # секунд простоя забывать; "sqlite" — id сообщения-меню переживает рестарт, "memory" — нет
+    CHAT_STATE_MAX: int = int(os.getenv("CHAT_STATE_MAX", "100000"))
+    CHAT_STATE_IDLE_TTL: int = int(os.getenv("CHAT_STATE_IDLE_TTL", str(7 * 86400)))
+    CHAT_STATE_BACKEND: str = os.getenv("CHAT_STATE_BACKEND", "sqlite")
+
+    # Получение апдейтов: "polling" или "webhook" (POST на WEBHOOK_URL + WEBHOOK_PATH этого же сервера)
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    # Очередь принятых апдейтов и число обработчиков (апдейты одного чата идут по порядку)
+    WEBHOOK_QUEUE_SIZE: int = int(os.getenv("WEBHOOK_QUEUE_SIZE", "10000"))
+    WEBHOOK_WORKERS: int = int(os.getenv("WEBHOOK_WORKERS", "16"))
+    # Исходящие вызовы Bot API: общий лимит, лимит личного чата (в секунду, с запасом на всплеск)
+    # и группового чата (в секунду) — по правилам Telegram
+    TG_GLOBAL_RATE: float = float(os.getenv("TG_GLOBAL_RATE", "30"))
+    TG_CHAT_RATE: float = float(os.getenv("TG_CHAT_RATE", "1"))
+    TG_CHAT_BURST: float = float(os.getenv("TG_CHAT_BURST", "3"))
+    TG_GROUP_RATE: float = float(os.getenv("TG_GROUP_RATE", "0.33"))
+    # Доля общего лимита для массовых отправок (рассылка, прогрев постеров); остальное — ответам пользователям
+    TG_BULK_RATE: float = float(os.getenv("TG_BULK_RATE", "20"))
+    # Адрес Bot API; для нагрузочных тестов — локальная заглушка (python -m app.bot.fake_telegram)
+    TELEGRAM_API_BASE: str = os.getenv("TELEGRAM_API_BASE", "")
 
     # Web
     SECRET_KEY: str = os.getenv("SECRET_KEY", "change-me")
@@ -18,10 +51,30 @@ class Settings(BaseSettings):
     PORT: int = int(os.getenv("PORT", "5555"))
     DEBUG: bool = os.getenv("DEBUG", "false").lower() == "true"
 
+    # Database
+    DB_READERS: int = int(os.getenv("DB_READERS", "4"))
+    # Как часто пересчитывать агрегаты статистики с нуля (секунды, 0 — не пересчитывать)
+    STATS_RECONCILE_INTERVAL: int = int(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))
+
     # TMDb
     TMDB_API_KEY: str = os.getenv("TMDB_API_KEY", "")
     TMDB_LANGUAGE: str = os.getenv("TMDB_LANGUAGE", "ru-RU")
     TMDB_IMAGE_BASE: str = os.getenv("TMDB_IMAGE_BASE", "https://image.tmdb.org/t/p")
+    # Одновременных запросов к TMDb и лимит запросов в секунду (квота TMDb ~50 rps)
+    TMDB_CONCURRENCY: int = int(os.getenv("TMDB_CONCURRENCY", "8"))
+    TMDB_RATE_LIMIT: float = float(os.getenv("TMDB_RATE_LIMIT", "40"))
+    # Кэш ответов TMDb: записей в памяти, свежесть в памяти и на диске (секунды)
+    TMDB_CACHE_SIZE: int = int(os.getenv("TMDB_CACHE_SIZE", "512"))
+    TMDB_CACHE_TTL: int = int(os.getenv("TMDB_CACHE_TTL", "600"))
+    TMDB_DISK_CACHE_TTL: int = int(os.getenv("TMDB_DISK_CACHE_TTL", "86400"))
+
+    # Фоновые задачи: число параллельных обработчиков очереди
+    TASK_WORKERS: int = int(os.getenv("TASK_WORKERS", "4"))
+    # Как часто сбрасывать прогресс задач в jobs.db (секунды) и сколько завершённых задач хранить
+    JOB_FLUSH_INTERVAL: float = float(os.getenv("JOB_FLUSH_INTERVAL", "1"))
+    JOB_HISTORY: int = int(os.getenv("JOB_HISTORY", "1000"))
+    # Рассылка: сколько сообщений отправляется одновременно (темп ограничивает TG_BULK_RATE)
+    BROADCAST_CONCURRENCY: int = int(os.getenv("BROADCAST_CONCURRENCY", "25"))
 
     UPDATE_MANIFEST_URL: str = "https://update.sgorel.ovh/versions/"
 
@@ -0,0 +1,78 @@
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Optional, TypeVar
+
+from app.core.settings import settings
+from app.db.pool import pool
+
+T = TypeVar("T")
+
+
+class AsyncDatabase:
+    """Run sqlite3 work off the event loop.
+
+    Reads go to a small thread pool (each thread keeps its own pooled
+    connection), writes go to one dedicated writer thread, so in WAL mode
+    readers never wait behind a write and writers never race each other.
+    Callbacks receive the thread's connection as their first argument.
+    """
+
+    def __init__(self, readers: int = 4) -> None:
+        self._readers = max(1, int(readers))
+        self._read_executor: Optional[ThreadPoolExecutor] = None
+        self._write_executor: Optional[ThreadPoolExecutor] = None
+        self._read_slots: Optional[asyncio.Semaphore] = None
+
+    def _executors(self) -> tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+        if self._read_executor is None:
+            self._read_executor = ThreadPoolExecutor(max_workers=self._readers, thread_name_prefix="db-read")
+        if self._write_executor is None:
+            self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        return self._read_executor, self._write_executor
+
+    async def read(self, fn: Callable[..., T], *args: Any, db_name: str = 'films.db') -> T:
+        read_executor, _ = self._executors()
+        if self._read_slots is None:
+            self._read_slots = asyncio.Semaphore(self._readers)
+        loop = asyncio.get_running_loop()
+
+        def _run() -> T:
+            return fn(pool.get(db_name), *args)
+
+        async with self._read_slots:
+            return await loop.run_in_executor(read_executor, _run)
+
+    async def write(self, fn: Callable[..., T], *args: Any, db_name: str = 'films.db') -> T:
+        """Run fn inside a transaction on the single writer thread."""
+        _, write_executor = self._executors()
+        loop = asyncio.get_running_loop()
+
+        def _run() -> T:
+            conn = pool.get(db_name)
+            with conn:
+                return fn(conn, *args)
+
+        return await loop.run_in_executor(write_executor, _run)
+
+    # --- Shortcuts for one-statement queries ---
+    async def fetchone(self, sql: str, params: Iterable[Any] = (), *, db_name: str = 'films.db') -> Optional[sqlite3.Row]:
+        return await self.read(lambda conn: conn.execute(sql, tuple(params)).fetchone(), db_name=db_name)
+
+    async def fetchall(self, sql: str, params: Iterable[Any] = (), *, db_name: str = 'films.db') -> List[sqlite3.Row]:
+        return await self.read(lambda conn: conn.execute(sql, tuple(params)).fetchall(), db_name=db_name)
+
+    async def execute(self, sql: str, params: Iterable[Any] = (), *, db_name: str = 'films.db') -> int:
+        """Execute a write statement, return cursor.lastrowid."""
+        return await self.write(lambda conn: conn.execute(sql, tuple(params)).lastrowid, db_name=db_name)
+
+    def shutdown(self) -> None:
+        for ex in (self._read_executor, self._write_executor):
+            if ex is not None:
+                ex.shutdown(wait=True)
+        self._read_executor = None
+        self._write_executor = None
+        self._read_slots = None
+
+
+database = AsyncDatabase(readers=settings.DB_READERS)
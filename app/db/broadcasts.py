@@ -0,0 +1,108 @@
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.db.migrations import add_column
+
+# Получатели рассылок (jobs.db): статус по каждому tg_id, чтобы после
+# падения или рестарта задача продолжила с того же места и никому не
+# отправила сообщение дважды (кроме последней недописанной пачки).
+
+PENDING, SENT, FAILED, BLOCKED = 0, 1, 2, 3
+# Временные сбои (сеть, 5xx) оставляют получателя в PENDING; после стольких попыток — FAILED
+MAX_ATTEMPTS = 3
+
+
+def install_broadcasts(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_recipients(
+            job_id TEXT NOT NULL,
+            tg_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            PRIMARY KEY (job_id, tg_id)
+        ) WITHOUT ROWID
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_pending ON broadcast_recipients(job_id, status, user_id)")
+    # Старые задачи чистит prune_jobs(); их списки получателей уходят вместе с ними
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS jobs_broadcast_ad AFTER DELETE ON jobs
+        WHEN old.type = 'broadcast' BEGIN
+            DELETE FROM broadcast_recipients WHERE job_id = old.id;
+        END
+        """
+    )
+
+
+def add_broadcast_attempts(conn: sqlite3.Connection) -> None:
+    add_column(conn, "broadcast_recipients", "attempts", "INTEGER NOT NULL DEFAULT 0")
+
+
+def audience_page(conn: sqlite3.Connection, after: int, limit: int) -> List[Tuple[int, int]]:
+    """Keyset page of (users.id, tg_id) of users who are not banned (users.db)."""
+    rows = conn.execute(
+        """
+        SELECT id, tg_id FROM users
+        WHERE id > ? AND tg_id IS NOT NULL AND COALESCE(banned, 0) = 0
+        ORDER BY id LIMIT ?
+        """,
+        (after, limit),
+    ).fetchall()
+    return [(int(r[0]), int(r[1])) for r in rows]
+
+
+def audience_size(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("SELECT COUNT(*) FROM users WHERE tg_id IS NOT NULL AND COALESCE(banned, 0) = 0").fetchone()[0])
+
+
+def add_recipients(conn: sqlite3.Connection, job_id: str, rows: Iterable[Tuple[int, int]]) -> None:
+    conn.executemany(
+        "INSERT OR IGNORE INTO broadcast_recipients(job_id, tg_id, user_id) VALUES (?, ?, ?)",
+        [(job_id, tg_id, user_id) for user_id, tg_id in rows],
+    )
+
+
+def pending_recipients(conn: sqlite3.Connection, job_id: str, after: int, limit: int) -> List[Tuple[int, int]]:
+    """Keyset page of (user_id, tg_id) still waiting to be sent."""
+    rows = conn.execute(
+        """
+        SELECT user_id, tg_id FROM broadcast_recipients
+        WHERE job_id = ? AND status = 0 AND user_id > ?
+        ORDER BY user_id LIMIT ?
+        """,
+        (job_id, after, limit),
+    ).fetchall()
+    return [(int(r[0]), int(r[1])) for r in rows]
+
+
+def mark_recipients(conn: sqlite3.Connection, job_id: str, results: Iterable[Tuple[int, int, Optional[str]]]) -> None:
+    """Store (tg_id, status, error) results in one executemany.
+
+    PENDING means a transient failure: the attempt is counted and the
+    recipient stays pending until MAX_ATTEMPTS, then becomes FAILED.
+    """
+    conn.executemany(
+        """
+        UPDATE broadcast_recipients
+        SET status = CASE WHEN ?1 = 0 AND attempts + 1 >= ?2 THEN 2 ELSE ?1 END,
+            attempts = attempts + (?1 = 0),
+            error = ?3
+        WHERE job_id = ?4 AND tg_id = ?5
+        """,
+        [(status, MAX_ATTEMPTS, error, job_id, tg_id) for tg_id, status, error in results],
+    )
+
+
+def broadcast_progress(conn: sqlite3.Connection, job_id: str) -> Tuple[Dict[str, int], int]:
+    """({"sent", "failed", "blocked", "pending"}, last user id already enqueued)."""
+    counts = {"pending": 0, "sent": 0, "failed": 0, "blocked": 0}
+    names = {PENDING: "pending", SENT: "sent", FAILED: "failed", BLOCKED: "blocked"}
+    for status, n in conn.execute(
+        "SELECT status, COUNT(*) FROM broadcast_recipients WHERE job_id = ? GROUP BY status", (job_id,)
+    ):
+        counts[names.get(status, "failed")] += int(n)
+    cursor = conn.execute("SELECT MAX(user_id) FROM broadcast_recipients WHERE job_id = ?", (job_id,)).fetchone()[0]
+    return counts, int(cursor or 0)
@@ -0,0 +1,221 @@
+import random
+import sqlite3
+from typing import Container, Dict, Iterable, List, Optional, Tuple
+
+from app.db.aio import database
+from app.db.sqlite import notify_genres_changed
+
+_FILM_COLUMNS = "id, code, name, description, genre, site, photo_id, telegram_file_id"
+
+
+class FilmRecord:
+    """Compact in-memory copy of an active films row."""
+
+    __slots__ = ("id", "code", "name", "description", "genre", "site", "photo_id", "file_id", "genre_ids")
+
+    def __init__(self, id: int, code: Optional[str], name: str, description: str,
+                 genre: str, site: str, photo_id: Optional[str], file_id: Optional[str] = None) -> None:
+        self.id = id
+        self.code = code
+        self.name = name
+        self.description = description
+        self.genre = genre
+        self.site = site
+        self.photo_id = photo_id
+        # Telegram file_id загруженного постера; None — ещё не выгружали
+        self.file_id = file_id
+        self.genre_ids: Tuple[int, ...] = ()
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "FilmRecord":
+        return cls(
+            int(row['id']),
+            row['code'] or None,
+            row['name'] or '',
+            row['description'] or '',
+            row['genre'] or '',
+            row['site'] or '',
+            row['photo_id'] or None,
+            row['telegram_file_id'] if 'telegram_file_id' in row.keys() else None,
+        )
+
+
+class _GenreIndex:
+    """genre_id -> array of active film ids, with O(1) add/remove/random pick.
+
+    Removal swaps the last element into the freed slot, so every film's
+    position in each array is tracked in `_pos`.
+    """
+
+    __slots__ = ("_ids", "_pos")
+
+    def __init__(self) -> None:
+        self._ids: Dict[int, List[int]] = {}
+        self._pos: Dict[int, Dict[int, int]] = {}
+
+    def add(self, genre_id: int, film_id: int) -> None:
+        pos = self._pos.setdefault(genre_id, {})
+        if film_id in pos:
+            return
+        ids = self._ids.setdefault(genre_id, [])
+        pos[film_id] = len(ids)
+        ids.append(film_id)
+
+    def remove(self, genre_id: int, film_id: int) -> None:
+        pos = self._pos.get(genre_id)
+        if not pos or film_id not in pos:
+            return
+        ids = self._ids[genre_id]
+        i = pos.pop(film_id)
+        last = ids.pop()
+        if last != film_id:
+            ids[i] = last
+            pos[last] = i
+        if not ids:
+            del self._ids[genre_id]
+            del self._pos[genre_id]
+
+    def films(self, genre_id: int) -> List[int]:
+        return self._ids.get(genre_id) or []
+
+
+class FilmCatalog:
+    """Active films keyed by code, so the bot's code lookups never touch disk.
+
+    Loaded once at startup; every write path calls refresh()/remove() for the
+    rows it touched. Inactive films are simply absent from the catalog.
+    Also keeps a genre -> film ids index for constant-time random picks.
+    """
+
+    # Сколько случайных попыток делаем, чтобы обойти недавно показанные фильмы
+    PICK_ATTEMPTS = 8
+
+    def __init__(self) -> None:
+        self._by_code: Dict[str, FilmRecord] = {}
+        self._by_id: Dict[int, FilmRecord] = {}
+        self._genres = _GenreIndex()
+        self.loaded = False
+
+    # --- loading (runs on a database thread) ---
+    def _load(self, conn: sqlite3.Connection) -> None:
+        by_code: Dict[str, FilmRecord] = {}
+        by_id: Dict[int, FilmRecord] = {}
+        genres = _GenreIndex()
+        for row in conn.execute(f"SELECT {_FILM_COLUMNS} FROM films WHERE activate = 1"):
+            rec = FilmRecord.from_row(row)
+            by_id[rec.id] = rec
+            if rec.code:
+                by_code[rec.code] = rec
+        film_genres: Dict[int, List[int]] = {}
+        for film_id, genre_id in conn.execute(
+            "SELECT fg.film_id, fg.genre_id FROM film_genres fg JOIN films f ON f.id = fg.film_id WHERE f.activate = 1"
+        ):
+            film_genres.setdefault(film_id, []).append(genre_id)
+            genres.add(genre_id, film_id)
+        for film_id, gids in film_genres.items():
+            by_id[film_id].genre_ids = tuple(gids)
+        self._by_code, self._by_id, self._genres = by_code, by_id, genres
+        self.loaded = True
+
+    async def load(self) -> None:
+        await database.read(self._load)
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            await self.load()
+
+    # --- lookups ---
+    def lookup(self, text: str) -> Optional[FilmRecord]:
+        """Find by code, falling back to the legacy numeric id."""
+        rec = self._by_code.get(text)
+        if rec is None and text.isdigit():
+            rec = self._by_id.get(int(text))
+        return rec
+
+    def get_by_id(self, film_id: int) -> Optional[FilmRecord]:
+        return self._by_id.get(film_id)
+
+    def random_by_genre(self, genre_id: int, exclude: Container[int] = ()) -> Optional[FilmRecord]:
+        """Random active film of the genre, preferring ids not in `exclude`."""
+        ids = self._genres.films(genre_id)
+        if not ids:
+            return None
+        fid = random.choice(ids)
+        if exclude:
+            for _ in range(self.PICK_ATTEMPTS):
+                if fid not in exclude:
+                    break
+                fid = random.choice(ids)
+            else:
+                # Небольшой жанр почти целиком просмотрен — выбираем из оставшихся
+                if len(ids) <= self.PICK_ATTEMPTS * 8:
+                    fresh = [i for i in ids if i not in exclude]
+                    if fresh:
+                        fid = random.choice(fresh)
+        return self._by_id.get(fid)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    # --- patching ---
+    def _discard(self, film_id: int) -> Optional[FilmRecord]:
+        old = self._by_id.pop(film_id, None)
+        if old is not None:
+            if old.code and self._by_code.get(old.code) is old:
+                del self._by_code[old.code]
+            for gid in old.genre_ids:
+                self._genres.remove(gid, film_id)
+        return old
+
+    def remove(self, film_id: int) -> None:
+        if self._discard(film_id) is not None:
+            # Фильм покинул активный набор — его жанры могли исчезнуть из меню
+            notify_genres_changed()
+
+    def apply_row(self, film_id: int, row: Optional[sqlite3.Row], genre_ids: Iterable[int] = ()) -> None:
+        old = self._discard(film_id)
+        if row is None or not row['activate']:
+            if old is not None:
+                notify_genres_changed()
+            return
+        rec = FilmRecord.from_row(row)
+        rec.genre_ids = tuple(genre_ids)
+        self._by_id[rec.id] = rec
+        if rec.code:
+            self._by_code[rec.code] = rec
+        for gid in rec.genre_ids:
+            self._genres.add(gid, rec.id)
+        # Новый активный фильм или сменились его жанры — набор жанров в меню мог измениться
+        if old is None or set(old.genre_ids) != set(rec.genre_ids):
+            notify_genres_changed()
+
+    async def set_file_id(self, film: FilmRecord, file_id: Optional[str]) -> None:
+        """Remember (or forget, with None) the Telegram file_id of a film's poster."""
+        film.file_id = file_id
+        cached = self._by_id.get(film.id)
+        if cached is not None and cached is not film:
+            cached.file_id = file_id
+        await database.execute("UPDATE films SET telegram_file_id = ? WHERE id = ?", (file_id, film.id))
+
+    async def refresh(self, *film_ids: int) -> None:
+        """Re-read the given films and patch the catalog."""
+        ids = [int(i) for i in film_ids if i]
+        if not ids:
+            return
+        rows, film_genres = await database.read(_fetch_films, ids)
+        found = {int(r['id']): r for r in rows}
+        for fid in ids:
+            self.apply_row(fid, found.get(fid), film_genres.get(fid, ()))
+
+
+def _fetch_films(conn: sqlite3.Connection, ids: Iterable[int]) -> Tuple[List[sqlite3.Row], Dict[int, List[int]]]:
+    ids = list(ids)
+    marks = ",".join("?" * len(ids))
+    rows = conn.execute(f"SELECT {_FILM_COLUMNS}, activate FROM films WHERE id IN ({marks})", ids).fetchall()
+    film_genres: Dict[int, List[int]] = {}
+    for film_id, genre_id in conn.execute(f"SELECT film_id, genre_id FROM film_genres WHERE film_id IN ({marks})", ids):
+        film_genres.setdefault(film_id, []).append(genre_id)
+    return rows, film_genres
+
+
+catalog = FilmCatalog()
@@ -0,0 +1,62 @@
+import sqlite3
+from typing import List
+
+# Коды фильмов — 5 цифр (10000..99999). Вместо случайных попыток с повтором
+# выдаём их из перемешанной последовательности: n-й код = CODE_MIN + (A*n + B) mod SPACE.
+# При gcd(A, SPACE) = 1 это перестановка всего пространства, так что коды
+# не повторяются и не идут подряд. Занятые (старые случайные) коды просто
+# пропускаются; после полного круга снова доступны коды удалённых фильмов.
+
+CODE_MIN = 10000
+SPACE = 90000
+_A = 37493
+_B = 52711
+# Сколько кодов проверяем одним запросом (держимся ниже старого лимита SQLite в 999 параметров)
+PROBE_WINDOW = 500
+
+
+def _code_at(n: int) -> str:
+    return str(CODE_MIN + (_A * n + _B) % SPACE)
+
+
+def install_codes(conn: sqlite3.Connection) -> None:
+    conn.execute("CREATE TABLE IF NOT EXISTS code_seq(id INTEGER PRIMARY KEY CHECK (id = 1), next INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO code_seq(id, next) VALUES (1, 0)")
+
+
+def free_codes(conn: sqlite3.Connection) -> int:
+    """How many 5-digit codes are not taken by any film (one pass over idx_films_code)."""
+    used = conn.execute("SELECT COUNT(*) FROM films WHERE code GLOB '[1-9][0-9][0-9][0-9][0-9]'").fetchone()[0]
+    return SPACE - int(used)
+
+
+def reserve_codes(conn: sqlite3.Connection, n: int) -> List[str]:
+    """Take n unused codes from the sequence (run it inside the write transaction).
+
+    Raises RuntimeError up front when fewer than n codes are free.
+    """
+    if n <= 0:
+        return []
+    free = free_codes(conn)
+    if n > free:
+        raise RuntimeError(f"Свободных кодов фильмов не осталось: нужно {n}, свободно {free}")
+    pos = int(conn.execute("SELECT next FROM code_seq WHERE id = 1").fetchone()[0])
+    out: List[str] = []
+    while len(out) < n:
+        need = n - len(out)
+        # Окно по ожидаемой плотности занятых кодов: обычно хватает одного запроса,
+        # а при почти полном пространстве проверяем по PROBE_WINDOW за раз, а не по одному
+        window = min(PROBE_WINDOW, max(need, -(-need * SPACE // free)))
+        chunk = [_code_at(pos + i) for i in range(window)]
+        marks = ",".join("?" * len(chunk))
+        taken = {row[0] for row in conn.execute(f"SELECT code FROM films WHERE code IN ({marks})", chunk)}
+        for i, code in enumerate(chunk):
+            if code not in taken:
+                out.append(code)
+                if len(out) == n:
+                    # Непроверенный остаток окна не пропускаем — с него начнётся следующий вызов
+                    window = i + 1
+                    break
+        pos += window
+    conn.execute("UPDATE code_seq SET next = ? WHERE id = 1", (pos % SPACE,))
+    return out
@@ -0,0 +1,110 @@
+import json
+import sqlite3
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Background jobs live in their own database so progress writes never
+# contend with films.db / users.db, and jobs survive a restart.
+
+JOBS_DB = 'jobs.db'
+
+_COLUMNS = ("id", "type", "params", "status", "progress", "meta", "error", "cancel_requested", "created_at", "updated_at")
+
+
+def install_jobs(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs(
+            n INTEGER PRIMARY KEY AUTOINCREMENT,
+            id TEXT UNIQUE NOT NULL,
+            type TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL,
+            progress INTEGER NOT NULL DEFAULT 0,
+            meta TEXT NOT NULL DEFAULT '{}',
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)")
+    conn.commit()
+
+
+def job_row(job: Dict[str, Any]) -> Tuple:
+    """Serialize a job for save_jobs(); call it on the event loop, where jobs are mutated."""
+    return (
+        job["id"],
+        job["type"],
+        json.dumps(job.get("params") or {}, ensure_ascii=False),
+        job["status"],
+        int(job.get("progress") or 0),
+        json.dumps(job.get("meta") or {}, ensure_ascii=False),
+        job.get("error"),
+        1 if job.get("cancel_requested") else 0,
+        job["created_at"],
+        job["updated_at"],
+    )
+
+
+def _from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    job = {k: row[k] for k in _COLUMNS}
+    job["params"] = json.loads(job["params"] or "{}")
+    job["meta"] = json.loads(job["meta"] or "{}")
+    job["cancel_requested"] = bool(job["cancel_requested"])
+    return job
+
+
+def save_jobs(conn: sqlite3.Connection, rows: Iterable[Tuple]) -> None:
+    """Upsert job_row() tuples in one statement batch (caller owns the transaction)."""
+    conn.executemany(
+        f"""
+        INSERT INTO jobs({", ".join(_COLUMNS)}) VALUES ({", ".join("?" * len(_COLUMNS))})
+        ON CONFLICT(id) DO UPDATE SET
+            status = excluded.status,
+            progress = excluded.progress,
+            meta = excluded.meta,
+            error = excluded.error,
+            cancel_requested = excluded.cancel_requested,
+            updated_at = excluded.updated_at
+        """,
+        list(rows),
+    )
+
+
+def load_unfinished(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    rows = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE status IN ('pending', 'running') ORDER BY n").fetchall()
+    return [_from_row(r) for r in rows]
+
+
+def get_job(conn: sqlite3.Connection, job_id: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _from_row(row) if row else None
+
+
+def list_jobs(conn: sqlite3.Connection, cursor: Optional[int] = None, limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """Newest first, keyset-paginated by insertion order; returns (jobs, next_cursor)."""
+    sql = f"SELECT n, {', '.join(_COLUMNS)} FROM jobs"
+    params: List[Any] = []
+    if cursor:
+        sql += " WHERE n < ?"
+        params.append(int(cursor))
+    sql += " ORDER BY n DESC LIMIT ?"
+    params.append(limit + 1)
+    rows = conn.execute(sql, params).fetchall()
+    jobs = [_from_row(r) for r in rows[:limit]]
+    next_cursor = int(rows[limit - 1]["n"]) if len(rows) > limit else None
+    return jobs, next_cursor
+
+
+def prune_jobs(conn: sqlite3.Connection, keep: int) -> None:
+    """Drop finished jobs beyond the newest `keep` ones."""
+    conn.execute(
+        """
+        DELETE FROM jobs
+        WHERE status NOT IN ('pending', 'running')
+          AND n <= (SELECT n FROM jobs ORDER BY n DESC LIMIT 1 OFFSET ?)
+        """,
+        (max(0, int(keep)),),
+    )
@@ -0,0 +1,56 @@
+import sqlite3
+from typing import Iterable, List
+
+# Reference counts for files in uploads, keyed by films.photo_id.
+# Triggers keep them current; a file whose count drops to zero is
+# removed by MediaStore.collect_garbage().
+
+_MEDIA_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media(
+    name TEXT PRIMARY KEY,
+    refcount INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_media_released ON media(refcount) WHERE refcount <= 0;
+
+CREATE TRIGGER IF NOT EXISTS media_films_ai AFTER INSERT ON films
+WHEN COALESCE(new.photo_id, '') != '' BEGIN
+    INSERT INTO media(name, refcount) VALUES (new.photo_id, 1)
+        ON CONFLICT(name) DO UPDATE SET refcount = refcount + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS media_films_au AFTER UPDATE OF photo_id ON films
+WHEN old.photo_id IS NOT new.photo_id BEGIN
+    UPDATE media SET refcount = refcount - 1 WHERE name = old.photo_id;
+    INSERT INTO media(name, refcount) SELECT new.photo_id, 1 WHERE COALESCE(new.photo_id, '') != ''
+        ON CONFLICT(name) DO UPDATE SET refcount = refcount + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS media_films_ad AFTER DELETE ON films
+WHEN COALESCE(old.photo_id, '') != '' BEGIN
+    UPDATE media SET refcount = refcount - 1 WHERE name = old.photo_id;
+END;
+"""
+
+
+def install_media(conn: sqlite3.Connection) -> None:
+    conn.executescript(_MEDIA_SCHEMA)
+    conn.commit()
+
+
+def reconcile_media(conn: sqlite3.Connection) -> None:
+    """Recount references from films (caller owns the transaction)."""
+    conn.execute("UPDATE media SET refcount = 0")
+    conn.execute(
+        """
+        INSERT INTO media(name, refcount)
+        SELECT photo_id, COUNT(*) FROM films WHERE COALESCE(photo_id, '') != '' GROUP BY photo_id
+        ON CONFLICT(name) DO UPDATE SET refcount = excluded.refcount
+        """
+    )
+
+
+def released_media(conn: sqlite3.Connection) -> List[str]:
+    return [row[0] for row in conn.execute("SELECT name FROM media WHERE refcount <= 0")]
+
+
+def forget_media(conn: sqlite3.Connection, names: Iterable[str]) -> None:
+    """Drop rows of removed files, unless a film picked the name up again meanwhile."""
+    conn.executemany("DELETE FROM media WHERE name = ? AND refcount <= 0", [(n,) for n in names])
@@ -0,0 +1,50 @@
+import sqlite3
+from typing import Callable, Iterator, List, Sequence
+
+# Версия схемы хранится в PRAGMA user_version самого файла базы.
+# Миграция N применяется ровно один раз, после чего user_version = N, так что
+# тёплый старт — это одна проверка версии. Шаги должны быть идемпотентны:
+# прерванный шаг (или база, созданная до миграций, с версией 0) просто
+# выполняется заново.
+
+Migration = Callable[[sqlite3.Connection], None]
+
+BATCH_SIZE = 1000
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return int(conn.execute("PRAGMA user_version").fetchone()[0])
+
+
+def migrate(conn: sqlite3.Connection, steps: Sequence[Migration]) -> int:
+    """Apply the steps the database has not seen yet; return how many ran."""
+    version = schema_version(conn)
+    for n in range(version, len(steps)):
+        steps[n](conn)
+        # Версия пишется в той же транзакции, что и хвост шага
+        conn.execute(f"PRAGMA user_version = {n + 1}")
+        conn.commit()
+    return max(0, len(steps) - version)
+
+
+def add_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def batches(conn: sqlite3.Connection, sql: str, size: int = BATCH_SIZE) -> Iterator[List[sqlite3.Row]]:
+    """Keyset-paginate a backfill query, committing after each batch.
+
+    `sql` selects `id` first and must contain `id > ?` and end with
+    `ORDER BY id LIMIT ?`; the caller processes each batch before the
+    next one is read.
+    """
+    last = 0
+    while True:
+        rows = conn.execute(sql, (last, size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        conn.commit()
+        last = rows[-1][0]
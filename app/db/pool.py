@@ -0,0 +1,68 @@
+import sqlite3
+import threading
+from typing import Dict, List
+
+from app.db.search import normalize_text
+
+# Сколько подготовленных выражений sqlite3 держит в кэше на одно соединение.
+# Все запросы проекта параметризованы, так что кэш по тексту SQL срабатывает почти всегда.
+STATEMENT_CACHE_SIZE = 256
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",      # ~16 МБ страниц на соединение
+    "PRAGMA mmap_size=268435456",    # 256 МБ memory-mapped I/O
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def connect(db_name: str = 'films.db') -> sqlite3.Connection:
+    """Open a new tuned connection (WAL, relaxed fsync, statement cache)."""
+    conn = sqlite3.connect(db_name, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # Нужна триггерам поискового индекса films_fts
+    conn.create_function("kb_norm", 1, normalize_text, deterministic=True)
+    return conn
+
+
+class ConnectionPool:
+    """Long-lived connections, one per (thread, database file).
+
+    sqlite3 connections are cheap to reuse but expensive to open: every open
+    re-reads the schema and drops the page cache. Each thread gets its own
+    connection per database so there is no cross-thread locking in Python.
+    """
+
+    def __init__(self) -> None:
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all: List[sqlite3.Connection] = []
+
+    def get(self, db_name: str = 'films.db') -> sqlite3.Connection:
+        conns: Dict[str, sqlite3.Connection] | None = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        conn = conns.get(db_name)
+        if conn is None:
+            conn = connect(db_name)
+            conns[db_name] = conn
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    def close_all(self) -> None:
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._local = threading.local()
+
+
+pool = ConnectionPool()
@@ -0,0 +1,114 @@
+import sqlite3
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+
+def normalize_text(s: Any) -> str:
+    """NFKC + collapsed whitespace + casefold — form in which search text is stored."""
+    if s is None:
+        return ""
+    s = unicodedata.normalize("NFKC", str(s))
+    return " ".join(s.split()).casefold()
+
+
+def install_search(conn: sqlite3.Connection) -> None:
+    """Create the films_fts index and the triggers that keep it in step with films.
+
+    Text is normalised at write time by the kb_norm() SQL function, which
+    app.db.pool.connect() registers on every connection. The trigram
+    tokenizer gives substring matching, same as the old in-Python filter.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'films_fts'").fetchone()
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS films_fts USING fts5(name, code, description, tokenize='trigram')"
+    )
+    conn.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS films_fts_ai AFTER INSERT ON films BEGIN
+            INSERT INTO films_fts(rowid, name, code, description)
+            VALUES (new.id, kb_norm(new.name), kb_norm(new.code), kb_norm(new.description));
+        END;
+        CREATE TRIGGER IF NOT EXISTS films_fts_ad AFTER DELETE ON films BEGIN
+            DELETE FROM films_fts WHERE rowid = old.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS films_fts_au AFTER UPDATE OF name, code, description ON films BEGIN
+            DELETE FROM films_fts WHERE rowid = old.id;
+            INSERT INTO films_fts(rowid, name, code, description)
+            VALUES (new.id, kb_norm(new.name), kb_norm(new.code), kb_norm(new.description));
+        END;
+        """
+    )
+    if not exists:
+        conn.execute(
+            """
+            INSERT INTO films_fts(rowid, name, code, description)
+            SELECT id, kb_norm(name), kb_norm(code), kb_norm(description) FROM films
+            """
+        )
+    conn.commit()
+
+
+def _fts_phrase(q: str) -> str:
+    return '"' + q.replace('"', '""') + '"'
+
+
+def search_films(
+    conn: sqlite3.Connection,
+    query: str = "",
+    genre: str = "",
+    cursor: Optional[int] = None,
+    limit: int = 50,
+) -> Dict[str, Any]:
+    """Keyset-paginated film search, newest first.
+
+    Returns {"items": [...], "next_cursor": id or None}; pass next_cursor back
+    as `cursor` to get the following page. Text terms need at least 3
+    characters; 1–2 digits match code prefixes, and a numeric query also
+    matches the film with exactly that id.
+    """
+    q = normalize_text(query)
+    g = normalize_text(genre)
+    where: List[str] = []
+    params: List[Any] = []
+
+    if q:
+        if len(q) >= 3:
+            # Индексный поиск по триграммам
+            match = "f.id IN (SELECT rowid FROM films_fts WHERE films_fts MATCH ?)"
+            params.append(_fts_phrase(q))
+        elif q.isdigit():
+            # Короткий номер: префикс кода по idx_films_code ('12' -> '12' <= code < '13')
+            match = "(f.code >= ? AND f.code < ?)"
+            params.extend([q, q[:-1] + chr(ord(q[-1]) + 1)])
+        else:
+            # Триграммы не покрывают 1–2 символа, а сканировать весь каталог не будем
+            return {"items": [], "next_cursor": None}
+        if q.isdigit():
+            # ID совпадает только целиком
+            match = f"({match} OR f.id = ?)"
+            params.append(int(q))
+        where.append(match)
+
+    if g and g != "all":
+        genre_ids = [r[0] for r in conn.execute("SELECT id FROM genres WHERE kb_norm(name) = ?", (g,))]
+        if not genre_ids:
+            return {"items": [], "next_cursor": None}
+        marks = ",".join("?" * len(genre_ids))
+        where.append(f"EXISTS (SELECT 1 FROM film_genres fg WHERE fg.film_id = f.id AND fg.genre_id IN ({marks}))")
+        params.extend(genre_ids)
+
+    if cursor:
+        where.append("f.id < ?")
+        params.append(int(cursor))
+
+    limit = max(1, min(int(limit or 50), 200))
+    sql = "SELECT f.* FROM films f"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY f.id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = items[-1]["id"] if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
@@ -1,18 +1,49 @@
+import logging
 import sqlite3
-import random
-from typing import Any, Iterable, List
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.db.broadcasts import add_broadcast_attempts, install_broadcasts
+from app.db.codes import install_codes, reserve_codes
+from app.db.jobs import JOBS_DB, install_jobs
+from app.db.media import install_media, reconcile_media
+from app.db.migrations import Migration, add_column, batches, migrate
+from app.db.pool import connect
+from app.db.search import install_search
+from app.db.stats import install_film_stats, install_user_stats, reconcile_film_stats, reconcile_user_stats
+
+logger = logging.getLogger(__name__)
+
+# Подписчики на изменение набора жанров активных фильмов (напр. кэш клавиатуры бота).
+# Вызываются из каталога (app.db.catalog) в цикле событий, когда запись уже закоммичена,
+# а не из функций этого модуля, которые работают в потоке записи внутри транзакции.
+_genre_listeners: List[Callable[[], None]] = []
+
+
+def on_genres_changed(callback: Callable[[], None]) -> None:
+    """Register a callback fired after film genres or the active film set change."""
+    _genre_listeners.append(callback)
+
+
+def notify_genres_changed() -> None:
+    for cb in list(_genre_listeners):
+        try:
+            cb()
+        except Exception:
+            logger.exception("Ошибка обработчика изменения жанров %r", cb)
 
 
 def get_db_connection(db_name: str = 'films.db') -> sqlite3.Connection:
-    conn = sqlite3.connect(db_name, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Open a dedicated (non-pooled) connection; the caller must close it.
 
+    Request handlers should go through app.db.aio.database instead.
+    """
+    return connect(db_name)
 
-def init_db() -> None:
-    conn_films = get_db_connection('films.db')
-    cursor_films = conn_films.cursor()
-    cursor_films.execute("""CREATE TABLE IF NOT EXISTS films(
+
+# --- Schema migrations (см. app.db.migrations) ---
+def _films_v1_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""CREATE TABLE IF NOT EXISTS films(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT,
         description TEXT,
@@ -22,33 +53,18 @@ def init_db() -> None:
         genre TEXT,
         site TEXT
     )""")
-    # Добавляем столбец code, если его нет
-    try:
-        cursor_films.execute("ALTER TABLE films ADD COLUMN code TEXT")
-        conn_films.commit()
-    except sqlite3.OperationalError:
-        # Вероятно, столбец уже существует
-        pass
+    add_column(conn, "films", "code", "TEXT")
     # Уникальный индекс для кода
-    cursor_films.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_films_code ON films(code)")
-    conn_films.commit()
-    # Добавляем столбцы external_source / external_id
-    try:
-        cursor_films.execute("ALTER TABLE films ADD COLUMN external_source TEXT")
-        conn_films.commit()
-    except sqlite3.OperationalError:
-        pass
-    try:
-        cursor_films.execute("ALTER TABLE films ADD COLUMN external_id TEXT")
-        conn_films.commit()
-    except sqlite3.OperationalError:
-        pass
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_films_code ON films(code)")
+    add_column(conn, "films", "external_source", "TEXT")
+    add_column(conn, "films", "external_id", "TEXT")
+    # file_id постера, который вернул Telegram при первой загрузке (повторно не выгружаем файл)
+    add_column(conn, "films", "telegram_file_id", "TEXT")
     # Уникальный индекс для внешней пары (источник, внешний id)
-    cursor_films.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_films_external ON films(external_source, external_id)")
-    conn_films.commit()
-    
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_films_external ON films(external_source, external_id)")
+
     # --- Normalized genres tables ---
-    cursor_films.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS genres(
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -56,7 +72,7 @@ def init_db() -> None:
         )
         """
     )
-    cursor_films.execute(
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS film_genres(
             film_id INTEGER NOT NULL,
@@ -67,57 +83,50 @@ def init_db() -> None:
         )
         """
     )
-    cursor_films.execute("CREATE INDEX IF NOT EXISTS idx_genres_name ON genres(name)")
-    cursor_films.execute("CREATE INDEX IF NOT EXISTS idx_fg_film ON film_genres(film_id)")
-    cursor_films.execute("CREATE INDEX IF NOT EXISTS idx_fg_genre ON film_genres(genre_id)")
-    conn_films.commit()
-    # Бэкфилл кодов для существующих записей
-    cursor_films.execute("SELECT id FROM films WHERE code IS NULL OR code = ''")
-    missing = [row[0] for row in cursor_films.fetchall()]
-    if missing:
-        # Получим уже занятые коды
-        cursor_films.execute("SELECT code FROM films WHERE code IS NOT NULL AND code != ''")
-        used = {row[0] for row in cursor_films.fetchall()}
-        def gen():
-            return f"{random.randint(10000, 99999)}"
-        for fid in missing:
-            code = gen()
-            # Гарантируем уникальность в оперативном наборе
-            while code in used:
-                code = gen()
-            used.add(code)
-            cursor_films.execute("UPDATE films SET code = ? WHERE id = ?", (code, fid))
-        conn_films.commit()
-    
-    # --- One-time backfill: migrate comma-separated films.genre into normalized tables ---
-    try:
-        # Only run a lightweight sync that inserts missing mappings; safe to run idempotently
-        cursor_films.execute("SELECT id, genre FROM films")
-        rows = cursor_films.fetchall()
-        for row in rows:
-            fid = row[0]
-            gstr = (row[1] or '').strip()
-            if not gstr:
-                continue
-            # Split by comma/semicolon and trim
-            parts = [p.strip() for p in __import__('re').split(r"[,;]", gstr) if p.strip()]
-            if not parts:
-                continue
-            # Insert genres and mappings if absent
-            for g in parts:
-                gid = upsert_genre(conn_films, g)
-                cursor_films.execute("INSERT OR IGNORE INTO film_genres(film_id, genre_id) VALUES(?, ?)", (fid, gid))
-        conn_films.commit()
-    except Exception:
-        # Do not fail init if backfill has issues; it's safe to skip
-        pass
-
-    conn_films.commit()
-    conn_films.close()
-
-    conn_users = get_db_connection('users.db')
-    cursor_users = conn_users.cursor()
-    cursor_users.execute("""CREATE TABLE IF NOT EXISTS users(
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_genres_name ON genres(name)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fg_film ON film_genres(film_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fg_genre ON film_genres(genre_id)")
+
+
+def _films_v2_codes(conn: sqlite3.Connection) -> None:
+    # Бэкфилл кодов для записей, созданных до появления столбца code
+    install_codes(conn)
+    for rows in batches(conn, "SELECT id FROM films WHERE (code IS NULL OR code = '') AND id > ? ORDER BY id LIMIT ?"):
+        codes = reserve_codes(conn, len(rows))
+        conn.executemany("UPDATE films SET code = ? WHERE id = ?", [(c, r[0]) for c, r in zip(codes, rows)])
+
+
+def _films_v3_genres(conn: sqlite3.Connection) -> None:
+    # Перенос films.genre (через запятую) в genres/film_genres
+    resolver = GenreResolver(conn)
+    for rows in batches(conn, "SELECT id, genre FROM films WHERE COALESCE(genre, '') != '' AND id > ? ORDER BY id LIMIT ?"):
+        link_film_genres(conn, [(r[0], split_genres(r[1])) for r in rows], resolver)
+
+
+def _films_v4_search(conn: sqlite3.Connection) -> None:
+    # Полнотекстовый индекс для поиска в админке (+ триггеры синхронизации)
+    install_search(conn)
+
+
+def _films_v5_stats(conn: sqlite3.Connection) -> None:
+    # Материализованные агрегаты для /api/stats; дальше их ведут триггеры
+    install_film_stats(conn)
+    reconcile_film_stats(conn)
+
+
+def _films_v6_media(conn: sqlite3.Connection) -> None:
+    # Счётчики ссылок на файлы постеров (для сборки мусора в uploads)
+    install_media(conn)
+    reconcile_media(conn)
+
+
+def _films_v7_codes(conn: sqlite3.Connection) -> None:
+    # Последовательность кодов фильмов (базы, прошедшие v2 до её появления)
+    install_codes(conn)
+
+
+def _users_v1_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""CREATE TABLE IF NOT EXISTS users(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT,
         tg_id INTEGER UNIQUE,
@@ -126,7 +135,7 @@ def init_db() -> None:
         referred_by TEXT,
         banned INTEGER DEFAULT 0
     )""")
-    cursor_users.execute("""CREATE TABLE IF NOT EXISTS referrals(
+    conn.execute("""CREATE TABLE IF NOT EXISTS referrals(
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         referrer_id INTEGER,
         referred_id INTEGER,
@@ -134,8 +143,47 @@ def init_db() -> None:
         FOREIGN KEY (referrer_id) REFERENCES users(tg_id),
         FOREIGN KEY (referred_id) REFERENCES users(tg_id)
     )""")
-    conn_users.commit()
-    conn_users.close()
+
+
+def _users_v2_stats(conn: sqlite3.Connection) -> None:
+    install_user_stats(conn)
+    reconcile_user_stats(conn)
+
+
+def _users_v3_chat_state(conn: sqlite3.Connection) -> None:
+    # id сообщения-меню бота по чатам (см. app.bot.state.ChatStateStore)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chat_state(
+            chat_id INTEGER PRIMARY KEY,
+            menu_id INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_state_updated ON chat_state(updated_at)")
+
+
+# Только дописывать в конец: номер шага — это версия схемы
+MIGRATIONS: Dict[str, Tuple[Migration, ...]] = {
+    'films.db': (_films_v1_schema, _films_v2_codes, _films_v3_genres, _films_v4_search, _films_v5_stats, _films_v6_media, _films_v7_codes),
+    'users.db': (_users_v1_schema, _users_v2_stats, _users_v3_chat_state),
+    # Фоновые задачи (очередь импорта и т.п.) — отдельная база
+    JOBS_DB: (install_jobs, install_broadcasts, add_broadcast_attempts),
+}
+
+
+def init_db() -> None:
+    """Bring every database up to the current schema version.
+
+    On a warm start this is one PRAGMA user_version read per file.
+    """
+    for db_name, steps in MIGRATIONS.items():
+        conn = get_db_connection(db_name)
+        try:
+            migrate(conn, steps)
+        finally:
+            conn.close()
 
 
 # --- Helpers for normalized genres ---
@@ -144,28 +192,36 @@ def upsert_genre(conn: sqlite3.Connection, name: str) -> int:
     n = (name or '').strip()
     if not n:
         raise ValueError("Genre name is empty")
-    cur = conn.cursor()
-    try:
-        cur.execute("INSERT OR IGNORE INTO genres(name) VALUES(?)", (n,))
-        conn.commit()
-    except Exception:
-        # ignore
-        pass
-    cur.execute("SELECT id FROM genres WHERE name = ?", (n,))
-    row = cur.fetchone()
-    if not row:
-        # Extremely rare race; try insert again
-        cur.execute("INSERT OR REPLACE INTO genres(name) VALUES(?)", (n,))
-        conn.commit()
-        cur.execute("SELECT id FROM genres WHERE name = ?", (n,))
-        row = cur.fetchone()
-    return int(row[0])
+    return GenreResolver(conn).resolve([n])[n]
 
 
-def set_film_genres(conn: sqlite3.Connection, film_id: int, genres: Iterable[str]) -> None:
-    """Replace film's genres mapping with provided list. Keeps films.genre text in sync."""
-    cur = conn.cursor()
-    # Deduplicate and clean
+class GenreResolver:
+    """name -> id map for genres, loaded once per write batch.
+
+    Unknown names are inserted together with one executemany, so mapping a
+    whole batch of films costs a couple of statements instead of two per
+    genre. Use it within a single transaction: ids of genres it inserted
+    are only valid if that transaction commits.
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+        self._ids: Dict[str, int] = {row[1]: int(row[0]) for row in conn.execute("SELECT id, name FROM genres")}
+
+    def resolve(self, names: Iterable[str]) -> Dict[str, int]:
+        wanted = {(n or '').strip() for n in names}
+        wanted.discard('')
+        missing = [n for n in wanted if n not in self._ids]
+        if missing:
+            self._conn.executemany("INSERT OR IGNORE INTO genres(name) VALUES(?)", [(n,) for n in missing])
+            marks = ",".join("?" * len(missing))
+            for row in self._conn.execute(f"SELECT id, name FROM genres WHERE name IN ({marks})", missing):
+                self._ids[row[1]] = int(row[0])
+        return {n: self._ids[n] for n in wanted}
+
+
+def clean_genres(genres: Iterable[str] | None) -> List[str]:
+    """Trim, drop empties and duplicates, keep order."""
     clean: List[str] = []
     seen = set()
     for g in (genres or []):
@@ -174,11 +230,147 @@ def set_film_genres(conn: sqlite3.Connection, film_id: int, genres: Iterable[str
             continue
         seen.add(s)
         clean.append(s)
+    return clean
+
+
+def link_film_genres(conn: sqlite3.Connection, pairs: Iterable[Tuple[int, Iterable[str]]], resolver: Optional[GenreResolver] = None) -> None:
+    """Add film_genres rows for (film_id, genre names) pairs with one executemany."""
+    pairs = [(fid, clean_genres(names)) for fid, names in pairs]
+    resolver = resolver or GenreResolver(conn)
+    ids = resolver.resolve(g for _, names in pairs for g in names)
+    conn.executemany(
+        "INSERT OR IGNORE INTO film_genres(film_id, genre_id) VALUES(?, ?)",
+        [(fid, ids[g]) for fid, names in pairs for g in names],
+    )
+
+
+def set_film_genres(conn: sqlite3.Connection, film_id: int, genres: Iterable[str]) -> None:
+    """Replace film's genres mapping with provided list. Keeps films.genre text in sync.
+
+    Does not commit: run it inside the caller's transaction (database.write),
+    then catalog.refresh() the film so genre listeners fire after the commit.
+    """
+    cur = conn.cursor()
+    # Не оставляем висячих связей для удалённого (или ещё не созданного) фильма
+    if cur.execute("SELECT 1 FROM films WHERE id = ?", (film_id,)).fetchone() is None:
+        return
+    clean = clean_genres(genres)
     # Reset mapping
     cur.execute("DELETE FROM film_genres WHERE film_id = ?", (film_id,))
-    for g in clean:
-        gid = upsert_genre(conn, g)
-        cur.execute("INSERT OR IGNORE INTO film_genres(film_id, genre_id) VALUES(?, ?)", (film_id, gid))
+    link_film_genres(conn, [(film_id, clean)])
     # Keep legacy text column in sync
     cur.execute("UPDATE films SET genre = ? WHERE id = ?", (", ".join(clean), film_id))
-    conn.commit()
+
+
+def split_genres(genre: str | None) -> List[str]:
+    """Split a free-form "Драма, Комедия; Триллер" string into trimmed names."""
+    return [p.strip() for p in re.split(r"[,;]", genre or "") if p.strip()]
+
+
+def find_external_film(conn: sqlite3.Connection, source: str, external_id: str) -> Optional[int]:
+    """Return id of a film imported from (source, external_id), if any."""
+    row = conn.execute(
+        "SELECT id FROM films WHERE external_source = ? AND external_id = ?", (source, external_id)
+    ).fetchone()
+    return int(row[0]) if row else None
+
+
+def find_external_films(conn: sqlite3.Connection, source: str, external_ids: Iterable[str]) -> Dict[str, int]:
+    """Batch variant of find_external_film: {external_id: film id} for those already imported."""
+    ids = [str(i) for i in external_ids]
+    if not ids:
+        return {}
+    marks = ",".join("?" * len(ids))
+    rows = conn.execute(
+        f"SELECT external_id, id FROM films WHERE external_source = ? AND external_id IN ({marks})", (source, *ids)
+    ).fetchall()
+    return {row[0]: int(row[1]) for row in rows}
+
+
+def insert_films(conn: sqlite3.Connection, films: Iterable[Dict[str, Any]], *, skip_existing: bool = False) -> List[Optional[Tuple[int, str]]]:
+    """Insert many active films; return (id, code) per input film.
+
+    Each film is a dict with name, description, photo_id, genres, site and
+    optionally external_source / external_id. Films and their film_genres rows
+    are written with executemany and genres are resolved through one
+    GenreResolver. With skip_existing, films whose external pair is already in
+    the catalog (or repeated within the batch) are skipped and yield None.
+    Does not commit: the caller's transaction (database.write) covers it all;
+    catalog.refresh() of the new ids then notifies genre listeners.
+    """
+    films = list(films)
+    result: List[Optional[Tuple[int, str]]] = [None] * len(films)
+    todo = list(range(len(films)))
+    if skip_existing:
+        seen = set()
+        by_source: Dict[str, List[str]] = {}
+        for f in films:
+            if f.get("external_source") and f.get("external_id") is not None:
+                by_source.setdefault(f["external_source"], []).append(str(f["external_id"]))
+        for source, ext_ids in by_source.items():
+            seen.update((source, ext_id) for ext_id in find_external_films(conn, source, ext_ids))
+        todo = []
+        for i, f in enumerate(films):
+            if f.get("external_source") and f.get("external_id") is not None:
+                key = (f["external_source"], str(f["external_id"]))
+                if key in seen:
+                    continue
+                seen.add(key)
+            todo.append(i)
+    if not todo:
+        return result
+
+    genres = {i: clean_genres(films[i].get("genres")) for i in todo}
+    codes = dict(zip(todo, reserve_codes(conn, len(todo))))
+    conn.executemany(
+        """
+        INSERT INTO films (name, description, photo_status, photo_id, activate, genre, site, code, external_source, external_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (
+                films[i].get("name"),
+                films[i].get("description") or "",
+                1 if films[i].get("photo_id") else 0,
+                films[i].get("photo_id"),
+                1,
+                ", ".join(genres[i]),
+                films[i].get("site") or "",
+                codes[i],
+                films[i].get("external_source"),
+                str(films[i]["external_id"]) if films[i].get("external_id") is not None else None,
+            )
+            for i in todo
+        ],
+    )
+    # Коды уникальны — по ним и узнаём id вставленных строк
+    marks = ",".join("?" * len(todo))
+    ids = {row[0]: int(row[1]) for row in conn.execute(f"SELECT code, id FROM films WHERE code IN ({marks})", [codes[i] for i in todo])}
+    for i in todo:
+        result[i] = (ids[codes[i]], codes[i])
+    link_film_genres(conn, [(ids[codes[i]], genres[i]) for i in todo])
+    return result
+
+
+def insert_film(
+    conn: sqlite3.Connection,
+    *,
+    name: str,
+    description: str,
+    photo_id: Optional[str],
+    genres: Iterable[str],
+    site: str,
+    external_source: Optional[str] = None,
+    external_id: Optional[str] = None,
+) -> Tuple[int, str]:
+    """Insert an active film with the next free 5-digit code, return (id, code)."""
+    film = {
+        "name": name,
+        "description": description,
+        "photo_id": photo_id,
+        "genres": genres,
+        "site": site,
+        "external_source": external_source,
+        "external_id": external_id,
+    }
+    return insert_films(conn, [film])[0]
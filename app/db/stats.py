@@ -0,0 +1,199 @@
+import datetime as dt
+import sqlite3
+from typing import Dict, Tuple
+
+# Aggregates for /api/stats are kept in small tables that triggers update on
+# every write (the bot and the admin panel write through different code paths,
+# so SQL is the one place all changes pass). reconcile_*() rebuilds them from
+# scratch; it runs at startup and periodically as a safety net.
+
+_HAS_IMAGE_NEW = "(new.photo_status IS 1 OR COALESCE(new.photo_id, '') != '')"
+_HAS_IMAGE_OLD = "(old.photo_status IS 1 OR COALESCE(old.photo_id, '') != '')"
+
+_FILM_TRIGGERS = f"""
+CREATE TABLE IF NOT EXISTS stats_counters(
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats_genres(
+    genre_id INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO stats_counters(key, value) VALUES ('films_total', 0), ('films_with_image', 0), ('films_no_genre', 0);
+
+CREATE TRIGGER IF NOT EXISTS stats_films_ai AFTER INSERT ON films BEGIN
+    UPDATE stats_counters SET value = value + 1 WHERE key IN ('films_total', 'films_no_genre');
+    UPDATE stats_counters SET value = value + {_HAS_IMAGE_NEW} WHERE key = 'films_with_image';
+END;
+CREATE TRIGGER IF NOT EXISTS stats_films_au AFTER UPDATE OF photo_status, photo_id ON films BEGIN
+    UPDATE stats_counters SET value = value + {_HAS_IMAGE_NEW} - {_HAS_IMAGE_OLD} WHERE key = 'films_with_image';
+END;
+CREATE TRIGGER IF NOT EXISTS stats_films_ad AFTER DELETE ON films BEGIN
+    UPDATE stats_counters SET value = value - 1 WHERE key = 'films_total';
+    UPDATE stats_counters SET value = value - {_HAS_IMAGE_OLD} WHERE key = 'films_with_image';
+    UPDATE stats_counters SET value = value - 1
+        WHERE key = 'films_no_genre' AND NOT EXISTS (SELECT 1 FROM film_genres WHERE film_id = old.id);
+    UPDATE stats_genres SET count = count - 1
+        WHERE genre_id IN (SELECT genre_id FROM film_genres WHERE film_id = old.id);
+    -- foreign_keys выключены, поэтому связи удаляем сами
+    DELETE FROM film_genres WHERE film_id = old.id;
+END;
+
+-- Связи учитываем только для существующих фильмов
+CREATE TRIGGER IF NOT EXISTS stats_fg_ai AFTER INSERT ON film_genres
+WHEN EXISTS (SELECT 1 FROM films WHERE id = new.film_id) BEGIN
+    INSERT INTO stats_genres(genre_id, count) VALUES (new.genre_id, 1)
+        ON CONFLICT(genre_id) DO UPDATE SET count = count + 1;
+    UPDATE stats_counters SET value = value - 1
+        WHERE key = 'films_no_genre'
+          AND (SELECT COUNT(*) FROM film_genres WHERE film_id = new.film_id) = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_fg_ad AFTER DELETE ON film_genres
+WHEN EXISTS (SELECT 1 FROM films WHERE id = old.film_id) BEGIN
+    UPDATE stats_genres SET count = count - 1 WHERE genre_id = old.genre_id;
+    UPDATE stats_counters SET value = value + 1
+        WHERE key = 'films_no_genre' AND NOT EXISTS (SELECT 1 FROM film_genres WHERE film_id = old.film_id);
+END;
+"""
+
+_USER_TRIGGERS = """
+CREATE TABLE IF NOT EXISTS stats_counters(
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats_referrals_daily(
+    day TEXT PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO stats_counters(key, value) VALUES ('users_total', 0), ('admins', 0), ('banned', 0);
+
+CREATE TRIGGER IF NOT EXISTS stats_users_ai AFTER INSERT ON users BEGIN
+    UPDATE stats_counters SET value = value + 1 WHERE key = 'users_total';
+    UPDATE stats_counters SET value = value + (new.admin IS 1) WHERE key = 'admins';
+    UPDATE stats_counters SET value = value + (new.banned IS 1) WHERE key = 'banned';
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_au AFTER UPDATE OF admin, banned ON users BEGIN
+    UPDATE stats_counters SET value = value + (new.admin IS 1) - (old.admin IS 1) WHERE key = 'admins';
+    UPDATE stats_counters SET value = value + (new.banned IS 1) - (old.banned IS 1) WHERE key = 'banned';
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_ad AFTER DELETE ON users BEGIN
+    UPDATE stats_counters SET value = value - 1 WHERE key = 'users_total';
+    UPDATE stats_counters SET value = value - (old.admin IS 1) WHERE key = 'admins';
+    UPDATE stats_counters SET value = value - (old.banned IS 1) WHERE key = 'banned';
+END;
+
+CREATE TRIGGER IF NOT EXISTS stats_referrals_ai AFTER INSERT ON referrals BEGIN
+    INSERT INTO stats_referrals_daily(day, count) VALUES (date(new.date_referred), 1)
+        ON CONFLICT(day) DO UPDATE SET count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_referrals_ad AFTER DELETE ON referrals BEGIN
+    UPDATE stats_referrals_daily SET count = count - 1 WHERE day = date(old.date_referred);
+END;
+"""
+
+
+def install_film_stats(conn: sqlite3.Connection) -> None:
+    conn.executescript(_FILM_TRIGGERS)
+    conn.commit()
+
+
+def install_user_stats(conn: sqlite3.Connection) -> None:
+    conn.executescript(_USER_TRIGGERS)
+    conn.commit()
+
+
+# --- reconcile (full recount; caller owns the transaction) ---
+def reconcile_film_stats(conn: sqlite3.Connection) -> None:
+    # Связи удалённых фильмов могли остаться с тех времён, когда триггеров ещё не было
+    conn.execute("DELETE FROM film_genres WHERE film_id NOT IN (SELECT id FROM films)")
+    conn.execute("DELETE FROM stats_counters")
+    conn.execute(
+        f"""
+        INSERT INTO stats_counters(key, value)
+        SELECT 'films_total', COUNT(*) FROM films
+        UNION ALL
+        SELECT 'films_with_image', COUNT(*) FROM films
+            WHERE photo_status = 1 OR COALESCE(photo_id, '') != ''
+        UNION ALL
+        SELECT 'films_no_genre', COUNT(*) FROM films f
+            WHERE NOT EXISTS (SELECT 1 FROM film_genres fg WHERE fg.film_id = f.id)
+        """
+    )
+    conn.execute("DELETE FROM stats_genres")
+    conn.execute(
+        """
+        INSERT INTO stats_genres(genre_id, count)
+        SELECT genre_id, COUNT(*) FROM film_genres WHERE film_id IN (SELECT id FROM films) GROUP BY genre_id
+        """
+    )
+
+
+def reconcile_user_stats(conn: sqlite3.Connection) -> None:
+    conn.execute("DELETE FROM stats_counters")
+    conn.execute(
+        """
+        INSERT INTO stats_counters(key, value)
+        SELECT 'users_total', COUNT(*) FROM users
+        UNION ALL
+        SELECT 'admins', COUNT(*) FROM users WHERE admin = 1
+        UNION ALL
+        SELECT 'banned', COUNT(*) FROM users WHERE banned = 1
+        """
+    )
+    conn.execute("DELETE FROM stats_referrals_daily")
+    conn.execute(
+        """
+        INSERT INTO stats_referrals_daily(day, count)
+        SELECT date(date_referred), COUNT(*) FROM referrals GROUP BY date(date_referred)
+        """
+    )
+
+
+# --- reads ---
+def _counters(conn: sqlite3.Connection) -> Dict[str, int]:
+    return {row[0]: row[1] for row in conn.execute("SELECT key, value FROM stats_counters")}
+
+
+def read_film_stats(conn: sqlite3.Connection) -> dict:
+    c = _counters(conn)
+    counts: Dict[str, int] = {}
+    display: Dict[str, str] = {}
+    for name, count in conn.execute(
+        "SELECT g.name, s.count FROM stats_genres s JOIN genres g ON g.id = s.genre_id WHERE s.count > 0"
+    ):
+        # Жанры, различающиеся только регистром, показываем одной строкой
+        key = name.lower()
+        counts[key] = counts.get(key, 0) + count
+        display.setdefault(key, name)
+    if c.get('films_no_genre', 0) > 0:
+        counts["не указан"] = counts.get("не указан", 0) + c['films_no_genre']
+        display.setdefault("не указан", "Не указан")
+    by_genre = sorted(
+        ({"genre": display[k], "count": v} for k, v in counts.items()),
+        key=lambda x: x["count"],
+        reverse=True,
+    )
+    recent = [
+        {"code": row[0], "name": row[1]}
+        for row in conn.execute("SELECT code, name FROM films ORDER BY id DESC LIMIT 5")
+    ]
+    return {
+        "total": c.get('films_total', 0),
+        "with_image": c.get('films_with_image', 0),
+        "by_genre": by_genre,
+        "recent": recent,
+    }
+
+
+def read_user_stats(conn: sqlite3.Connection) -> Tuple[dict, dict]:
+    c = _counters(conn)
+    last7 = [(dt.date.today() - dt.timedelta(days=i)).isoformat() for i in range(6, -1, -1)]
+    raw = {
+        row[0]: row[1]
+        for row in conn.execute(
+            "SELECT day, count FROM stats_referrals_daily WHERE day >= ? AND day <= ?", (last7[0], last7[-1])
+        )
+    }
+    referrals = {"labels": last7, "counts": [raw.get(day, 0) for day in last7]}
+    users = {"total": c.get('users_total', 0), "admins": c.get('admins', 0), "banned": c.get('banned', 0)}
+    return users, referrals
@@ -166,6 +166,8 @@ def main():
         "backups",
         "films.db",
         "users.db",
+        "jobs.db",
+        "tmdb_cache.db",
     ]
     post_install = plan.get("post_install") or []
 
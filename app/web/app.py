@@ -1,11 +1,12 @@
 from contextlib import asynccontextmanager
+import asyncio
 from fastapi import FastAPI, Depends, Request, HTTPException, UploadFile, File, Form, Query
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, RedirectResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.templating import Jinja2Templates
-from typing import Callable, Optional
+from typing import TYPE_CHECKING, Callable, Optional
 import os
 import sys
 import shutil
@@ -13,14 +14,24 @@ import tempfile
 import subprocess
 
 from app.core.settings import settings
-from app.db.sqlite import init_db, get_db_connection, set_film_genres
-from app.web.sockets import sio, get_films as sio_get_films, get_users as sio_get_users
-from app.web.static import uploads_path, allowed_file
+from app.db.aio import database
+from app.db.catalog import catalog
+from app.db.pool import pool
+from app.db.search import search_films as db_search_films
+from app.db.sqlite import find_external_film, find_external_films, init_db, insert_film, insert_films, set_film_genres, split_genres
+from app.db.stats import read_film_stats, read_user_stats, reconcile_film_stats, reconcile_user_stats
+from app.web.sockets import sio, films_feed, users_feed
+from app.web.media import media_store
+from app.web.static import uploads_path
+from app.web.thumbs import pick as pick_derivative, thumbnailer
+from app.web.tmdb import tmdb
 import urllib.parse, urllib.request, json
-import time
 import re
 from pathlib import Path
 
+if TYPE_CHECKING:
+    from app.bot.webhook import UpdateQueue
+
 # tasks
 try:
     from app.web.tasks import task_manager
@@ -28,27 +39,72 @@ except Exception:
     task_manager = None
 
 
+def _etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match: comma-separated tags, weak comparison (W/ ignored), "*" matches anything."""
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag and tag == etag:
+            return True
+    return False
+
+
+async def _reconcile_stats_loop(interval: int) -> None:
+    """Periodically rebuild the stats aggregates in case a write bypassed the triggers."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await database.write(reconcile_film_stats)
+            await database.write(reconcile_user_stats, db_name='users.db')
+        except Exception:
+            pass
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
+    await catalog.load()
+    try:
+        await media_store.collect_garbage()
+    except Exception:
+        pass
+    reconciler = None
+    if settings.STATS_RECONCILE_INTERVAL > 0:
+        reconciler = asyncio.create_task(_reconcile_stats_loop(settings.STATS_RECONCILE_INTERVAL))
     # start background task manager
     if task_manager is not None:
         try:
             await task_manager.start()
         except Exception:
             pass
+    # Режим webhook: обработчики апдейтов и регистрация адреса в Telegram
+    bot_updates = getattr(app.state, "bot_updates", None)
+    if bot_updates is not None:
+        url = settings.WEBHOOK_URL.rstrip("/") + settings.WEBHOOK_PATH if settings.WEBHOOK_URL else None
+        await bot_updates.start(url, settings.WEBHOOK_SECRET)
     try:
         yield
     finally:
+        if bot_updates is not None:
+            await bot_updates.stop()
+        if reconciler is not None:
+            reconciler.cancel()
         if task_manager is not None:
             try:
                 await task_manager.stop()
             except Exception:
                 pass
+        await tmdb.close()
+        database.shutdown()
+        pool.close_all()
 
 
-def create_app() -> FastAPI:
+def create_app(bot_updates: Optional["UpdateQueue"] = None) -> FastAPI:
     app = FastAPI(lifespan=lifespan)
+    app.state.bot_updates = bot_updates
 
     app.add_middleware(SessionMiddleware, secret_key=settings.SECRET_KEY)
     app.add_middleware(
@@ -66,11 +122,63 @@ def create_app() -> FastAPI:
 
     # Socket.IO обёртка подключена в main.py (ASGIApp). Доп. монтирование не требуется.
 
+    @app.get("/media/{name}")
+    async def media_file(request: Request, name: str, size: str = "thumb"):
+        # Уменьшенные копии постеров; имена контентные, поэтому кэшируем «навсегда»
+        if os.path.basename(name) != name or name.startswith("."):
+            raise HTTPException(status_code=404, detail="Файл не найден")
+        size, fmt = pick_derivative(request.headers.get("accept", ""), size)
+        path = await thumbnailer.ensure(name, size, fmt)
+        if path:
+            etag = f'"{os.path.basename(path)}"'
+            cache = "public, max-age=31536000, immutable"
+        else:
+            # Pillow нет или файл не картинка — отдаём оригинал, но кэшируем недолго
+            path = os.path.join(uploads_path(), name)
+            if not os.path.isfile(path):
+                raise HTTPException(status_code=404, detail="Файл не найден")
+            st = os.stat(path)
+            etag = f'"{name}-{int(st.st_mtime)}-{st.st_size}"'
+            cache = "public, max-age=3600"
+        headers = {"ETag": etag, "Cache-Control": cache, "Vary": "Accept"}
+        if _etag_matches(request.headers.get("if-none-match", ""), etag):
+            return Response(status_code=304, headers=headers)
+        return FileResponse(path, headers=headers)
+
     # Auth helpers
     def login_required(request: Request):
         if not request.session.get("logged_in"):
             raise HTTPException(status_code=302, detail="Redirect", headers={"Location": "/login"})
 
+    if bot_updates is not None:
+        @app.post(settings.WEBHOOK_PATH, include_in_schema=False)
+        async def telegram_webhook(request: Request):
+            # Только кладём апдейт в очередь и сразу отвечаем — обработка идёт в фоне
+            if settings.WEBHOOK_SECRET and request.headers.get("x-telegram-bot-api-secret-token") != settings.WEBHOOK_SECRET:
+                raise HTTPException(status_code=403, detail="Forbidden")
+            try:
+                data = await request.json()
+            except Exception:
+                data = None
+            if not isinstance(data, dict):
+                raise HTTPException(status_code=400, detail="Bad update")
+            if not bot_updates.offer(data):
+                # Очередь полна — Telegram повторит доставку позже
+                return Response(status_code=503, headers={"Retry-After": "1"})
+            return Response(status_code=200)
+
+        @app.get("/api/bot/updates")
+        async def bot_updates_stats(request: Request):
+            login_required(request)
+            return JSONResponse(bot_updates.stats())
+
+    @app.get("/api/bot/outbound")
+    async def bot_outbound_stats(request: Request):
+        login_required(request)
+        # Отправлено / схлопнуто правок / 429 и время ожидания в очереди лимитов
+        from app.bot.instance import outbound
+        return JSONResponse(outbound.stats())
+
     @app.get("/login", response_class=HTMLResponse)
     async def login_page(request: Request):
         return templates.TemplateResponse("login.html", {"request": request})
@@ -323,6 +431,8 @@ def create_app() -> FastAPI:
                     "backups",
                     "films.db",
                     "users.db",
+                    "jobs.db",
+                    "tmdb_cache.db",
                 ],
                 "python_exe": sys.executable,
                 "app_dir": str(Path(__file__).resolve().parents[2]),
@@ -347,6 +457,8 @@ def create_app() -> FastAPI:
                     "backups",
                     "films.db",
                     "users.db",
+                    "jobs.db",
+                    "tmdb_cache.db",
                 ],
                 "python_exe": sys.executable,
                 "app_dir": str(Path(__file__).resolve().parents[2]),
@@ -365,47 +477,18 @@ def create_app() -> FastAPI:
         return JSONResponse({"message": "Обновление запущено", "status": "started", "version": latest}, status_code=202)
 
     # API
-    # TMDb helpers (with simple cache + retry + fallback to stale cache)
-    _tmdb_cache: dict[str, dict] = {}
-    _tmdb_ttl_sec = 600
-
-    def _cache_key(path: str, params: dict | None) -> str:
-        params = params or {}
-        # Do not cache by api_key
-        q = {k: v for k, v in params.items() if k != 'api_key'}
-        items = sorted(q.items())
-        return path + '?' + urllib.parse.urlencode(items)
-
-    def tmdb_request(path: str, params: dict | None = None):
+    # TMDb: общий асинхронный клиент (app/web/tmdb.py) с кэшем; ошибки — в HTTP-коды
+    async def tmdb_request(path: str, params: dict | None = None):
         if not settings.TMDB_API_KEY:
             raise HTTPException(status_code=400, detail="TMDB_API_KEY не задан в .env")
-        base = "https://api.themoviedb.org/3"
-        q = {"api_key": settings.TMDB_API_KEY, "language": settings.TMDB_LANGUAGE}
-        if params:
-            q.update(params)
-        url = f"{base}{path}?" + urllib.parse.urlencode(q)
-        key = _cache_key(path, q)
-        now = time.time()
-        # fresh cache
-        c = _tmdb_cache.get(key)
-        if c and (now - c.get('ts', 0) < _tmdb_ttl_sec):
-            return c['data']
-        last_error = None
-        for attempt in range(3):
-            try:
-                with urllib.request.urlopen(url, timeout=12 + attempt * 3) as r:
-                    data = r.read()
-                    parsed = json.loads(data.decode('utf-8'))
-                    _tmdb_cache[key] = {"ts": time.time(), "data": parsed}
-                    return parsed
-            except Exception as e:
-                last_error = e
-                # backoff: 0.5s, 1s
-                time.sleep(0.5 * (attempt + 1))
-        # Fallback to stale cache if present
-        if c:
-            return c['data']
-        raise HTTPException(status_code=502, detail=f"TMDb ошибка: {last_error}")
+        try:
+            data = await tmdb.get_json(path, params)
+        except Exception as e:
+            # Сеть, лимиты, битый JSON и прочие сбои клиента — всё это ошибка шлюза, а не 500
+            raise HTTPException(status_code=502, detail=str(e) or "Ошибка TMDb")
+        if not isinstance(data, dict):
+            raise HTTPException(status_code=502, detail="TMDb: некорректный ответ")
+        return data
 
     @app.get("/api/import/search")
     async def import_search(request: Request, query: str, page: int = 1):
@@ -413,7 +496,7 @@ def create_app() -> FastAPI:
         query = (query or "").strip()
         if not query:
             return JSONResponse({"results": [], "page": 1, "total_pages": 0})
-        data = tmdb_request("/search/movie", {"query": query, "page": page, "include_adult": "false"})
+        data = await tmdb_request("/search/movie", {"query": query, "page": page, "include_adult": "false"})
         image_base = settings.TMDB_IMAGE_BASE
         results = []
         for it in data.get("results", [])[:20]:
@@ -435,350 +518,137 @@ def create_app() -> FastAPI:
         # Запрашиваем популярные фильмы TMDb со случайной страницы,
         # затем случайно выбираем N фильмов с этой страницы
         import random
-        first_page = tmdb_request("/movie/popular", {"page": 1})
+        first_page = await tmdb_request("/movie/popular", {"page": 1})
         total_pages = int(first_page.get("total_pages", 1) or 1)
         max_page = min(total_pages, 500)  # TMDb ограничивает пагинацию 500
         rnd_page = random.randint(1, max_page)
-        data = first_page if rnd_page == 1 else tmdb_request("/movie/popular", {"page": rnd_page})
+        data = first_page if rnd_page == 1 else await tmdb_request("/movie/popular", {"page": rnd_page})
         results = [it.get("id") for it in data.get("results", []) if it.get("id")]
         if not results:
             return JSONResponse({"imported": 0, "skipped": 0, "requested": 0, "items": []})
         ids = random.sample(results, k=min(count, len(results)))
-        
-        conn = get_db_connection()
-        c = conn.cursor()
-
-        imported = []
-        skipped = 0
 
-        import sqlite3
+        # Дубликаты — одним запросом, детали и постеры — параллельно (лимиты — в клиенте TMDb)
+        existing = await database.read(find_external_films, "tmdb", [str(i) for i in ids])
+        todo = [i for i in ids if str(i) not in existing]
+        skipped = len(ids) - len(todo)
+        results = await asyncio.gather(*(tmdb.fetch_movie(i) for i in todo), return_exceptions=True)
+        fetched = [
+            {**m, "external_source": "tmdb", "external_id": str(m["movie_id"])}
+            for m in results if not isinstance(m, BaseException)
+        ]
+        skipped += len(results) - len(fetched)
 
-        def gen():
-            return f"{random.randint(10000, 99999)}"
+        # Все фильмы и их жанры — одной транзакцией
+        rows = await database.write(lambda conn: insert_films(conn, fetched, skip_existing=True)) if fetched else []
+        imported = [{"id": r[0], "code": r[1], "name": f["name"]} for f, r in zip(fetched, rows) if r is not None]
+        skipped += len(fetched) - len(imported)
 
-        for movie_id in ids:
-            # Пропуск дубликатов
-            c.execute("SELECT id FROM films WHERE external_source = ? AND external_id = ?", ("tmdb", str(movie_id)))
-            if c.fetchone():
-                skipped += 1
-                continue
-            try:
-                # Детали фильма
-                d = tmdb_request(f"/movie/{movie_id}", {})
-                name = d.get("title") or d.get("name") or "Без названия"
-                description = d.get("overview") or ""
-                genre_list = [g.get("name") for g in d.get("genres", []) if g.get("name")]
-                genres = ", ".join(genre_list)
-                site = d.get("homepage") or ""
-                poster_path = d.get("poster_path")
-                photo_id = None
-                if poster_path:
-                    try:
-                        base = settings.TMDB_IMAGE_BASE
-                        url = f"{base}/w500{poster_path}"
-                        fn = f"tmdb_{movie_id}.jpg"
-                        file_path = os.path.join(uploads_path(), fn)
-                        with urllib.request.urlopen(url, timeout=15) as r, open(file_path, 'wb') as f:
-                            f.write(r.read())
-                        photo_id = fn
-                    except Exception:
-                        photo_id = None
+        await catalog.refresh(*(it["id"] for it in imported))
 
-                code = gen()
-                for _ in range(7):
-                    try:
-                        c.execute(
-                            """
-                            INSERT INTO films (name, description, photo_status, photo_id, activate, genre, site, code, external_source, external_id)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """,
-                            (name, description, 1 if photo_id else 0, photo_id, 1, genres, site, code, "tmdb", str(movie_id))
-                        )
-                        break
-                    except sqlite3.IntegrityError:
-                        code = gen()
-                film_id = c.lastrowid
-                # normalize genres mapping
-                try:
-                    set_film_genres(conn, film_id, genre_list)
-                except Exception:
-                    pass
-                imported.append({"id": film_id, "code": code, "name": name})
-            except Exception:
-                skipped += 1
-                continue
-
-        conn.commit()
         # Итоговое уведомление и обновление списка
         await sio.emit('notification', {'message': f'Импорт популярных TMDb: добавлено {len(imported)} из {len(ids)} (пропущено: {skipped})', 'type': 'success' if imported else 'warning'})
-        await sio_get_films()
-        conn.close()
+        await films_feed.upsert(*(it["id"] for it in imported))
         return JSONResponse({"imported": len(imported), "skipped": skipped, "requested": len(ids), "items": imported})
 
     @app.post("/api/import/tmdb/{movie_id}")
     async def import_tmdb(request: Request, movie_id: int):
         login_required(request)
         # Проверка на дубликат
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM films WHERE external_source = ? AND external_id = ?", ("tmdb", str(movie_id)))
-        if cur.fetchone():
-            conn.close()
+        if await database.read(find_external_film, "tmdb", str(movie_id)):
             return JSONResponse({"message": "Фильм уже импортирован"})
         # Детали фильма
-        d = tmdb_request(f"/movie/{movie_id}", {})
+        d = await tmdb_request(f"/movie/{movie_id}", {})
         name = d.get("title") or d.get("name") or "Без названия"
-        description = d.get("overview") or ""
         genre_list = [g.get("name") for g in d.get("genres", []) if g.get("name")]
-        genres = ", ".join(genre_list)
-        site = d.get("homepage") or ""
-        poster_path = d.get("poster_path")
-        photo_id = None
-        if poster_path:
-            try:
-                base = settings.TMDB_IMAGE_BASE
-                url = f"{base}/w500{poster_path}"
-                fn = f"tmdb_{movie_id}.jpg"
-                file_path = os.path.join(uploads_path(), fn)
-                with urllib.request.urlopen(url, timeout=15) as r, open(file_path, 'wb') as f:
-                    f.write(r.read())
-                photo_id = fn
-            except Exception:
-                photo_id = None
+        photo_id = await tmdb.download_poster(movie_id, d.get("poster_path"))
         # Генерируем код и вставляем
-        import random, sqlite3
-        def gen():
-            return f"{random.randint(10000, 99999)}"
-        code = gen()
-        with conn:
-            c = conn.cursor()
-            for _ in range(7):
-                try:
-                    c.execute(
-                        """
-                        INSERT INTO films (name, description, photo_status, photo_id, activate, genre, site, code, external_source, external_id)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        (name, description, 1 if photo_id else 0, photo_id, 1, genres, site, code, "tmdb", str(movie_id))
-                    )
-                    break
-                except sqlite3.IntegrityError:
-                    code = gen()
-            film_id = c.lastrowid
-        # normalize genres mapping
-        try:
-            set_film_genres(conn, film_id, genre_list)
-        except Exception:
-            pass
+        film_id, code = await database.write(
+            lambda conn: insert_film(
+                conn,
+                name=name,
+                description=d.get("overview") or "",
+                photo_id=photo_id,
+                genres=genre_list,
+                site=d.get("homepage") or "",
+                external_source="tmdb",
+                external_id=str(movie_id),
+            )
+        )
+        await catalog.refresh(film_id)
         await sio.emit('notification', {'message': f'Импортировано из TMDb: "{name}". Код: {code}', 'type': 'success'})
-        await sio_get_films()
-        conn.close()
+        await films_feed.upsert(film_id)
         return JSONResponse({"message": "Импорт успешно выполнен", "id": film_id, "code": code})
 
 
     @app.get("/api/films")
     async def get_films_api(request: Request):
         login_required(request)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM films ORDER BY id DESC")
-        films = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        rows = await database.fetchall("SELECT * FROM films ORDER BY id DESC")
+        films = [dict(row) for row in rows]
         return JSONResponse(films)
 
     @app.get("/api/stats")
     async def get_stats(request: Request):
-        import datetime as dt
         login_required(request)
-        # Films stats
-        conn_f = get_db_connection()
-        c_f = conn_f.cursor()
-        c_f.execute("SELECT COUNT(*) as cnt FROM films")
-        films_total = c_f.fetchone()[0]
-        c_f.execute("SELECT COUNT(*) FROM films WHERE (photo_status = 1) OR (photo_id IS NOT NULL AND photo_id != '')")
-        films_with_image = c_f.fetchone()[0]
-        # Агрегация по отдельным жанрам (genre — это строка с перечислением через запятую/точку с запятой)
-        import re
-        c_f.execute("SELECT genre FROM films")
-        rows = c_f.fetchall()
-        counts: dict[str, int] = {}
-        display: dict[str, str] = {}
-        for (gstr,) in rows:
-            s = (gstr or "").strip()
-            if not s:
-                key = "не указан"
-                counts[key] = counts.get(key, 0) + 1
-                if key not in display: display[key] = "Не указан"
-                continue
-            # Разбиваем по , или ;, удаляем лишние пробелы, пустые значения
-            parts = [p.strip() for p in re.split(r"[,;]", s) if p.strip()]
-            if not parts:
-                key = "не указан"
-                counts[key] = counts.get(key, 0) + 1
-                if key not in display: display[key] = "Не указан"
-                continue
-            for g in parts:
-                key = g.lower()
-                counts[key] = counts.get(key, 0) + 1
-                # Сохраняем человекочитаемую форму (первое встреченное написание)
-                if key not in display:
-                    display[key] = g
-        films_by_genre = sorted([
-            {"genre": display.get(k, k.title()), "count": v}
-            for k, v in counts.items()
-        ], key=lambda x: x["count"], reverse=True)
-        c_f.execute("SELECT code, name FROM films ORDER BY id DESC LIMIT 5")
-        recent_films = [{"code": row[0], "name": row[1]} for row in c_f.fetchall()]
-        conn_f.close()
-
-        # Users stats
-        conn_u = get_db_connection('users.db')
-        c_u = conn_u.cursor()
-        c_u.execute("SELECT COUNT(*) FROM users")
-        users_total = c_u.fetchone()[0]
-        c_u.execute("SELECT COUNT(*) FROM users WHERE admin = 1")
-        admins = c_u.fetchone()[0]
-        c_u.execute("SELECT COUNT(*) FROM users WHERE banned = 1")
-        banned = c_u.fetchone()[0]
-
-        # Referrals per day (last 7 days)
-        c_u.execute("SELECT date(date_referred) as d, COUNT(*) as c FROM referrals WHERE date_referred >= date('now','-6 day') GROUP BY d ORDER BY d")
-        raw = {row[0]: row[1] for row in c_u.fetchall()}
-        last7 = [(dt.date.today() - dt.timedelta(days=i)).isoformat() for i in range(6,-1,-1)]
-        referrals = {"labels": last7, "counts": [raw.get(day, 0) for day in last7]}
-        conn_u.close()
-
+        films = await database.read(read_film_stats)
+        users, referrals = await database.read(read_user_stats, db_name='users.db')
         return JSONResponse({
-            "films": {
-                "total": films_total,
-                "with_image": films_with_image,
-                "by_genre": films_by_genre,
-                "recent": recent_films,
-            },
-            "users": {
-                "total": users_total,
-                "admins": admins,
-                "banned": banned,
-            },
+            "films": films,
+            "users": users,
             "referrals": referrals
         })
 
     @app.get("/api/films/search")
-    async def search_films(request: Request, query: str = "", genre: str = ""):
+    async def search_films(request: Request, query: str = "", genre: str = "", cursor: int = 0, limit: int = 50):
         login_required(request)
-        # Регистронезависимый поиск (в т.ч. для кириллицы) + нормализация пробелов/юникода
-        import unicodedata as _ud
-        def _norm(s: str) -> str:
-            s = _ud.normalize("NFKC", (s or ""))
-            s = " ".join(s.split())  # схлопываем множественные пробелы
-            return s.casefold()
-        q = (query or "").strip()
-        g = (genre or "").strip()
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM films ORDER BY id DESC")
-        films = [dict(row) for row in cursor.fetchall()]
-        conn.close()
-
-        if q:
-            q_cf = _norm(q)
-            films = [f for f in films if (
-                q_cf in _norm(str(f.get("id", "")))
-                or q_cf in _norm(f.get("code") or "")
-                or q_cf in _norm(f.get("name") or "")
-            )]
-
-        if g and g != "all":
-            import re as _re
-            g_cf = _norm(g)
-            def _genre_has(genre_str: str) -> bool:
-                parts = [_p.strip() for _p in _re.split(r"[,;]", genre_str or "") if _p.strip()]
-                for _p in parts:
-                    if _norm(_p) == g_cf:
-                        return True
-                return False
-            films = [f for f in films if _genre_has(f.get("genre") or "")]
-
-        return JSONResponse(films)
+        # FTS5 по нормализованным name/code/description + keyset-пагинация по id
+        page = await database.read(db_search_films, query.strip(), genre.strip(), cursor or None, limit)
+        return JSONResponse(page)
 
     @app.post("/api/film")
     async def add_film(request: Request, name: str = Form(...), genre: str = Form(...), description: str = Form(""), site: str = Form(""), image: UploadFile | None = File(None)):
         login_required(request)
-        conn = get_db_connection()
         try:
-            with conn:
-                cursor = conn.cursor()
-                # Генерируем уникальный 5-значный код с защитой от гонок
-                import random, sqlite3
-                def gen():
-                    return f"{random.randint(10000, 99999)}"
-                code = gen()
-                photo_id = None
-                if image and allowed_file(image.filename):
-                    from werkzeug.utils import secure_filename
-                    filename = secure_filename(image.filename)
-                    file_path = os.path.join(uploads_path(), filename)
-                    with open(file_path, 'wb') as f:
-                        f.write(await image.read())
-                    photo_id = filename
-                # До 7 попыток на случай коллизии кода
-                for _ in range(7):
-                    try:
-                        cursor.execute(
-                            """
-                            INSERT INTO films (name, description, photo_status, photo_id, activate, genre, site, code)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                            """,
-                            (name, description, 1 if photo_id else 0, photo_id, 1, genre, site, code)
-                        )
-                        break
-                    except sqlite3.IntegrityError:
-                        code = gen()
-                film_id = cursor.lastrowid
+            # Файл пишется потоково и именуется по хэшу содержимого (одинаковые постеры — один файл)
+            photo_id = await media_store.save_upload(image)
+            # Генерируем уникальный 5-значный код с защитой от гонок
+            film_id, code = await database.write(
+                lambda conn: insert_film(
+                    conn,
+                    name=name,
+                    description=description,
+                    photo_id=photo_id,
+                    genres=split_genres(genre),
+                    site=site,
+                )
+            )
+            await catalog.refresh(film_id)
             await sio.emit('notification', {'message': f'Фильм "{name}" добавлен. Код: {code}', 'type': 'success'})
-            await sio_get_films()
-            # normalize genres mapping (from provided string)
-            try:
-                import re as _re
-                parts = [p.strip() for p in _re.split(r"[,;]", genre or "") if p.strip()]
-                set_film_genres(conn, film_id, parts)
-            except Exception:
-                pass
+            await films_feed.upsert(film_id)
             return JSONResponse({"id": film_id, "code": code, "name": name, "message": "Фильм успешно добавлен"}, status_code=201)
         except Exception as e:
-            conn.rollback()
             return JSONResponse({"error": "Произошла ошибка при добавлении фильма"}, status_code=500)
-        finally:
-            conn.close()
 
     @app.get("/api/film/{id}")
     async def get_film(request: Request, id: int):
         login_required(request)
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM films WHERE id = ?", (id,))
-        film = cursor.fetchone()
-        conn.close()
+        film = await database.fetchone("SELECT * FROM films WHERE id = ?", (id,))
         if film:
             return JSONResponse(dict(film))
         raise HTTPException(status_code=404, detail="Фильм не найден")
 
-    @app.put("/api/film/{id}")
-    async def update_film(request: Request, id: int, name: str = Form(...), genre: str = Form(...), description: str = Form(""), site: str = Form(""), image: UploadFile | None = File(None)):
-        login_required(request)
-        conn = get_db_connection()
+    def _update_film_row(conn, id: int, name: str, description: str, photo_id: str | None, genre: str, site: str) -> bool:
+        """Update the film and its genres in the caller's transaction; False if there is no such film."""
         cursor = conn.cursor()
-        if image and allowed_file(image.filename):
-            from werkzeug.utils import secure_filename
-            filename = secure_filename(image.filename)
-            file_path = os.path.join(uploads_path(), filename)
-            with open(file_path, 'wb') as f:
-                f.write(await image.read())
+        if photo_id:
             cursor.execute(
                 """
-                UPDATE films SET name = ?, description = ?, photo_status = 1, photo_id = ?, activate = 1, genre = ?, site = ? WHERE id = ?
+                UPDATE films SET name = ?, description = ?, photo_status = 1, photo_id = ?,
+                    telegram_file_id = CASE WHEN photo_id IS ? THEN telegram_file_id ELSE NULL END,
+                    activate = 1, genre = ?, site = ? WHERE id = ?
                 """,
-                (name, description, filename, genre, site, id)
+                (name, description, photo_id, photo_id, genre, site, id)
             )
         else:
             cursor.execute(
@@ -787,81 +657,84 @@ def create_app() -> FastAPI:
                 """,
                 (name, description, genre, site, id)
             )
-        conn.commit()
-        # normalize genres mapping (from provided string)
-        try:
-            import re as _re
-            parts = [p.strip() for p in _re.split(r"[,;]", genre or "") if p.strip()]
-            set_film_genres(conn, id, parts)
-        except Exception:
-            pass
+        if cursor.rowcount == 0:
+            return False
+        # normalize genres mapping (from provided string); ошибка откатывает и UPDATE выше
+        set_film_genres(conn, id, split_genres(genre))
+        return True
+
+    @app.put("/api/film/{id}")
+    async def update_film(request: Request, id: int, name: str = Form(...), genre: str = Form(...), description: str = Form(""), site: str = Form(""), image: UploadFile | None = File(None)):
+        login_required(request)
+        photo_id = await media_store.save_upload(image)
+        if not await database.write(_update_film_row, id, name, description, photo_id, genre, site):
+            raise HTTPException(status_code=404, detail="Фильм не найден")
+        await catalog.refresh(id)
+        if photo_id:
+            # Прежний постер мог остаться без ссылок
+            await media_store.collect_garbage()
         await sio.emit('notification', {'message': f'Фильм "{name}" обновлен. Код: {id}', 'type': 'info'})
-        await sio_get_films()
-        conn.close()
+        await films_feed.upsert(id)
         return JSONResponse({"message": "Фильм успешно обновлен"})
 
     @app.get("/api/users")
     async def get_users_api(request: Request):
         login_required(request)
-        conn = get_db_connection('users.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users ORDER BY id DESC")
-        users = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        rows = await database.fetchall("SELECT * FROM users ORDER BY id DESC", db_name='users.db')
+        users = [dict(row) for row in rows]
         return JSONResponse(users)
 
+    def _toggle_user_flag(conn, id: int, column: str, value: int | None):
+        """Flip (value=None) or set users.<column>; return (user row, new value)."""
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {column}, name, tg_id FROM users WHERE id = ?", (id,))
+        user = cursor.fetchone()
+        if not user:
+            return None, None
+        new_status = value if value is not None else (0 if user[column] else 1)
+        cursor.execute(f"UPDATE users SET {column} = ? WHERE id = ?", (new_status, id))
+        return user, new_status
+
+    def _forget_bot_user(tg_id) -> None:
+        # Бот держит строку пользователя в кэше — сбрасываем, чтобы бан и статус действовали сразу
+        try:
+            from app.bot.users import user_cache
+            user_cache.invalidate(int(tg_id))
+        except Exception:
+            pass
+
     @app.post("/api/user/{id}/toggle-admin")
     async def toggle_admin(request: Request, id: int):
         login_required(request)
-        conn = get_db_connection('users.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT admin, name FROM users WHERE id = ?", (id,))
-        user = cursor.fetchone()
+        user, new_status = await database.write(_toggle_user_flag, id, "admin", None, db_name='users.db')
         if not user:
-            conn.close()
             raise HTTPException(status_code=404, detail="Пользователь не найден")
-        new_status = 0 if user['admin'] else 1
-        cursor.execute("UPDATE users SET admin = ? WHERE id = ?", (new_status, id))
-        conn.commit()
+        _forget_bot_user(user["tg_id"])
         await sio.emit('notification', {'message': f'Пользователь "{user["name"]}" теперь {"траффер" if new_status else "пользователь"}', 'type': 'info'})
-        await sio_get_users()
-        conn.close()
+        await users_feed.upsert(id)
         return JSONResponse({"message": f"Статус пользователя изменен на {'траффер' if new_status else 'пользователь'}"})
 
     @app.post("/api/user/{id}/ban")
     async def ban_user(request: Request, id: int):
         login_required(request)
-        conn = get_db_connection('users.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM users WHERE id = ?", (id,))
-        user = cursor.fetchone()
+        user, _ = await database.write(_toggle_user_flag, id, "banned", 1, db_name='users.db')
         if not user:
-            conn.close()
             raise HTTPException(status_code=404, detail="Пользователь не найден")
-        cursor.execute("UPDATE users SET banned = 1 WHERE id = ?", (id,))
-        conn.commit()
+        _forget_bot_user(user["tg_id"])
         await sio.emit('notification', {'message': f'Пользователь "{user["name"]}" забанен', 'type': 'warning'})
-        await sio_get_users()
-        conn.close()
+        await users_feed.upsert(id)
         return JSONResponse({"message": "Пользователь забанен"})
 
     @app.post("/api/user/{id}/toggle-ban")
     async def toggle_ban(request: Request, id: int):
         login_required(request)
-        conn = get_db_connection('users.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT banned, name FROM users WHERE id = ?", (id,))
-        user = cursor.fetchone()
+        user, new_status = await database.write(_toggle_user_flag, id, "banned", None, db_name='users.db')
         if not user:
-            conn.close()
             raise HTTPException(status_code=404, detail="Пользователь не найден")
-        new_status = 0 if user['banned'] else 1
-        cursor.execute("UPDATE users SET banned = ? WHERE id = ?", (new_status, id))
-        conn.commit()
+        _forget_bot_user(user["tg_id"])
         msg = f'Пользователь "{user["name"]}" {"забанен" if new_status else "разбанен"}'
         await sio.emit('notification', {'message': msg, 'type': 'warning' if new_status else 'success'})
-        await sio_get_users()
-        conn.close()
+        await users_feed.upsert(id)
         return JSONResponse({"message": msg})
 
     # Background task queue endpoints (if task manager is available)
@@ -878,17 +751,59 @@ def create_app() -> FastAPI:
             job = await task_manager.enqueue("tmdb_single", {"movie_id": movie_id})
             return JSONResponse({"job_id": job["id"], "status": job["status"]}, status_code=202)
 
+        @app.post("/api/tasks/posters/prewarm")
+        async def enqueue_poster_prewarm(request: Request, chat_id: int | None = None):
+            login_required(request)
+            target = chat_id or settings.POSTER_CACHE_CHAT_ID
+            if not target:
+                raise HTTPException(status_code=400, detail="POSTER_CACHE_CHAT_ID не задан в .env")
+            job = await task_manager.enqueue("poster_prewarm", {"chat_id": target})
+            return JSONResponse({"job_id": job["id"], "status": job["status"]}, status_code=202)
+
+        @app.post("/api/tasks/broadcast")
+        async def enqueue_broadcast(request: Request, text: str = Form(...), film: str = Form("")):
+            login_required(request)
+            text = text.strip()
+            if not text:
+                raise HTTPException(status_code=400, detail="Текст рассылки пуст")
+            params: dict = {"text": text}
+            if film.strip():
+                await catalog.ensure_loaded()
+                rec = catalog.lookup(film.strip())
+                if rec is None:
+                    raise HTTPException(status_code=404, detail="Фильм не найден")
+                # Подпись к фото в Telegram ограничена 1024 символами
+                if len(text) > 1024:
+                    raise HTTPException(status_code=400, detail="Подпись к постеру длиннее 1024 символов")
+                params["film_id"] = rec.id
+            elif len(text) > 4096:
+                raise HTTPException(status_code=400, detail="Сообщение длиннее 4096 символов")
+            job = await task_manager.enqueue("broadcast", params)
+            return JSONResponse({"job_id": job["id"], "status": job["status"]}, status_code=202)
+
         @app.get("/api/tasks/{job_id}")
         async def get_task_status(request: Request, job_id: str):
             login_required(request)
-            j = task_manager.get_job(job_id)
+            j = await task_manager.get_job(job_id)
             if not j:
                 raise HTTPException(status_code=404, detail="Задача не найдена")
             return JSONResponse(j)
 
+        @app.post("/api/tasks/{job_id}/cancel")
+        async def cancel_task(request: Request, job_id: str):
+            login_required(request)
+            j, accepted = await task_manager.cancel(job_id)
+            if not j:
+                raise HTTPException(status_code=404, detail="Задача не найдена")
+            # Уже завершённую (в т.ч. отменённую ранее) задачу отменить нельзя
+            if not accepted:
+                return JSONResponse({"error": "Задача уже завершена", "status": j["status"]}, status_code=409)
+            return JSONResponse({"job_id": j["id"], "status": j["status"], "cancel_requested": j["cancel_requested"]}, status_code=202)
+
         @app.get("/api/tasks")
-        async def list_tasks(request: Request):
+        async def list_tasks(request: Request, cursor: int = 0, limit: int = Query(50, ge=1, le=200)):
             login_required(request)
-            return JSONResponse(task_manager.list_jobs())
+            jobs, next_cursor = await task_manager.list_jobs(cursor or None, limit)
+            return JSONResponse({"jobs": jobs, "next_cursor": next_cursor, "queue": task_manager.queue_stats()})
 
     return app
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from typing import AsyncIterator, Dict, Optional
+
+from app.db.aio import database
+from app.db.media import forget_media, released_media
+from app.web.static import allowed_file, uploads_path
+from app.web.thumbs import thumbnailer
+
+CHUNK_SIZE = 64 * 1024
+# Сколько накапливать в памяти перед записью на диск (пишем в потоке, не в цикле событий)
+WRITE_BUFFER = 1024 * 1024
+
+
+class MediaStore:
+    """Content-addressed poster storage in the uploads folder.
+
+    Bodies are streamed to a temp file in chunks while hashing, then renamed
+    to <sha256>.<ext>; a file that already exists is simply reused, so the
+    same poster is stored once however many films point at it.
+    """
+
+    # Свежесохранённый файл ещё может быть не привязан к фильму — GC его не трогает
+    GRACE_SECONDS = 600
+
+    def __init__(self) -> None:
+        self._recent: Dict[str, float] = {}
+
+    async def save_stream(self, chunks: AsyncIterator[bytes], ext: str) -> Optional[str]:
+        """Store a stream of bytes; return the file name, or None if it was empty."""
+        folder = uploads_path()
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".upload-", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                buf: list = []
+                buffered = 0
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    digest.update(chunk)
+                    buf.append(chunk)
+                    buffered += len(chunk)
+                    size += len(chunk)
+                    if buffered >= WRITE_BUFFER:
+                        await asyncio.to_thread(f.writelines, buf)
+                        buf, buffered = [], 0
+                if buf:
+                    await asyncio.to_thread(f.writelines, buf)
+            if not size:
+                return None
+            name = f"{digest.hexdigest()}.{ext.lower()}"
+            await asyncio.to_thread(self._commit, tmp, os.path.join(folder, name))
+            self._recent[name] = time.monotonic()
+            # Миниатюры и WebP для админки — в фоне, ответ не ждёт
+            thumbnailer.schedule(name)
+            return name
+        finally:
+            if os.path.exists(tmp):
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _commit(tmp: str, dst: str) -> None:
+        if os.path.exists(dst):
+            os.remove(tmp)
+        else:
+            os.replace(tmp, dst)
+
+    async def save_upload(self, upload) -> Optional[str]:
+        """Store a FastAPI UploadFile with an allowed extension."""
+        if not upload or not upload.filename or not allowed_file(upload.filename):
+            return None
+        ext = upload.filename.rsplit(".", 1)[1]
+
+        async def _chunks():
+            while True:
+                chunk = await upload.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+        return await self.save_stream(_chunks(), ext)
+
+    async def collect_garbage(self) -> int:
+        """Delete files no film references any more; return how many were removed."""
+        now = time.monotonic()
+        self._recent = {n: t for n, t in self._recent.items() if now - t < self.GRACE_SECONDS}
+        names = [n for n in await database.read(released_media) if n not in self._recent]
+        removed = []
+        folder = uploads_path()
+        for name in names:
+            # photo_id — это имя файла; ничего за пределами uploads не трогаем
+            if os.path.basename(name) != name:
+                continue
+            try:
+                os.remove(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            thumbnailer.remove(name)
+            removed.append(name)
+        if removed:
+            await database.write(forget_media, removed)
+        return len(removed)
+
+
+media_store = MediaStore()
@@ -1,63 +1,140 @@
+import asyncio
+
 import socketio
-from app.db.sqlite import get_db_connection
+from app.db.aio import database
+from app.db.catalog import catalog
+from app.web.media import media_store
 
 sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins='*')
 sio_app = socketio.ASGIApp(sio)
 
 
+# Сколько строк отдаём в одной странице снимка таблицы
+SNAPSHOT_PAGE = 200
+
+
+class ChangeFeed:
+    """Row-level change events for one table.
+
+    Clients get a paginated snapshot on connect and then only per-row
+    'upsert'/'delete' deltas. Every delta carries the next version number;
+    a client that sees a gap re-requests the snapshot.
+    """
+
+    def __init__(self, table: str, db_name: str) -> None:
+        self.table = table
+        self.db_name = db_name
+        self.version = 0
+        # Держим порядок версий: чтение строк и отправка дельты идут под одним замком
+        self._lock = asyncio.Lock()
+
+    async def _emit(self, op: str, **payload) -> None:
+        self.version += 1
+        await sio.emit(f'{self.table}_delta', {'op': op, 'version': self.version, **payload})
+
+    async def upsert(self, *ids: int) -> None:
+        """Publish the current state of the given rows (missing rows become deletes)."""
+        ids = [int(i) for i in ids if i]
+        if not ids:
+            return
+        marks = ",".join("?" * len(ids))
+        async with self._lock:
+            rows = await database.fetchall(
+                f"SELECT * FROM {self.table} WHERE id IN ({marks}) ORDER BY id DESC", ids, db_name=self.db_name
+            )
+            found = [dict(row) for row in rows]
+            gone = sorted(set(ids) - {r['id'] for r in found})
+            if found:
+                await self._emit('upsert', rows=found)
+            if gone:
+                await self._emit('delete', ids=gone)
+
+    async def delete(self, *ids: int) -> None:
+        ids = [int(i) for i in ids if i]
+        if not ids:
+            return
+        async with self._lock:
+            await self._emit('delete', ids=ids)
+
+    async def snapshot(self, sid, cursor: int | None = None, limit: int = SNAPSHOT_PAGE) -> None:
+        """Send one page (ordered by id DESC, starting below `cursor`) to `sid` only."""
+        sql = f"SELECT * FROM {self.table}"
+        params: list = []
+        if cursor:
+            sql += " WHERE id < ?"
+            params.append(int(cursor))
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit + 1)
+        # Отправляем тоже под замком, чтобы дельта не обогнала снимок, из которого она следует
+        async with self._lock:
+            rows = await database.fetchall(sql, params, db_name=self.db_name)
+            items = [dict(row) for row in rows[:limit]]
+            next_cursor = items[-1]['id'] if len(rows) > limit else None
+            await sio.emit(
+                f'{self.table}_snapshot',
+                {'version': self.version, 'cursor': cursor, 'next_cursor': next_cursor, 'rows': items},
+                to=sid,
+            )
+
+
+films_feed = ChangeFeed('films', 'films.db')
+users_feed = ChangeFeed('users', 'users.db')
+
+
 @sio.event
 async def connect(sid, environ):
-    await get_films()
-    await get_users()
+    # Первую страницу получает только подключившийся клиент
+    await films_feed.snapshot(sid)
+    await users_feed.snapshot(sid)
 
 
-@sio.event
-async def get_films(sid=None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM films ORDER BY id DESC")
-    films = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    await sio.emit('update_films', films)
-    await sio.emit('films', films)
+def _cursor(data) -> int | None:
+    try:
+        return int((data or {}).get('cursor') or 0) or None
+    except (AttributeError, TypeError, ValueError):
+        return None
 
 
 @sio.event
-async def get_users(sid=None):
-    conn = get_db_connection('users.db')
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users ORDER BY id DESC")
-    users = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    await sio.emit('update_users', users)
-    await sio.emit('users', users)
+async def get_films(sid, data=None):
+    await films_feed.snapshot(sid, _cursor(data))
 
 
 @sio.event
-async def delete_film(sid, id: int):
-    conn = get_db_connection()
+async def get_users(sid, data=None):
+    await users_feed.snapshot(sid, _cursor(data))
+
+
+def _delete_film_row(conn, id: int):
     cursor = conn.cursor()
     cursor.execute("SELECT name, code FROM films WHERE id = ?", (id,))
     film = cursor.fetchone()
+    if not film:
+        return None
+    cursor.execute("DELETE FROM films WHERE id = ?", (id,))
+    # Если таблица фильмов стала пустой, сбрасываем автонумерацию ID
+    try:
+        cursor.execute("SELECT COUNT(*) FROM films")
+        cnt = cursor.fetchone()[0]
+        if cnt == 0:
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name='films'")
+    except Exception:
+        # На случай необычной конфигурации SQLite просто игнорируем сбой сброса последовательности
+        pass
+    return film
+
+
+@sio.event
+async def delete_film(sid, id: int):
+    film = await database.write(_delete_film_row, id)
+    catalog.remove(id)
     if film:
         film_name = film['name']
         film_code = film['code'] if 'code' in film.keys() else None
-        cursor.execute("DELETE FROM films WHERE id = ?", (id,))
-        conn.commit()
-        # Если таблица фильмов стала пустой, сбрасываем автонумерацию ID
-        try:
-            cursor.execute("SELECT COUNT(*) FROM films")
-            cnt = cursor.fetchone()[0]
-            if cnt == 0:
-                cursor.execute("DELETE FROM sqlite_sequence WHERE name='films'")
-                conn.commit()
-        except Exception:
-            # На случай необычной конфигурации SQLite просто игнорируем сбой сброса последовательности
-            pass
-        conn.close()
         code_part = f" Код: {film_code}" if film_code else f" ID: {id}"
         await sio.emit('notification', {'message': f'Фильм "{film_name}" удален.{code_part}', 'type': 'info'})
-        await get_films()
+        await films_feed.delete(id)
+        # Постер больше никому не нужен — удаляем файл
+        await media_store.collect_garbage()
     else:
-        conn.close()
         await sio.emit('notification', {'message': f'Фильм с кодом {id} не найден', 'type': 'error'})
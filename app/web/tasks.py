@@ -1,41 +1,110 @@
 import asyncio
-import json
-import os
+import itertools
 import random
 import time
-import urllib.parse
-import urllib.request
-from typing import Any, Dict, List, Optional
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 from app.core.settings import settings
-from app.db.sqlite import get_db_connection, set_film_genres
-from app.web.static import uploads_path
-from app.web.sockets import sio, get_films as sio_get_films
+
+from app.db.aio import database
+from app.db.broadcasts import (
+    BLOCKED, FAILED, PENDING, SENT, add_recipients, audience_page, audience_size, broadcast_progress, mark_recipients,
+    pending_recipients,
+)
+from app.db.catalog import catalog
+from app.db.jobs import JOBS_DB, get_job as db_get_job, list_jobs as db_list_jobs, job_row, load_unfinished, prune_jobs, save_jobs
+from app.db.sqlite import find_external_film, find_external_films, insert_films
+from app.web.sockets import sio, films_feed
+from app.web.tmdb import tmdb
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler when its job was cancelled through the API."""
 
 
 class TaskManager:
-    def __init__(self) -> None:
-        self._queue: "asyncio.Queue[dict]" = asyncio.Queue()
+    # Меньше — раньше: одиночный импорт из админки не ждёт массовых задач
+    PRIORITIES = {"tmdb_single": 0, "tmdb_popular": 10, "poster_prewarm": 20, "broadcast": 30}
+    # Сколько задач одного типа может выполняться одновременно (нет ключа — без ограничения)
+    TYPE_LIMITS = {"tmdb_popular": 1, "poster_prewarm": 1, "broadcast": 1}
+    FINISHED = ("done", "error", "cancelled")
+
+    def __init__(self, workers: int = 4, flush_interval: float = 1.0, history: int = 1000) -> None:
+        self._workers = max(1, int(workers))
+        self._queue: "asyncio.PriorityQueue[tuple[int, int, str]]" = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        # В памяти только незавершённые задачи; всё остальное — в jobs.db
         self._jobs: Dict[str, dict] = {}
-        self._worker_task: Optional[asyncio.Task] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self._flush_task: Optional[asyncio.Task] = None
         self._running = False
-        self._max_history = 100  # keep recent jobs in memory
+        self._active: Dict[str, int] = defaultdict(int)
+        # Задачи, упёршиеся в TYPE_LIMITS; возвращаются в очередь, когда освобождается слот
+        self._deferred: Dict[str, Deque[str]] = defaultdict(deque)
+        # Прогресс пишем пачками раз в flush_interval, а не на каждый шаг
+        self._dirty: Dict[str, dict] = {}
+        self._flush_interval = flush_interval
+        self._history = history
 
     async def start(self) -> None:
         if self._running:
             return
         self._running = True
-        self._worker_task = asyncio.create_task(self._worker())
+        await self._restore()
+        self._flush_task = asyncio.create_task(self._flusher())
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
 
     async def stop(self) -> None:
         self._running = False
-        if self._worker_task:
-            self._worker_task.cancel()
+        tasks = self._worker_tasks + ([self._flush_task] if self._flush_task else [])
+        for t in tasks:
+            t.cancel()
+        for t in tasks:
             try:
-                await self._worker_task
-            except Exception:
+                await t
+            except BaseException:
                 pass
-            self._worker_task = None
+        self._worker_tasks = []
+        self._flush_task = None
+        # Прерванные задачи остаются в базе как running и будут перезапущены при старте
+        await self._flush()
+
+    # --- persistence ---
+    async def _restore(self) -> None:
+        """Re-enqueue jobs that were pending or running when the process stopped."""
+        await database.write(prune_jobs, self._history, db_name=JOBS_DB)
+        for job in await database.read(load_unfinished, db_name=JOBS_DB):
+            if job["cancel_requested"]:
+                job["status"] = "cancelled"
+            else:
+                job["status"] = "pending"
+                job["progress"] = 0
+            job["updated_at"] = time.time()
+            await self._persist(job)
+            if job["status"] == "pending":
+                self._jobs[job["id"]] = job
+                self._put(job)
+
+    async def _persist(self, job: dict) -> None:
+        """Write a job right away (creation and status changes must not be lost)."""
+        self._dirty.pop(job["id"], None)
+        await database.write(save_jobs, [job_row(job)], db_name=JOBS_DB)
+
+    async def _flush(self) -> None:
+        if not self._dirty:
+            return
+        batch = [job_row(j) for j in self._dirty.values()]
+        self._dirty = {}
+        try:
+            await database.write(save_jobs, batch, db_name=JOBS_DB)
+        except Exception:
+            pass
+
+    async def _flusher(self) -> None:
+        while self._running:
+            await asyncio.sleep(self._flush_interval)
+            await self._flush()
 
     def _new_job(self, jtype: str, params: dict) -> dict:
         jid = f"{int(time.time()*1000)}-{random.randint(1000,9999)}"
@@ -43,70 +112,132 @@ class TaskManager:
             "id": jid,
             "type": jtype,
             "params": params,
-            "status": "pending",  # pending | running | done | error
+            "status": "pending",  # pending | running | done | error | cancelled
             "progress": 0,
             "created_at": time.time(),
             "updated_at": time.time(),
             "meta": {},
             "error": None,
+            "cancel_requested": False,
         }
         self._jobs[jid] = job
-        # trim history (keep last N by created_at)
-        if len(self._jobs) > self._max_history:
-            # delete oldest done jobs first
-            done = [j for j in self._jobs.values() if j.get("status") in ("done", "error")]
-            done.sort(key=lambda x: x.get("created_at", 0))
-            for x in done[: max(0, len(self._jobs) - self._max_history)]:
-                self._jobs.pop(x["id"], None)
         return job
 
+    def _put(self, job: dict) -> None:
+        self._queue.put_nowait((self.PRIORITIES.get(job["type"], 50), next(self._seq), job["id"]))
+
     async def enqueue(self, jtype: str, params: dict) -> dict:
         job = self._new_job(jtype, params)
-        await self._queue.put(job["id"])
+        await self._persist(job)
+        self._put(job)
         await self._emit_update(job)
         return job
 
-    def get_job(self, job_id: str) -> Optional[dict]:
+    async def get_job(self, job_id: str) -> Optional[dict]:
         j = self._jobs.get(job_id)
-        if not j:
-            return None
-        return dict(j)
+        if j:
+            return dict(j)
+        return await database.read(db_get_job, job_id, db_name=JOBS_DB)
+
+    async def list_jobs(self, cursor: Optional[int] = None, limit: int = 50) -> Tuple[List[dict], Optional[int]]:
+        """One page from the store, newest first; live jobs show their in-memory state."""
+        jobs, next_cursor = await database.read(db_list_jobs, cursor, limit, db_name=JOBS_DB)
+        return [dict(self._jobs.get(j["id"]) or j) for j in jobs], next_cursor
+
+    def queue_stats(self) -> dict:
+        busy = sum(self._active.values())
+        return {
+            "workers": self._workers,
+            "busy": busy,
+            "utilisation": round(busy / self._workers, 2),
+            "queued": sum(1 for j in self._jobs.values() if j["status"] == "pending"),
+            "running_by_type": {k: v for k, v in self._active.items() if v},
+        }
+
+    async def cancel(self, job_id: str) -> Tuple[Optional[dict], bool]:
+        """Cancel a job: pending ones immediately, running ones at their next checkpoint.
+
+        Returns (job, accepted); accepted is False when the job had already finished.
+        """
+        job = self._jobs.get(job_id)
+        if not job:
+            # Завершённая задача (done/error/cancelled): просто вернём её состояние
+            return await database.read(db_get_job, job_id, db_name=JOBS_DB), False
+        if job["status"] == "pending":
+            job["status"] = "cancelled"
+            job["updated_at"] = time.time()
+            self._jobs.pop(job_id, None)
+            await self._persist(job)
+            await self._emit_update(job)
+        elif job["status"] == "running" and not job["cancel_requested"]:
+            job["cancel_requested"] = True
+            job["updated_at"] = time.time()
+            await self._persist(job)
+            await self._emit_update(job)
+        return dict(job), True
 
-    def list_jobs(self) -> List[dict]:
-        # sort by created_at desc
-        return [dict(self._jobs[jid]) for jid in sorted(self._jobs.keys(), key=lambda k: self._jobs[k]["created_at"], reverse=True)]
+    @staticmethod
+    def _check_cancelled(job: dict) -> None:
+        if job.get("cancel_requested"):
+            raise JobCancelled()
 
     async def _worker(self) -> None:
         while self._running:
             try:
-                jid = await self._queue.get()
+                _, _, jid = await self._queue.get()
             except asyncio.CancelledError:
                 break
-            job = self._jobs.get(jid)
-            if not job:
-                continue
             try:
-                job["status"] = "running"
-                job["updated_at"] = time.time()
-                await self._emit_update(job)
-                if job["type"] == "tmdb_single":
-                    await self._handle_tmdb_single(job)
-                elif job["type"] == "tmdb_popular":
-                    await self._handle_tmdb_popular(job)
-                else:
-                    raise RuntimeError(f"Unknown job type: {job['type']}")
-                job["status"] = "done"
-                job["progress"] = 100
-                job["updated_at"] = time.time()
-                await self._emit_update(job)
-            except Exception as e:
-                job["status"] = "error"
-                job["error"] = str(e)
-                job["updated_at"] = time.time()
-                await self._emit_update(job)
+                job = self._jobs.get(jid)
+                if not job or job["status"] != "pending":
+                    continue  # отменена, пока ждала в очереди
+                limit = self.TYPE_LIMITS.get(job["type"])
+                if limit is not None and self._active[job["type"]] >= limit:
+                    self._deferred[job["type"]].append(jid)
+                    continue
+                await self._run(job)
             finally:
                 self._queue.task_done()
 
+    async def _run(self, job: dict) -> None:
+        jtype = job["type"]
+        self._active[jtype] += 1
+        try:
+            job["status"] = "running"
+            job["updated_at"] = time.time()
+            await self._persist(job)
+            await self._emit_update(job)
+            if jtype == "tmdb_single":
+                await self._handle_tmdb_single(job)
+            elif jtype == "tmdb_popular":
+                await self._handle_tmdb_popular(job)
+            elif jtype == "poster_prewarm":
+                await self._handle_poster_prewarm(job)
+            elif jtype == "broadcast":
+                await self._handle_broadcast(job)
+            else:
+                raise RuntimeError(f"Unknown job type: {jtype}")
+            job["status"] = "done"
+            job["progress"] = 100
+        except JobCancelled:
+            job["status"] = "cancelled"
+        except Exception as e:
+            job["status"] = "error"
+            job["error"] = str(e)
+        finally:
+            self._active[jtype] -= 1
+            job["updated_at"] = time.time()
+            # Освободился слот типа — возвращаем в очередь первую отложенную задачу
+            deferred = self._deferred[jtype]
+            while deferred:
+                nxt = self._jobs.get(deferred.popleft())
+                if nxt and nxt["status"] == "pending":
+                    self._put(nxt)
+                    break
+        self._jobs.pop(job["id"], None)
+        await self._persist(job)
+        await self._emit_update(job)
+
     async def _emit_update(self, job: dict) -> None:
         # Send sanitized payload to clients
         payload = {
@@ -116,190 +247,126 @@ class TaskManager:
             "progress": int(job.get("progress") or 0),
             "meta": job.get("meta") or {},
             "error": job.get("error"),
+            "cancel_requested": bool(job.get("cancel_requested")),
             "created_at": job.get("created_at"),
             "updated_at": job.get("updated_at"),
+            "queue": self.queue_stats(),
         }
+        if job["status"] == "running":
+            self._dirty[job["id"]] = job
         try:
             await sio.emit("task_update", payload)
         except Exception:
             pass
 
-    # --- TMDb helpers ---
-    def _tmdb_request(self, path: str, params: Optional[dict] = None) -> dict:
-        if not settings.TMDB_API_KEY:
-            raise RuntimeError("TMDB_API_KEY не задан в .env")
-        base = "https://api.themoviedb.org/3"
-        q = {"api_key": settings.TMDB_API_KEY, "language": settings.TMDB_LANGUAGE}
-        if params:
-            q.update(params)
-        url = f"{base}{path}?" + urllib.parse.urlencode(q)
-        with urllib.request.urlopen(url, timeout=15) as r:
-            data = r.read()
-            return json.loads(data.decode("utf-8"))
+    # --- TMDb import pipeline ---
+    # details + poster are fetched concurrently (bounded by the TMDb client),
+    # finished films are inserted in batches, one write transaction per batch.
+    IMPORT_BATCH = 10
 
-    async def _handle_tmdb_single(self, job: dict) -> None:
-        movie_id = int(job["params"].get("movie_id"))
-        # Duplicate check
-        conn = get_db_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT id FROM films WHERE external_source = ? AND external_id = ?",
-                ("tmdb", str(movie_id)),
+    async def _insert_movies(self, movies: List[dict]) -> List[dict]:
+        """Insert fetched films; return [{"id", "code", "name"}] for the ones added."""
+
+        def _insert(conn) -> List[dict]:
+            # Дубликат мог появиться, пока мы качали данные — skip_existing его отсеет
+            rows = insert_films(
+                conn,
+                [
+                    {**m, "external_source": "tmdb", "external_id": str(m["movie_id"])}
+                    for m in movies
+                ],
+                skip_existing=True,
             )
-            if cur.fetchone():
-                job["meta"] = {"duplicate": True}
-                job["progress"] = 100
-                return
-            # Fetch details
-            d = self._tmdb_request(f"/movie/{movie_id}", {})
-            name = d.get("title") or d.get("name") or "Без названия"
-            description = d.get("overview") or ""
-            genre_list = [g.get("name") for g in d.get("genres", []) if g.get("name")]
-            genres = ", ".join(genre_list)
-            site = d.get("homepage") or ""
-            poster_path = d.get("poster_path")
-            photo_id = None
-            if poster_path:
-                try:
-                    base = settings.TMDB_IMAGE_BASE
-                    url = f"{base}/w500{poster_path}"
-                    fn = f"tmdb_{movie_id}.jpg"
-                    file_path = os.path.join(uploads_path(), fn)
-                    with urllib.request.urlopen(url, timeout=15) as r, open(file_path, "wb") as f:
-                        f.write(r.read())
-                    photo_id = fn
-                except Exception:
-                    photo_id = None
-            # Insert
-            import sqlite3
+            return [
+                {"id": r[0], "code": r[1], "name": m["name"]}
+                for m, r in zip(movies, rows) if r is not None
+            ]
 
-            def gen() -> str:
-                return f"{random.randint(10000, 99999)}"
+        items = await database.write(_insert)
+        await catalog.refresh(*(it["id"] for it in items))
+        return items
 
-            code = gen()
-            with conn:
-                c = conn.cursor()
-                for _ in range(7):
-                    try:
-                        c.execute(
-                            """
-                            INSERT INTO films (name, description, photo_status, photo_id, activate, genre, site, code, external_source, external_id)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """,
-                            (name, description, 1 if photo_id else 0, photo_id, 1, genres, site, code, "tmdb", str(movie_id)),
-                        )
-                        break
-                    except sqlite3.IntegrityError:
-                        code = gen()
-                film_id = c.lastrowid
-            # normalize genres mapping
-            try:
-                set_film_genres(conn, film_id, genre_list)
-            except Exception:
-                pass
-            job["meta"] = {"id": film_id, "code": code, "name": name}
+    async def _handle_tmdb_single(self, job: dict) -> None:
+        movie_id = int(job["params"].get("movie_id"))
+        # Duplicate check
+        if await database.read(find_external_film, "tmdb", str(movie_id)):
+            job["meta"] = {"duplicate": True}
             job["progress"] = 100
-            # notify UI
-            try:
-                await sio.emit("notification", {"message": f'Импортировано из TMDb: "{name}". Код: {code}', "type": "success"})
-                await sio_get_films()
-            except Exception:
-                pass
-        finally:
-            conn.close()
+            return
+        movie = await tmdb.fetch_movie(movie_id)
+        self._check_cancelled(job)
+        items = await self._insert_movies([movie])
+        if not items:
+            job["meta"] = {"duplicate": True}
+            job["progress"] = 100
+            return
+        item = items[0]
+        job["meta"] = item
+        job["progress"] = 100
+        # notify UI
+        try:
+            await sio.emit("notification", {"message": f'Импортировано из TMDb: "{item["name"]}". Код: {item["code"]}', "type": "success"})
+            await films_feed.upsert(item["id"])
+        except Exception:
+            pass
 
     async def _handle_tmdb_popular(self, job: dict) -> None:
         count = int(job["params"].get("count") or 0)
         if count <= 0:
             count = 1
         # Pick random page then sample N ids
-        first_page = self._tmdb_request("/movie/popular", {"page": 1})
+        first_page = await tmdb.get_json("/movie/popular", {"page": 1})
         total_pages = int(first_page.get("total_pages", 1) or 1)
         max_page = min(total_pages, 500)
         rnd_page = random.randint(1, max_page)
-        data = first_page if rnd_page == 1 else self._tmdb_request("/movie/popular", {"page": rnd_page})
+        data = first_page if rnd_page == 1 else await tmdb.get_json("/movie/popular", {"page": rnd_page})
         results = [it.get("id") for it in data.get("results", []) if it.get("id")]
         if not results:
             job["meta"] = {"requested": count, "imported": 0, "skipped": 0}
             job["progress"] = 100
             return
         ids = random.sample(results, k=min(count, len(results)))
-        job["meta"] = {"requested": len(ids), "imported": 0, "skipped": 0, "failed": 0}
+
+        # duplicate check — одним запросом для всей выборки
+        existing = await database.read(find_external_films, "tmdb", [str(i) for i in ids])
+        todo = [i for i in ids if str(i) not in existing]
+        skipped = len(ids) - len(todo)
+        job["meta"] = {"requested": len(ids), "imported": 0, "skipped": skipped, "failed": 0}
         await self._emit_update(job)
 
-        conn = get_db_connection()
-        c = conn.cursor()
-        imported = []
-        skipped = 0
+        imported: List[dict] = []
+        pending: List[dict] = []
         failed = 0
-
-        import sqlite3
-
-        def gen() -> str:
-            return f"{random.randint(10000, 99999)}"
-
-        for idx, movie_id in enumerate(ids, start=1):
-            # update progress step-wise
-            job["progress"] = int((idx - 1) * 100 / len(ids))
-            job["updated_at"] = time.time()
-            await self._emit_update(job)
-            try:
-                # duplicate check
-                c.execute(
-                    "SELECT id FROM films WHERE external_source = ? AND external_id = ?",
-                    ("tmdb", str(movie_id)),
-                )
-                if c.fetchone():
-                    skipped += 1
-                    job["meta"].update({"skipped": skipped})
-                    continue
-                # fetch details
-                d = self._tmdb_request(f"/movie/{movie_id}", {})
-                name = d.get("title") or d.get("name") or "Без названия"
-                description = d.get("overview") or ""
-                genre_list = [g.get("name") for g in d.get("genres", []) if g.get("name")]
-                genres = ", ".join(genre_list)
-                site = d.get("homepage") or ""
-                poster_path = d.get("poster_path")
-                photo_id = None
-                if poster_path:
-                    try:
-                        base = settings.TMDB_IMAGE_BASE
-                        url = f"{base}/w500{poster_path}"
-                        fn = f"tmdb_{movie_id}.jpg"
-                        file_path = os.path.join(uploads_path(), fn)
-                        with urllib.request.urlopen(url, timeout=15) as r, open(file_path, "wb") as f:
-                            f.write(r.read())
-                        photo_id = fn
-                    except Exception:
-                        photo_id = None
-                code = gen()
-                for _ in range(7):
-                    try:
-                        c.execute(
-                            """
-                            INSERT INTO films (name, description, photo_status, photo_id, activate, genre, site, code, external_source, external_id)
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                            """,
-                            (name, description, 1 if photo_id else 0, photo_id, 1, genres, site, code, "tmdb", str(movie_id)),
-                        )
-                        break
-                    except sqlite3.IntegrityError:
-                        code = gen()
-                film_id = c.lastrowid
-                # normalize genres mapping
+        fetches = [asyncio.create_task(tmdb.fetch_movie(i)) for i in todo]
+        try:
+            for done, fut in enumerate(asyncio.as_completed(fetches), start=1):
                 try:
-                    set_film_genres(conn, film_id, genre_list)
+                    pending.append(await fut)
                 except Exception:
-                    pass
-                imported.append({"id": film_id, "code": code, "name": name})
-                job["meta"].update({"imported": len(imported)})
-            except Exception:
-                failed += 1
-                job["meta"].update({"failed": failed})
-                continue
-        conn.commit()
+                    failed += 1
+                if job["cancel_requested"]:
+                    # Уже скачанное сохраняем, остальное бросаем
+                    if pending:
+                        imported += await self._insert_movies(pending)
+                    job["meta"].update({"imported": len(imported), "failed": failed, "items": imported})
+                    await films_feed.upsert(*(it["id"] for it in imported))
+                    raise JobCancelled()
+                if len(pending) >= self.IMPORT_BATCH:
+                    imported += await self._insert_movies(pending)
+                    pending = []
+                job["progress"] = int(done * 100 / (len(todo) + 1))
+                job["updated_at"] = time.time()
+                job["meta"].update({"imported": len(imported), "failed": failed})
+                await self._emit_update(job)
+        finally:
+            # При отмене или ошибке гасим недокачанное и дожидаемся его, чтобы не оставлять висящих задач
+            for t in fetches:
+                t.cancel()
+            await asyncio.gather(*fetches, return_exceptions=True)
+        if pending:
+            imported += await self._insert_movies(pending)
+        # Дубликаты, отсеянные уже при вставке
+        skipped = len(ids) - len(imported) - failed
         try:
             await sio.emit(
                 "notification",
@@ -308,14 +375,158 @@ class TaskManager:
                     "type": "success" if imported else "warning",
                 },
             )
-            await sio_get_films()
+            await films_feed.upsert(*(it["id"] for it in imported))
         except Exception:
             pass
-        finally:
-            conn.close()
         job["progress"] = 100
-        job["meta"].update({"items": imported, "skipped": skipped})
+        job["meta"].update({"imported": len(imported), "failed": failed, "items": imported, "skipped": skipped})
+
+    # --- Telegram poster cache ---
+    async def _handle_poster_prewarm(self, job: dict) -> None:
+        """Upload posters lacking a Telegram file_id to a service chat and keep the ids."""
+        from aiogram.exceptions import TelegramRetryAfter
+        from app.bot.instance import bot, outbound
+        from app.bot.posters import send_poster
+
+        chat_id = int(job["params"].get("chat_id") or 0)
+        if not chat_id:
+            raise RuntimeError("POSTER_CACHE_CHAT_ID не задан в .env")
+        await catalog.ensure_loaded()
+        rows = await database.fetchall(
+            """
+            SELECT id FROM films
+            WHERE activate = 1 AND photo_id IS NOT NULL AND photo_id != ''
+              AND (telegram_file_id IS NULL OR telegram_file_id = '')
+            ORDER BY id
+            """
+        )
+        ids = [int(r["id"]) for r in rows]
+        job["meta"] = {"total": len(ids), "uploaded": 0, "failed": 0}
+        await self._emit_update(job)
+        # Служебный чат — массовая полоса исходящих, ответы пользователям её не ждут
+        with outbound.bulk():
+            for idx, film_id in enumerate(ids, start=1):
+                self._check_cancelled(job)
+                film = catalog.get_by_id(film_id)
+                if film is None or film.file_id:
+                    continue
+                for _ in range(3):
+                    try:
+                        m = await send_poster(bot, chat_id, film)
+                        if m:
+                            job["meta"]["uploaded"] += 1
+                            try:
+                                await bot.delete_message(chat_id, m.message_id)
+                            except Exception:
+                                pass
+                        break
+                    except TelegramRetryAfter as e:
+                        await asyncio.sleep(e.retry_after)
+                    except Exception:
+                        job["meta"]["failed"] += 1
+                        break
+                if idx % 10 == 0 or idx == len(ids):
+                    job["progress"] = int(idx * 100 / len(ids))
+                    job["updated_at"] = time.time()
+                    await self._emit_update(job)
+        job["progress"] = 100
+
+    # --- Broadcasts ---
+    # Получатели берутся из users.db страницами по id и записываются в jobs.db
+    # до отправки; статус каждого сохраняется после своей пачки, поэтому
+    # перезапущенная задача досылает только тех, кто ещё не получил сообщение.
+    # Временные сбои остаются в очереди и повторяются отдельным проходом.
+    BROADCAST_CHUNK = 200
+    BROADCAST_RETRY_DELAY = 10.0
+
+    async def _handle_broadcast(self, job: dict) -> None:
+        """Send a text (optionally under a film poster) to every user who is not banned."""
+        from app.bot.instance import bot
+
+        text = job["params"].get("text") or ""
+        film = None
+        if job["params"].get("film_id"):
+            await catalog.ensure_loaded()
+            film = catalog.get_by_id(int(job["params"]["film_id"]))
+            if film is None:
+                raise RuntimeError("Фильм для рассылки не найден")
+        total = await database.read(audience_size, db_name='users.db')
+        counts, cursor = await database.read(broadcast_progress, job["id"], db_name=JOBS_DB)
+        del counts["pending"]
+        job["meta"] = {"total": total, **counts}
+        await self._emit_update(job)
+
+        # Сначала — оставшиеся с прошлого запуска, затем новые страницы пользователей
+        after = 0
+        while True:
+            self._check_cancelled(job)
+            page = await database.read(pending_recipients, job["id"], after, self.BROADCAST_CHUNK, db_name=JOBS_DB)
+            if not page:
+                page = await database.read(audience_page, cursor, self.BROADCAST_CHUNK, db_name='users.db')
+                if not page:
+                    if not after or not await database.read(pending_recipients, job["id"], 0, 1, db_name=JOBS_DB):
+                        break
+                    # Аудитория пройдена — ещё один проход по временным сбоям.
+                    # Каждый проход тратит попытку, так что цикл конечен (MAX_ATTEMPTS).
+                    after = 0
+                    await asyncio.sleep(self.BROADCAST_RETRY_DELAY)
+                    continue
+                await database.write(add_recipients, job["id"], page, db_name=JOBS_DB)
+                cursor = page[-1][0]
+            after = page[-1][0]
+            await self._send_broadcast_page(job, bot, page, text, film)
+            meta = job["meta"]
+            done = meta["sent"] + meta["failed"] + meta["blocked"]
+            # Аудитория могла вырасти с начала задачи
+            meta["total"] = max(meta["total"], done)
+            job["progress"] = min(99, int(done * 100 / max(1, meta["total"])))
+            job["updated_at"] = time.time()
+            await self._emit_update(job)
+        self._check_cancelled(job)
+        job["progress"] = 100
+
+    async def _send_broadcast_page(self, job: dict, bot, page: List[Tuple[int, int]], text: str, film) -> None:
+        from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramMigrateToChat, TelegramNotFound
+        from app.bot.instance import outbound
+        from app.bot.posters import send_poster
+
+        queue: Deque[int] = deque(tg_id for _, tg_id in page)
+        results: List[Tuple[int, int, Optional[str]]] = []
+
+        async def send(tg_id: int) -> None:
+            try:
+                m = await send_poster(bot, tg_id, film, caption=text) if film is not None else None
+                if m is None:
+                    await bot.send_message(tg_id, text)
+                results.append((tg_id, SENT, None))
+            except TelegramForbiddenError as e:
+                # Пользователь заблокировал бота или удалил аккаунт
+                results.append((tg_id, BLOCKED, str(e)[:200]))
+            except (TelegramBadRequest, TelegramNotFound, TelegramMigrateToChat) as e:
+                # Чат не найден, аккаунт деактивирован и т.п. — повтор не поможет
+                results.append((tg_id, FAILED, str(e)[:200]))
+            except Exception as e:
+                # Сеть, 5xx после повторов планировщика — попробуем в следующем проходе
+                results.append((tg_id, PENDING, str(e)[:200]))
+
+        async def worker() -> None:
+            # Темп задаёт планировщик исходящих (массовая полоса, TG_BULK_RATE); здесь — только параллелизм
+            while queue and not job.get("cancel_requested"):
+                await send(queue.popleft())
+
+        try:
+            # Воркеры gather наследуют контекст, а с ним и пометку «массовый трафик»
+            with outbound.bulk():
+                await asyncio.gather(*(worker() for _ in range(min(len(queue), settings.BROADCAST_CONCURRENCY))))
+        finally:
+            # Сохраняем итоги даже при отмене или остановке — иначе при рестарте эти сообщения уйдут повторно
+            if results:
+                await database.write(mark_recipients, job["id"], results, db_name=JOBS_DB)
+                # Исчерпавшие попытки становятся FAILED в самой базе — счётчики берём оттуда
+                counts, _ = await database.read(broadcast_progress, job["id"], db_name=JOBS_DB)
+                del counts["pending"]
+                job["meta"].update(counts)
 
 
 # Export a singleton manager
-task_manager = TaskManager()
+task_manager = TaskManager(workers=settings.TASK_WORKERS, flush_interval=settings.JOB_FLUSH_INTERVAL, history=settings.JOB_HISTORY)
@@ -0,0 +1,109 @@
+import asyncio
+import os
+from typing import Optional, Set, Tuple
+
+from app.web.static import uploads_path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow необязателен: без него отдаём оригиналы
+    Image = None
+    ImageOps = None
+
+# Длинная сторона производных, px
+SIZES = {"thumb": 96, "card": 480}
+FORMATS = ("webp", "jpeg")
+DERIVED_DIR = "derived"
+
+
+def derived_folder() -> str:
+    path = os.path.join(uploads_path(), DERIVED_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def derived_name(name: str, size: str, fmt: str) -> str:
+    stem = name.rsplit(".", 1)[0]
+    return f"{stem}.{size}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def _render(src: str, size: str, fmt: str, dst: str) -> None:
+    with Image.open(src) as im:
+        im = ImageOps.exif_transpose(im)
+        im.thumbnail((SIZES[size], SIZES[size]))
+        if fmt == "jpeg" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        elif im.mode not in ("RGB", "RGBA", "L", "LA"):
+            im = im.convert("RGBA")
+        tmp = dst + ".part"
+        im.save(tmp, "WEBP" if fmt == "webp" else "JPEG", quality=80, optimize=True)
+    os.replace(tmp, dst)
+
+
+class Thumbnailer:
+    """Small JPEG/WebP copies of posters for the admin panel.
+
+    Originals are content-addressed, so a derivative never goes stale and
+    can be cached forever by name. Rendering runs in worker threads; at most
+    `concurrency` images are decoded at once.
+    """
+
+    def __init__(self, concurrency: int = 2) -> None:
+        self._concurrency = max(1, int(concurrency))
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    async def ensure(self, name: str, size: str, fmt: str) -> Optional[str]:
+        """Path to the derivative, rendering it if needed; None if it cannot be made."""
+        if not self.available or size not in SIZES or fmt not in FORMATS:
+            return None
+        src = os.path.join(uploads_path(), name)
+        dst = os.path.join(derived_folder(), derived_name(name, size, fmt))
+        if os.path.exists(dst):
+            return dst
+        if not os.path.exists(src):
+            return None
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._concurrency)
+        async with self._slots:
+            if not os.path.exists(dst):
+                try:
+                    await asyncio.to_thread(_render, src, size, fmt, dst)
+                except Exception:
+                    return None
+        return dst
+
+    def schedule(self, name: Optional[str]) -> None:
+        """Render every size/format of a freshly stored poster in the background."""
+        if not name or not self.available:
+            return
+
+        async def _all() -> None:
+            for size in SIZES:
+                for fmt in FORMATS:
+                    await self.ensure(name, size, fmt)
+
+        task = asyncio.create_task(_all())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def remove(self, name: str) -> None:
+        folder = os.path.join(uploads_path(), DERIVED_DIR)
+        for size in SIZES:
+            for fmt in FORMATS:
+                try:
+                    os.remove(os.path.join(folder, derived_name(name, size, fmt)))
+                except OSError:
+                    pass
+
+
+def pick(accept: str, size: str) -> Tuple[str, str]:
+    """Normalize the requested size and choose WebP when the client accepts it."""
+    return (size if size in SIZES else "thumb"), ("webp" if "image/webp" in (accept or "") else "jpeg")
+
+
+thumbnailer = Thumbnailer()
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+from app.core.ratelimit import TokenBucket
+from app.core.settings import settings
+from app.db.aio import database
+from app.web.media import CHUNK_SIZE, media_store
+
+logger = logging.getLogger(__name__)
+
+API_BASE = "https://api.themoviedb.org/3"
+CACHE_DB = 'tmdb_cache.db'
+
+
+class _TTLCache:
+    """Bounded LRU of (fetched_at, value); entries older than ttl count as stale."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        item = self._data.get(key)
+        if item is not None:
+            self._data.move_to_end(key)
+        return item
+
+    def fresh(self, key: str) -> Optional[Any]:
+        item = self.get(key)
+        if item is not None and time.time() - item[0] < self.ttl:
+            return item[1]
+        return None
+
+    def put(self, key: str, value: Any, fetched_at: Optional[float] = None) -> None:
+        self._data[key] = (fetched_at or time.time(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+# --- on-disk cache (runs on database threads) ---
+def _install_cache(conn: sqlite3.Connection, max_age: float) -> None:
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS tmdb_cache(key TEXT PRIMARY KEY, body TEXT NOT NULL, fetched_at REAL NOT NULL)")
+        # Старые записи всё равно не используем — чистим при старте
+        conn.execute("DELETE FROM tmdb_cache WHERE fetched_at < ?", (time.time() - max_age,))
+
+
+def _disk_get(conn: sqlite3.Connection, key: str) -> Optional[Tuple[float, str]]:
+    row = conn.execute("SELECT fetched_at, body FROM tmdb_cache WHERE key = ?", (key,)).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def _disk_put(conn: sqlite3.Connection, key: str, body: str, fetched_at: float) -> None:
+    conn.execute(
+        "INSERT OR REPLACE INTO tmdb_cache(key, body, fetched_at) VALUES (?, ?, ?)", (key, body, fetched_at)
+    )
+
+
+class TMDbClient:
+    """Non-blocking TMDb client shared by the importers.
+
+    One aiohttp session (keep-alive pool) for every call; in-flight requests
+    are capped by a semaphore and paced by a token bucket so bulk imports stay
+    inside TMDb's rate quota.
+
+    JSON responses go through two cache tiers: a bounded in-memory LRU
+    (fresh for `ttl` seconds) and an SQLite table that survives restarts
+    (fresh for `disk_ttl`). Identical concurrent requests share one fetch,
+    and a stale copy is served if TMDb is unreachable.
+    """
+
+    RETRIES = 3
+
+    def __init__(self, concurrency: int = 8, rate: float = 40.0,
+                 cache_size: int = 512, ttl: float = 600, disk_ttl: float = 86400) -> None:
+        self._concurrency = max(1, int(concurrency))
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._bucket = TokenBucket(rate, capacity=max(1.0, rate / 2))
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._memory = _TTLCache(cache_size, ttl)
+        self._disk_ttl = disk_ttl
+        self._disk_ready = False
+        self._inflight: Dict[str, "asyncio.Future[Any]"] = {}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=20),
+                connector=aiohttp.TCPConnector(limit=self._concurrency * 2),
+            )
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._concurrency)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _fetch(self, url: str, params: Optional[dict] = None) -> bytes:
+        session = self._get_session()
+        last_error: Exception | None = None
+        for attempt in range(self.RETRIES):
+            await self._bucket.acquire()
+            try:
+                async with self._slots:
+                    async with session.get(url, params=params) as r:
+                        if r.status == 429:
+                            # TMDb подсказывает, сколько ждать
+                            delay = float(r.headers.get("Retry-After") or 1)
+                            last_error = RuntimeError("TMDb: превышен лимит запросов")
+                            await asyncio.sleep(delay)
+                            continue
+                        r.raise_for_status()
+                        return await r.read()
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500:
+                    raise RuntimeError(f"TMDb ошибка: {e.status} {e.message}")
+                last_error = e
+                await asyncio.sleep(0.5 * (attempt + 1))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                # backoff: 0.5s, 1s
+                await asyncio.sleep(0.5 * (attempt + 1))
+        raise RuntimeError(f"TMDb ошибка: {last_error}")
+
+    async def get_json(self, path: str, params: Optional[dict] = None) -> Any:
+        if not settings.TMDB_API_KEY:
+            raise RuntimeError("TMDB_API_KEY не задан в .env")
+        q = {"language": settings.TMDB_LANGUAGE}
+        if params:
+            q.update({k: str(v) for k, v in params.items()})
+        # Ключ кэша — без api_key
+        key = path + "?" + urllib.parse.urlencode(sorted(q.items()))
+        data = self._memory.fresh(key)
+        if data is not None:
+            return data
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._load(key, path, q))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(fut)
+
+    async def _load(self, key: str, path: str, q: dict) -> Any:
+        if not self._disk_ready:
+            try:
+                await database.write(_install_cache, self._disk_ttl, db_name=CACHE_DB)
+            except Exception:
+                pass
+            self._disk_ready = True
+        disk = None
+        try:
+            disk = await database.read(_disk_get, key, db_name=CACHE_DB)
+        except Exception:
+            pass
+        if disk is not None and time.time() - disk[0] < self._disk_ttl:
+            data = json.loads(disk[1])
+            self._memory.put(key, data)
+            return data
+        try:
+            body = (await self._fetch(f"{API_BASE}{path}", {**q, "api_key": settings.TMDB_API_KEY})).decode("utf-8")
+        except RuntimeError:
+            # Fallback to a stale copy if we have one
+            stale = self._memory.get(key)
+            if stale is not None:
+                return stale[1]
+            if disk is not None:
+                return json.loads(disk[1])
+            raise
+        try:
+            data = json.loads(body)
+        except ValueError:
+            raise RuntimeError(f"TMDb: некорректный ответ на {path}")
+        now = time.time()
+        self._memory.put(key, data, now)
+        try:
+            await database.write(_disk_put, key, body, now, db_name=CACHE_DB)
+        except Exception:
+            pass
+        return data
+
+    async def download_poster(self, movie_id: int, poster_path: Optional[str]) -> Optional[str]:
+        """Stream the w500 poster into the media store; return its file name or None."""
+        if not poster_path:
+            return None
+        try:
+            session = self._get_session()
+            await self._bucket.acquire()
+            async with self._slots:
+                async with session.get(f"{settings.TMDB_IMAGE_BASE}/w500{poster_path}") as r:
+                    r.raise_for_status()
+                    return await media_store.save_stream(r.content.iter_chunked(CHUNK_SIZE), "jpg")
+        except Exception:
+            # Фильм всё равно импортируется, но без постера — пусть это будет видно в логе
+            logger.exception("Не удалось скачать постер TMDb для фильма %s (%s)", movie_id, poster_path)
+            return None
+
+    async def fetch_movie(self, movie_id: int) -> dict:
+        """Details and downloaded poster of one film, in the shape insert_films expects."""
+        d = await self.get_json(f"/movie/{movie_id}")
+        return {
+            "movie_id": movie_id,
+            "name": d.get("title") or d.get("name") or "Без названия",
+            "description": d.get("overview") or "",
+            "genres": [g.get("name") for g in d.get("genres", []) if g.get("name")],
+            "site": d.get("homepage") or "",
+            "photo_id": await self.download_poster(movie_id, d.get("poster_path")),
+        }
+
+
+tmdb = TMDbClient(
+    concurrency=settings.TMDB_CONCURRENCY,
+    rate=settings.TMDB_RATE_LIMIT,
+    cache_size=settings.TMDB_CACHE_SIZE,
+    ttl=settings.TMDB_CACHE_TTL,
+    disk_ttl=settings.TMDB_DISK_CACHE_TTL,
+)
@@ -4,11 +4,12 @@ import uvicorn
 import socketio
 
 from aiogram import Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
 
 from app.core.settings import settings
 from app.bot.instance import bot
 from app.bot.core import router
+from app.bot.state import BoundedMemoryStorage
+from app.bot.webhook import UpdateQueue
 from app.web.app import create_app
 from app.web.sockets import sio
 
@@ -237,6 +238,8 @@ def check_and_stage_update():
             "backups",
             "films.db",
             "users.db",
+            "jobs.db",
+            "tmdb_cache.db",
         ]
         plan = {
             "zip": str(zip_path),
@@ -278,6 +281,8 @@ def check_and_stage_update():
             "backups",
             "films.db",
             "users.db",
+            "jobs.db",
+            "tmdb_cache.db",
         ]
         plan = {
             "dir": str(staging),
@@ -301,19 +306,21 @@ def run_updater_and_exit(plan: dict) -> None:
 
 
 def start_bot() -> Dispatcher:
-    dp = Dispatcher(storage=MemoryStorage())
+    dp = Dispatcher(storage=BoundedMemoryStorage(settings.CHAT_STATE_MAX, settings.CHAT_STATE_IDLE_TTL))
     dp.include_router(router)
     return dp
 
 
 async def run_bot(dp: Dispatcher):
-    # Запуск polling в отдельной задаче; корректно завершается по CancelledError
+    # Запуск polling в отдельной задаче; корректно завершается по CancelledError.
+    # Пока у бота установлен webhook (после BOT_MODE=webhook), getUpdates не отдаёт апдейтов — снимаем его
+    await bot.delete_webhook(drop_pending_updates=False)
     await dp.start_polling(bot)
 
 
-async def run_server():
+async def run_server(bot_updates: UpdateQueue | None = None):
     # Асинхронный запуск uvicorn без отдельного потока — корректно ловит SIGINT/SIGTERM
-    app = create_app()
+    app = create_app(bot_updates)
     asgi_app = socketio.ASGIApp(sio, other_asgi_app=app)
     host = settings.HOST
     port = settings.PORT
@@ -369,8 +376,15 @@ async def run_server():
 
 async def main_async():
     dp = start_bot()
-    server_task = asyncio.create_task(run_server(), name="uvicorn")
-    bot_task = asyncio.create_task(run_bot(dp), name="bot")
+    if settings.BOT_MODE == "webhook":
+        # Апдейты приходят POST-ом на тот же uvicorn; polling не запускаем
+        updates = UpdateQueue(dp, bot, settings.WEBHOOK_QUEUE_SIZE, settings.WEBHOOK_WORKERS)
+        tasks = {asyncio.create_task(run_server(updates), name="uvicorn")}
+    else:
+        tasks = {
+            asyncio.create_task(run_server(), name="uvicorn"),
+            asyncio.create_task(run_bot(dp), name="bot"),
+        }
 
     # Кроссплатформенное завершение по Ctrl+C и SIGTERM
     stop_event = asyncio.Event()
@@ -388,13 +402,13 @@ async def main_async():
 
     try:
         await asyncio.wait(
-            {server_task, bot_task, asyncio.create_task(stop_event.wait())},
+            {*tasks, asyncio.create_task(stop_event.wait())},
             return_when=asyncio.FIRST_COMPLETED,
         )
     except KeyboardInterrupt:
         pass
     finally:
-        for t in (server_task, bot_task):
+        for t in tasks:
             if not t.done():
                 t.cancel()
         # Закрываем HTTP-сессию бота
@@ -38,11 +38,14 @@
         case 'running': return 'Выполняется';
         case 'done': return 'Готово';
         case 'error': return 'Ошибка';
+        case 'cancelled': return 'Отменена';
         default: return String(s||'');
       }
     }
 
     function typeText(t){
+      if(t === 'poster_prewarm') return 'Прогрев постеров Telegram';
+      if(t === 'broadcast') return 'Рассылка';
       return t === 'tmdb_popular' ? 'Импорт популярных TMDb' : 'Импорт фильма TMDb';
     }
 
@@ -65,7 +68,10 @@
                 <div class="small" style="color:var(--muted);font-size:12px;">ID: <span class="jid"></span></div>
               </div>
             </div>
-            <div class="stat" style="font-size:12px;color:var(--muted);"><span class="status"></span></div>
+            <div class="stat" style="display:flex;align-items:center;gap:8px;font-size:12px;color:var(--muted);">
+              <span class="status"></span>
+              <button class="task-cancel" data-id="${job.id}" title="Отменить" style="display:none"><i class="ti ti-x"></i></button>
+            </div>
           </div>
           <div class="progress" style="height:8px;background:var(--border);border-radius:6px;overflow:hidden;">
             <div class="bar" style="height:100%;width:0%;background:var(--brand);transition:width .25s ease"></div>
@@ -86,6 +92,15 @@
         const fl = m.failed ?? 0;
         return `Добавлено: ${imp}/${req}${sk?`, пропущено: ${sk}`:''}${fl?`, ошибок: ${fl}`:''}`;
       }
+      if(job.type === 'poster_prewarm'){
+        const fl = m.failed ?? 0;
+        return `Загружено: ${m.uploaded ?? 0}/${m.total ?? ''}${fl?`, ошибок: ${fl}`:''}`;
+      }
+      if(job.type === 'broadcast'){
+        const fl = m.failed ?? 0;
+        const bl = m.blocked ?? 0;
+        return `Отправлено: ${m.sent ?? 0}/${m.total ?? ''}${bl?`, заблокировали бота: ${bl}`:''}${fl?`, ошибок: ${fl}`:''}`;
+      }
       if(job.type === 'tmdb_single'){
         if(m.duplicate) return 'Дубликат: уже существует';
         const code = m.code ? `, код: ${m.code}` : '';
@@ -102,33 +117,60 @@
       const meta = el.querySelector('.meta');
       if(typeEl) typeEl.textContent = typeText(job.type);
       if(jidEl) jidEl.textContent = job.id;
-      if(stEl) stEl.textContent = statusText(job.status);
+      if(stEl) stEl.textContent = statusText(job.status) + (job.cancel_requested && job.status === 'running' ? ' (отмена…)' : '');
+      const cancelBtn = el.querySelector('.task-cancel');
+      if(cancelBtn){
+        const active = (job.status === 'pending' || job.status === 'running') && !job.cancel_requested;
+        cancelBtn.style.display = active ? '' : 'none';
+      }
       const p = Math.max(0, Math.min(100, Number(job.progress||0)));
       if(bar){
         bar.style.width = p + '%';
         if(job.status === 'done'){ bar.style.background = 'var(--ok)'; }
-        else if(job.status === 'error'){ bar.style.background = 'var(--err)'; }
+        else if(job.status === 'error' || job.status === 'cancelled'){ bar.style.background = 'var(--err)'; }
         else { bar.style.background = 'var(--brand)'; }
       }
       if(meta) meta.textContent = metaText(job);
     }
 
+    function paintQueue(q){
+      const el = document.getElementById('taskQueueInfo');
+      if(!el || !q) return;
+      el.textContent = `В очереди: ${q.queued ?? 0} · обработчики: ${q.busy ?? 0}/${q.workers ?? 0}`;
+    }
+
     function upsert(job){
       if(!job || !job.id) return;
       items.set(job.id, job);
       const el = ensureEl(job);
       if(el) paint(el, job);
+      if(job.queue) paintQueue(job.queue);
     }
 
     async function fetchAll(){
       try{
         const r = await fetch('/api/tasks');
         if(!r.ok) return;
-        const list = await r.json();
-        (list||[]).forEach(upsert);
+        const j = await r.json();
+        // старый формат — просто массив задач
+        const list = Array.isArray(j) ? j : (j.jobs||[]);
+        list.slice().reverse().forEach(upsert);
+        paintQueue(j.queue);
       }catch(_){/* noop */}
     }
 
+    async function cancel(id){
+      try{
+        const r = await fetch(`/api/tasks/${encodeURIComponent(id)}/cancel`, { method: 'POST' });
+        const j = await r.json();
+        if(!r.ok) toast(j.error || j.detail || 'Не удалось отменить задачу','error');
+      }catch(_){ toast('Ошибка сети','error'); }
+    }
+    document.addEventListener('click', (e)=>{
+      const b = e.target.closest('.task-cancel');
+      if(b){ b.disabled = true; cancel(b.dataset.id); }
+    });
+
     function seed(job_id, type){
       upsert({ id: job_id, type, status: 'pending', progress: 0, meta: {} });
     }
@@ -209,6 +251,47 @@
       }catch(err){ toast('Ошибка сети','error'); }
       finally{ popularBtn.disabled = false; }
     });
+    const prewarmBtn = document.getElementById('posterPrewarmBtn');
+    prewarmBtn?.addEventListener('click', async (e)=>{
+      e.preventDefault();
+      try{
+        prewarmBtn.disabled = true;
+        const r = await fetch('/api/tasks/posters/prewarm', { method: 'POST' });
+        const j = await r.json();
+        if(r.ok && j && j.job_id){
+          Tasks.seed(j.job_id, 'poster_prewarm');
+          toast('Задача поставлена в очередь','info');
+        } else {
+          toast(j.error || j.detail || 'Ошибка постановки задачи','error');
+        }
+      }catch(err){ toast('Ошибка сети','error'); }
+      finally{ prewarmBtn.disabled = false; }
+    });
+    const broadcastBtn = document.getElementById('broadcastBtn');
+    broadcastBtn?.addEventListener('click', async (e)=>{
+      e.preventDefault();
+      const textEl = document.getElementById('broadcastText');
+      const filmEl = document.getElementById('broadcastFilm');
+      const text = (textEl?.value || '').trim();
+      if(!text){ toast('Введите текст рассылки','warning'); return; }
+      if(!confirm('Отправить сообщение всем пользователям бота?')) return;
+      try{
+        broadcastBtn.disabled = true;
+        const fd = new FormData();
+        fd.append('text', text);
+        fd.append('film', (filmEl?.value || '').trim());
+        const r = await fetch('/api/tasks/broadcast', { method: 'POST', body: fd });
+        const j = await r.json();
+        if(r.ok && j && j.job_id){
+          Tasks.seed(j.job_id, 'broadcast');
+          toast('Рассылка поставлена в очередь','info');
+          if(textEl) textEl.value = '';
+        } else {
+          toast(j.error || j.detail || 'Ошибка постановки задачи','error');
+        }
+      }catch(err){ toast('Ошибка сети','error'); }
+      finally{ broadcastBtn.disabled = false; }
+    });
   }
 
   function bindThemeToggle(){
@@ -382,26 +465,14 @@
     });
   }
 
-  function socketInit(){
-    if(!window.io){ console.warn('Socket.IO не найден'); return; }
-    const socket = io('/', { path: '/socket.io' });
-    const filmTbody = $('#filmList tbody');
-    const userTbody = $('#userList tbody');
-    const editModal = $('#editFilmModal');
-    const editFormEl = $('#editFilmForm');
-    const editCloseBtn = editModal?.querySelector('.close');
-    // закрытие модалки по крестику и по клику на фон
-    editCloseBtn?.addEventListener('click', ()=>{ if(editModal){ editModal.classList.remove('is-open'); document.body.style.overflow=''; } });
-    editModal?.addEventListener('click', (e)=>{ if(e.target === editModal){ editModal.classList.remove('is-open'); document.body.style.overflow=''; } });
-
-    function renderFilms(items){
-      if(!filmTbody) return;
-      filmTbody.innerHTML = (items||[]).map(f=>{
-        const idCell = (f.code || (f.id!=null? f.id.toString().padStart(5,'0') : ''));
-        const siteCell = f.site ? `<a href="${f.site}" target="_blank">ссылка</a>` : '';
-        const imgCell = f.photo_id ? `<span class="badge">img</span>` : '';
-        return `
-          <tr>
+  // Строки таблиц фильмов и пользователей (снимок, дельты и поиск рисуют одинаково)
+  function filmRowHtml(f){
+    const idCell = (f.code || (f.id!=null? f.id.toString().padStart(5,'0') : ''));
+    const siteCell = f.site ? `<a href="${f.site}" target="_blank">ссылка</a>` : '';
+    // Миниатюра (~96px, WebP если браузер умеет) вместо полноразмерного постера
+    const imgCell = f.photo_id ? `<img src="/media/${encodeURIComponent(f.photo_id)}?size=thumb" alt="" loading="lazy" decoding="async" style="height:48px;border-radius:6px;"/>` : '';
+    return `
+          <tr data-id="${f.id}">
             <td>${idCell}</td>
             <td>${f.name||''}</td>
             <td>${f.genre||''}</td>
@@ -412,12 +483,10 @@
               <button class="row-delete" data-id="${f.id}"><i class="ti ti-trash"></i></button>
             </td>
           </tr>`;
-      }).join('');
-    }
-    function renderUsers(items){
-      if(!userTbody) return;
-      userTbody.innerHTML = (items||[]).map(u=>`
-        <tr>
+  }
+  function userRowHtml(u){
+    return `
+        <tr data-id="${u.id}">
           <td>${u.id}</td>
           <td>${u.name||''}</td>
           <td>${u.tg_id||''}</td>
@@ -428,23 +497,94 @@
               <i class="ti ${u.banned?'ti-user-check':'ti-user-cancel'}"></i>
             </button>
           </td>
-        </tr>
-      `).join('');
+        </tr>`;
+  }
+
+  // Живые таблицы (films, users) из socketInit; поиск фильмов переключает таблицу между ними и своей выдачей
+  const feeds = {};
+
+  function socketInit(){
+    if(!window.io){ console.warn('Socket.IO не найден'); return; }
+    const socket = io('/', { path: '/socket.io' });
+    const filmTbody = $('#filmList tbody');
+    const userTbody = $('#userList tbody');
+    const editModal = $('#editFilmModal');
+    const editFormEl = $('#editFilmForm');
+    const editCloseBtn = editModal?.querySelector('.close');
+    // закрытие модалки по крестику и по клику на фон
+    editCloseBtn?.addEventListener('click', ()=>{ if(editModal){ editModal.classList.remove('is-open'); document.body.style.overflow=''; } });
+    editModal?.addEventListener('click', (e)=>{ if(e.target === editModal){ editModal.classList.remove('is-open'); document.body.style.overflow=''; } });
+
+    // Таблица, синхронизируемая через change feed: первая страница снимка, затем дельты по строкам;
+    // следующие страницы — только по кнопке «Показать ещё», а не всей таблицей при каждом заходе
+    function feedTable(name, tbody, rowHtml, canInsert){
+      let version = -1, loading = true, nextCursor = null;
+      const rowEl = (id)=> tbody.querySelector(`tr[data-id="${id}"]`);
+      const more = document.createElement('div');
+      more.className = 'pagination';
+      (tbody.closest('.table-container') || tbody.parentElement).after(more);
+      function paintMore(){
+        more.innerHTML = nextCursor && canInsert() ? '<button type="button" class="load-more">Показать ещё</button>' : '';
+      }
+      function put(item, append){
+        const old = rowEl(item.id);
+        if(!old && !append){
+          if(!canInsert()) return;
+          // строки ниже загруженной страницы придут вместе с ней
+          if(nextCursor && item.id < nextCursor) return;
+        }
+        const tmp = document.createElement('tbody');
+        tmp.innerHTML = rowHtml(item).trim();
+        const tr = tmp.firstElementChild;
+        if(old){ old.replaceWith(tr); return; }
+        if(append){ tbody.appendChild(tr); return; }
+        // сохраняем порядок id DESC
+        const next = Array.from(tbody.children).find(r=>Number(r.dataset.id) < item.id);
+        tbody.insertBefore(tr, next || null);
+      }
+      function resync(force){
+        if(loading && !force) return;
+        loading = true;
+        socket.emit(`get_${name}`);
+      }
+      more.addEventListener('click', (e)=>{
+        if(!e.target.closest('.load-more') || loading || !nextCursor) return;
+        loading = true;
+        socket.emit(`get_${name}`, { cursor: nextCursor });
+      });
+      socket.on(`${name}_snapshot`, (p)=>{
+        if(!p.cursor){ tbody.innerHTML = ''; version = p.version; }
+        (p.rows||[]).forEach(item=>put(item, true));
+        nextCursor = p.next_cursor;
+        loading = false;
+        paintMore();
+      });
+      socket.on(`${name}_delta`, (d)=>{
+        if(d.version <= version) return;
+        if(d.version !== version + 1){ resync(false); return; } // пропустили дельту — перечитываем
+        version = d.version;
+        if(d.op === 'upsert') (d.rows||[]).forEach(item=>put(item, false));
+        else if(d.op === 'delete') (d.ids||[]).forEach(id=>rowEl(id)?.remove());
+        // статистика дешёвая (агрегаты на сервере), но перерисовываем её только когда раздел открыт
+        if($('#statsSection')?.classList.contains('active')) Stats.load();
+      });
+      // Таблицу заняли результаты поиска — прячем свою кнопку; вернуть живую таблицу — reset()
+      return { reset: ()=>resync(true), hide: ()=>{ more.innerHTML = ''; } };
     }
 
     socket.on('connect', ()=>console.log('Socket.IO connected'));
     socket.on('connect_error', (err)=>console.warn('Socket.IO connect_error', err?.message||err));
-    socket.on('update_films', (items)=>{ renderFilms(items); Stats.load(); });
-    socket.on('films', renderFilms);
-    socket.on('update_users', (items)=>{ renderUsers(items); Stats.load(); });
-    socket.on('users', renderUsers);
+    // Новые строки не вставляем, пока в таблице показан результат поиска
+    const unfiltered = ()=>{
+      const q = $('#searchFilm')?.value, g = $('#filterGenre')?.value;
+      return !q && (!g || g === 'all');
+    };
+    if(filmTbody) feeds.films = feedTable('films', filmTbody, filmRowHtml, unfiltered);
+    if(userTbody) feeds.users = feedTable('users', userTbody, userRowHtml, ()=>true);
     socket.on('notification', (p)=> toast(p?.message || 'Событие', p?.type || 'info'));
     // bind background tasks channel
     Tasks.bindSocket(socket);
 
-    socket.emit('get_films');
-    socket.emit('get_users');
-
     document.addEventListener('click', async (e)=>{
       const t = e.target.closest('button');
       if(!t) return;
@@ -505,7 +645,7 @@
           if(p){
             p.innerHTML = '';
             if(f.photo_id){
-              p.innerHTML = `<img src="/static/uploads/${f.photo_id}" alt="${f.name||''}" style="max-width:100%;border-radius:10px;"/>`;
+              p.innerHTML = `<img src="/media/${encodeURIComponent(f.photo_id)}?size=card" alt="${f.name||''}" style="max-width:100%;border-radius:10px;"/>`;
             }
           }
           if(editModal){ editModal.classList.add('is-open'); document.body.style.overflow='hidden'; }
@@ -602,33 +742,38 @@
   function filters(){
     const q = document.getElementById('searchFilm');
     const g = document.getElementById('filterGenre');
-    async function run(){
+    const pager = document.getElementById('pagination');
+    let cursor = null, seq = 0;
+    // Сервер отдаёт страницы по курсору (id последней строки); «Показать ещё» дозагружает следующую
+    async function run(append){
+      const my = ++seq;
+      if(!append && !q?.value && !(g?.value && g.value !== 'all') && feeds.films){
+        // Фильтры сброшены — возвращаем живую таблицу со своей постраничной загрузкой
+        cursor = null;
+        if(pager) pager.innerHTML = '';
+        feeds.films.reset();
+        return;
+      }
+      feeds.films?.hide();
       const params = new URLSearchParams();
       if(q?.value) params.set('query', q.value);
       if(g?.value && g.value !== 'all') params.set('genre', g.value);
+      if(append && cursor) params.set('cursor', cursor);
       const r = await fetch('/api/films/search?'+params.toString());
       const j = await r.json();
+      if(my !== seq) return; // пришёл ответ на устаревший запрос
       const tbody = document.querySelector('#filmList tbody');
-      tbody.innerHTML = (j||[]).map(f=>{
-        const idCell = (f.code || (f.id!=null? f.id.toString().padStart(5,'0') : ''));
-        const siteCell = f.site ? `<a href="${f.site}" target="_blank">ссылка</a>` : '';
-        const imgCell = f.photo_id ? `<span class="badge">img</span>` : '';
-        return `
-          <tr>
-            <td>${idCell}</td>
-            <td>${f.name||''}</td>
-            <td>${f.genre||''}</td>
-            <td>${siteCell}</td>
-            <td>${imgCell}</td>
-            <td>
-              <button class="row-edit" data-id="${f.id}"><i class="ti ti-edit"></i></button>
-              <button class="row-delete" data-id="${f.id}"><i class="ti ti-trash"></i></button>
-            </td>
-          </tr>`;
-      }).join('');
+      const html = (j.items||[]).map(filmRowHtml).join('');
+      if(append) tbody.insertAdjacentHTML('beforeend', html);
+      else tbody.innerHTML = html;
+      cursor = j.next_cursor;
+      if(pager){
+        pager.innerHTML = cursor ? '<button type="button" class="load-more">Показать ещё</button>' : '';
+      }
     }
-    q?.addEventListener('input', ()=>{ clearTimeout(q._t); q._t=setTimeout(run, 250); });
-    g?.addEventListener('change', run);
+    pager?.addEventListener('click', (e)=>{ if(e.target.closest('.load-more')) run(true); });
+    q?.addEventListener('input', ()=>{ clearTimeout(q._t); q._t=setTimeout(()=>run(false), 250); });
+    g?.addEventListener('change', ()=>run(false));
   }
 
   // ==================== Enhanced Genre Multi-Select (Dropdown) ====================